@@ -15,3 +15,23 @@ def get_generated_dbcs() -> dict[str, str]:
     from opendbc.dbc.generator.generator import generate_all
     _generated_dbc_cache = generate_all()
   return _generated_dbc_cache
+
+
+def get_generated_dbc(name: str) -> str | None:
+  """Generate a single *_generated DBC, without generating all the others.
+  Returns None if name isn't a generated DBC."""
+  if _generated_dbc_cache is not None:
+    return _generated_dbc_cache.get(name)
+  if not name.endswith("_generated"):
+    return None
+  from opendbc.dbc.generator.generator import generate_dbc
+  return generate_dbc(name)
+
+
+def get_generated_dbc_hash(name: str) -> str | None:
+  """Hash of the files a *_generated DBC is generated from, which is much cheaper than generating it.
+  Returns None if name isn't a generated DBC."""
+  if not name.endswith("_generated"):
+    return None
+  from opendbc.dbc.generator.generator import sources_hash
+  return sources_hash(name)
@@ -1,8 +1,9 @@
 from opendbc.can.packer import CANPacker
-from opendbc.can.parser import CANParser, CANDefine
+from opendbc.can.parser import CANParser, CANDefine, CANDispatcher
 
 __all__ = [
   "CANDefine",
+  "CANDispatcher",
   "CANParser",
   "CANPacker",
 ]
@@ -0,0 +1,163 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from opendbc.can.dbc import Msg, Signal, SignalType
+from opendbc.can.checksums import NIBBLE_SUMS, address_byte_sum, effective_type, get_checksum_function, honda_seed, xor_seed
+from opendbc.can.parser import get_raw_value
+from opendbc.car.chrysler.chryslercan import FCA_GIORGIO_CHECKSUM_XOR
+from opendbc.car.crc import CRC8BODY, CRC8H2F, CRC8J1850, CRC16_XMODEM
+from opendbc.car.hyundai.hyundaicanfd import HKG_CAN_FD_CHECKSUM_XOR
+from opendbc.car.volkswagen.mqbcan import VOLKSWAGEN_MQB_MEB_CONSTANTS
+
+_NIBBLE_SUMS = np.array(NIBBLE_SUMS, dtype=np.int64)
+_CRC8H2F = np.array(CRC8H2F, dtype=np.int64)
+_CRC8J1850 = np.array(CRC8J1850, dtype=np.int64)
+_CRC8BODY = np.array(CRC8BODY, dtype=np.int64)
+_CRC16_XMODEM = np.array(CRC16_XMODEM, dtype=np.int64)
+
+
+@dataclass
+class DecodedMessage:
+  """Columnar decode of every frame of one message. All arrays are indexed by frame."""
+  address: int
+  name: str
+  nanos: np.ndarray
+  values: dict[str, np.ndarray] = field(default_factory=dict)
+  checksum_valid: np.ndarray = field(default_factory=lambda: np.ones(0, dtype=bool))
+  # frame's counter is the previous frame's counter + 1
+  counter_valid: np.ndarray = field(default_factory=lambda: np.ones(0, dtype=bool))
+
+  @property
+  def valid(self) -> np.ndarray:
+    return self.checksum_valid & self.counter_valid
+
+
+def get_raw_values(payloads: np.ndarray, sig: Signal) -> np.ndarray:
+  """Vectorized get_raw_value over a (frames, bytes) uint8 matrix, sign-extended. Returns int64 (uint64 for wide unsigned)."""
+  lo, hi = sorted((sig.lsb // 8, sig.msb // 8))
+  if hi >= payloads.shape[1] or hi - lo >= 8:
+    # doesn't fit in a uint64 word or in the payload, fall back to walking each frame
+    raw = np.array([get_raw_value(bytes(row), sig) for row in payloads], dtype=object)
+    if sig.is_signed:
+      raw = raw - ((raw >> (sig.size - 1)) & 1) * (1 << sig.size)
+    return raw.astype(np.int64 if sig.is_signed or sig.size < 64 else np.uint64)
+
+  word = np.zeros(len(payloads), dtype=np.uint64)
+  for i in range(lo, hi + 1):
+    byte_shift = (i - lo) if sig.is_little_endian else (hi - i)
+    word |= payloads[:, i].astype(np.uint64) << np.uint64(8 * byte_shift)
+  raw = (word >> np.uint64(sig.lsb % 8)) & np.uint64((1 << sig.size) - 1)
+
+  if sig.size == 64:
+    return raw.view(np.int64) if sig.is_signed else raw
+  raw = raw.astype(np.int64)
+  if sig.is_signed:
+    raw -= ((raw >> (sig.size - 1)) & 1) << sig.size
+  return raw
+
+
+# ***** vectorized checksums *****
+# each takes the message's (frames, msg.size) uint8 payload matrix and works a column at a time, like
+# get_checksum_function does a byte at a time
+
+def _crc8(table: np.ndarray, crc: int, columns: np.ndarray) -> np.ndarray:
+  ret = np.full(columns.shape[1], crc, dtype=np.int64)
+  for col in columns:
+    ret = table[ret ^ col]
+  return ret
+
+
+def _honda_checksums(address: int, sig: Signal, d: np.ndarray) -> np.ndarray:
+  return (honda_seed(address) - _NIBBLE_SUMS[d[:, :-1]].sum(axis=1) - (d[:, -1] >> 4)) & 0xF
+
+
+def _toyota_checksums(address: int, sig: Signal, d: np.ndarray) -> np.ndarray:
+  return (address_byte_sum(address) + d.shape[1] + d[:, :-1].sum(axis=1, dtype=np.int64)) & 0xFF
+
+
+def _subaru_checksums(address: int, sig: Signal, d: np.ndarray) -> np.ndarray:
+  return (address_byte_sum(address) + d[:, 1:].sum(axis=1, dtype=np.int64)) & 0xFF
+
+
+def _tesla_checksums(address: int, sig: Signal, d: np.ndarray) -> np.ndarray:
+  seed = (address & 0xFF) + ((address >> 8) & 0xFF)
+  return (seed + d.sum(axis=1, dtype=np.int64) - d[:, sig.start_bit // 8]) & 0xFF
+
+
+def _xor_checksums(address: int, sig: Signal, d: np.ndarray) -> np.ndarray:
+  return (np.bitwise_xor.reduce(d, axis=1) ^ d[:, sig.start_bit // 8]).astype(np.int64) ^ xor_seed(address, sig)
+
+
+def _volkswagen_mqb_meb_checksums(address: int, sig: Signal, d: np.ndarray) -> np.ndarray:
+  crc = _crc8(_CRC8H2F, 0xFF, d.T[1:])
+  const = VOLKSWAGEN_MQB_MEB_CONSTANTS.get(address)
+  if const:
+    crc = _CRC8H2F[crc ^ np.array(const, dtype=np.int64)[d[:, 1] & 0x0F]]
+  return crc ^ 0xFF
+
+
+def _body_checksums(address: int, sig: Signal, d: np.ndarray) -> np.ndarray:
+  return _crc8(_CRC8BODY, 0xFF, d.T[-2::-1])
+
+
+def _chrysler_checksums(address: int, sig: Signal, d: np.ndarray) -> np.ndarray:
+  return _crc8(_CRC8J1850, 0xFF, d.T[:-1]) ^ 0xFF
+
+
+def _fca_giorgio_checksums(address: int, sig: Signal, d: np.ndarray) -> np.ndarray:
+  return _crc8(_CRC8J1850, 0, d.T[:-1]) ^ FCA_GIORGIO_CHECKSUM_XOR.get(address, 0x0A)
+
+
+def _hkg_can_fd_checksums(address: int, sig: Signal, d: np.ndarray) -> np.ndarray:
+  crc = np.zeros(len(d), dtype=np.int64)
+  for col in [*d.T[2:], address & 0xFF, (address >> 8) & 0xFF]:
+    crc = ((crc << 8) ^ _CRC16_XMODEM[(crc >> 8) ^ col]) & 0xFFFF
+  return crc ^ HKG_CAN_FD_CHECKSUM_XOR.get(d.shape[1], 0)
+
+
+VECTORIZED_CHECKSUMS = {
+  SignalType.HONDA_CHECKSUM: _honda_checksums,
+  SignalType.TOYOTA_CHECKSUM: _toyota_checksums,
+  SignalType.SUBARU_CHECKSUM: _subaru_checksums,
+  SignalType.TESLA_CHECKSUM: _tesla_checksums,
+  SignalType.XOR_CHECKSUM: _xor_checksums,
+  SignalType.VOLKSWAGEN_MQB_MEB_CHECKSUM: _volkswagen_mqb_meb_checksums,
+  SignalType.BODY_CHECKSUM: _body_checksums,
+  SignalType.CHRYSLER_CHECKSUM: _chrysler_checksums,
+  SignalType.FCA_GIORGIO_CHECKSUM: _fca_giorgio_checksums,
+  SignalType.HKG_CAN_FD_CHECKSUM: _hkg_can_fd_checksums,
+}
+
+
+def calc_checksums(address: int, sig: Signal, payloads: np.ndarray) -> np.ndarray:
+  """sig's checksum of each row of a (frames, bytes) uint8 matrix"""
+  sig_type = effective_type(address, sig)
+  if sig_type in VECTORIZED_CHECKSUMS:
+    return VECTORIZED_CHECKSUMS[sig_type](address, sig, payloads).astype(np.int64)
+  # PSA, per frame
+  checksum = get_checksum_function(address, sig, payloads.shape[1])
+  return np.array([checksum(row.tobytes()) for row in payloads], dtype=np.int64)
+
+
+def decode_message(msg: Msg, nanos: np.ndarray, payloads: np.ndarray,
+                   ignore_checksum: bool = False, ignore_counter: bool = False) -> DecodedMessage:
+  """Decode every frame of msg. payloads is a (frames, bytes) uint8 matrix, zero-padded to at least msg.size."""
+  d = np.zeros((len(payloads), msg.size), dtype=np.uint8)
+  width = min(msg.size, payloads.shape[1])
+  d[:, :width] = payloads[:, :width]
+  ret = DecodedMessage(msg.address, msg.name, nanos, checksum_valid=np.ones(len(d), dtype=bool),
+                       counter_valid=np.ones(len(d), dtype=bool))
+
+  for sig in msg.sigs.values():
+    raw = get_raw_values(d, sig)
+
+    if not ignore_checksum and sig.calc_checksum is not None:
+      ret.checksum_valid &= raw == calc_checksums(msg.address, sig, d)
+
+    if not ignore_counter and sig.type == SignalType.COUNTER and len(raw) > 1:
+      expected = (raw[:-1] + 1) & ((1 << sig.size) - 1)
+      ret.counter_valid[1:] &= raw[1:] == expected
+
+    ret.values[sig.name] = raw.astype(np.float64) * sig.factor + sig.offset
+  return ret
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""Build the compiled CAN-FD checksums (checksums.c) that CANParser and CANPacker use when present."""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+from opendbc.can.checksums import CHECKSUMS_C, get_library_path
+
+
+def build_library(lib_path: str | None = None) -> str:
+  """Compile checksums.c, by default to where load_compiled() finds it. Returns the library path."""
+  lib_path = lib_path or get_library_path()
+  os.makedirs(os.path.dirname(lib_path), exist_ok=True)
+  fd, tmp_path = tempfile.mkstemp(suffix=".so", dir=os.path.dirname(lib_path))
+  os.close(fd)
+  try:
+    subprocess.check_call(["cc", "-O2", "-fPIC", "-shared", "-std=gnu11", CHECKSUMS_C, "-o", tmp_path])
+    os.replace(tmp_path, lib_path)
+  finally:
+    if os.path.exists(tmp_path):
+      os.unlink(tmp_path)
+  return lib_path
+
+
+def main(argv: list[str] | None = None) -> int:
+  parser = argparse.ArgumentParser(description="Build the compiled CAN-FD checksums used by CANParser and CANPacker")
+  parser.parse_args(argv)
+  print(build_library())
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,128 @@
+// Optional compiled CRCs for CAN-FD payloads, see opendbc/can/checksums.py. Built with
+// `python -m opendbc.can.build_checksums`. test_checksums.py builds its own copy and checks it against Signal.calc_checksum.
+// Per-address values (final XORs, VW counter constants) are computed in Python once per message.
+
+#include <stdint.h>
+
+// keep in sync with SignalType in opendbc/can/dbc.py
+#define BODY_CHECKSUM 4
+#define VOLKSWAGEN_MQB_MEB_CHECKSUM 5
+#define CHRYSLER_CHECKSUM 8
+#define HKG_CAN_FD_CHECKSUM 9
+#define FCA_GIORGIO_CHECKSUM 10
+
+static uint8_t crc8_lut_h2f[256];
+static uint8_t crc8_lut_j1850[256];
+static uint8_t crc8_lut_body[256];
+static uint16_t crc16_lut_xmodem[256];
+static int luts_ready = 0;
+
+static void gen_crc8_lut(uint8_t poly, uint8_t *lut) {
+  for (int i = 0; i < 256; i++) {
+    uint8_t crc = (uint8_t)i;
+    for (int j = 0; j < 8; j++) {
+      crc = (crc & 0x80U) ? (uint8_t)((crc << 1) ^ poly) : (uint8_t)(crc << 1);
+    }
+    lut[i] = crc;
+  }
+}
+
+static void gen_crc16_lut(uint16_t poly, uint16_t *lut) {
+  for (int i = 0; i < 256; i++) {
+    uint16_t crc = (uint16_t)(i << 8);
+    for (int j = 0; j < 8; j++) {
+      crc = (crc & 0x8000U) ? (uint16_t)((crc << 1) ^ poly) : (uint16_t)(crc << 1);
+    }
+    lut[i] = crc;
+  }
+}
+
+void checksums_init(void) {
+  if (!luts_ready) {
+    gen_crc8_lut(0x2F, crc8_lut_h2f);
+    gen_crc8_lut(0x1D, crc8_lut_j1850);
+    gen_crc8_lut(0xD5, crc8_lut_body);
+    gen_crc16_lut(0x1021, crc16_lut_xmodem);
+    luts_ready = 1;
+  }
+}
+
+static uint32_t chrysler(const uint8_t *dat, int len) {
+  uint8_t checksum = 0xFF;
+  for (int j = 0; j < (len - 1); j++) {
+    uint8_t curr = dat[j];
+    uint8_t shift = 0x80;
+    for (int i = 0; i < 8; i++) {
+      uint8_t bit_sum = curr & shift;
+      uint8_t temp_chk = checksum & 0x80U;
+      if (bit_sum != 0U) {
+        bit_sum = 0x1C;
+        if (temp_chk != 0U) {
+          bit_sum = 1;
+        }
+        checksum = (uint8_t)(checksum << 1);
+        temp_chk = checksum | 1U;
+        bit_sum ^= temp_chk;
+      } else {
+        if (temp_chk != 0U) {
+          bit_sum = 0x1D;
+        }
+        checksum = (uint8_t)(checksum << 1);
+        bit_sum ^= checksum;
+      }
+      checksum = bit_sum;
+      shift = shift >> 1;
+    }
+  }
+  return (uint8_t)~checksum;
+}
+
+// seed: the address for HKG's CRC, extra: final XOR, consts: VW per-counter constants
+uint32_t checksum(int type, uint32_t seed, uint32_t extra, const uint8_t *consts, const uint8_t *dat, int len) {
+  uint32_t ret = 0;
+  switch (type) {
+    case BODY_CHECKSUM: {
+      uint8_t crc = 0xFF;
+      for (int i = len - 2; i >= 0; i--) {
+        crc = crc8_lut_body[crc ^ dat[i]];
+      }
+      ret = crc;
+      break;
+    }
+    case VOLKSWAGEN_MQB_MEB_CHECKSUM: {
+      uint8_t crc = 0xFF;
+      for (int i = 1; i < len; i++) {
+        crc = crc8_lut_h2f[crc ^ dat[i]];
+      }
+      if ((consts != 0) && (len > 1)) {
+        crc = crc8_lut_h2f[crc ^ consts[dat[1] & 0x0FU]];
+      }
+      ret = crc ^ 0xFFU;
+      break;
+    }
+    case CHRYSLER_CHECKSUM:
+      ret = chrysler(dat, len);
+      break;
+    case FCA_GIORGIO_CHECKSUM: {
+      uint8_t crc = 0;
+      for (int i = 0; i < (len - 1); i++) {
+        crc = crc8_lut_j1850[crc ^ dat[i]];
+      }
+      ret = crc ^ extra;
+      break;
+    }
+    case HKG_CAN_FD_CHECKSUM: {
+      uint16_t crc = 0;
+      for (int i = 2; i < len; i++) {
+        crc = (uint16_t)(crc << 8) ^ crc16_lut_xmodem[(crc >> 8) ^ dat[i]];
+      }
+      crc = (uint16_t)(crc << 8) ^ crc16_lut_xmodem[(crc >> 8) ^ (seed & 0xFFU)];
+      crc = (uint16_t)(crc << 8) ^ crc16_lut_xmodem[(crc >> 8) ^ ((seed >> 8) & 0xFFU)];
+      ret = crc ^ extra;
+      break;
+    }
+    default:
+      break;
+  }
+  return ret;
+}
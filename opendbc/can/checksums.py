@@ -0,0 +1,224 @@
+"""Checksums used by CANParser and CANPacker.
+
+Signal.calc_checksum is the reference definition of each checksum. get_checksum_function(address, sig, size)
+binds an equivalent to one message, with its per-address seeds (address nibble and byte sums, final XORs,
+VW counter constants) computed once, and returns a function of just the payload. Payloads are read without
+copying, only PSA's checksum, which masks its own nibble in the payload, gets a copy.
+
+CRCs over CAN-FD payloads can use a compiled C implementation instead (checksums.c, loaded with cffi
+like libsafety). It's opt-in: build it with `python -m opendbc.can.build_checksums`, nothing is compiled at
+runtime. Set DISABLE_CHECKSUM_ACCEL=1 to ignore a built library.
+"""
+import hashlib
+import os
+from collections.abc import Callable
+from functools import cache, reduce
+from operator import xor
+
+from opendbc.can.dbc import Signal, SignalType
+from opendbc.car.chrysler.chryslercan import FCA_GIORGIO_CHECKSUM_XOR
+from opendbc.car.crc import CRC8BODY, CRC8H2F, CRC8J1850, CRC16_XMODEM
+from opendbc.car.hyundai.hyundaicanfd import HKG_CAN_FD_CHECKSUM_XOR
+from opendbc.car.volkswagen.mlbcan import VOLKSWAGEN_MLB_XOR_STARTING_VALUES
+from opendbc.car.volkswagen.mqbcan import VOLKSWAGEN_MQB_MEB_CONSTANTS
+
+ChecksumFunction = Callable[[bytes | bytearray | memoryview], int]
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+CHECKSUMS_C = os.path.join(BASEDIR, "checksums.c")
+
+# the ~1us cffi call overhead is only worth it for table-driven CRCs over CAN-FD sized payloads
+COMPILED_MIN_SIZE = 16
+COMPILED_TYPES = {
+  SignalType.BODY_CHECKSUM,
+  SignalType.VOLKSWAGEN_MQB_MEB_CHECKSUM,
+  SignalType.CHRYSLER_CHECKSUM,
+  SignalType.FCA_GIORGIO_CHECKSUM,
+  SignalType.HKG_CAN_FD_CHECKSUM,
+}
+
+
+# ***** compiled *****
+
+def get_library_path() -> str:
+  """Path of the compiled checksums, keyed by the source hash so a stale build is never loaded"""
+  with open(CHECKSUMS_C, "rb") as f:
+    src_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+  return os.path.join(BASEDIR, "build", f"checksums_{src_hash}.so")
+
+
+def load_library(lib_path: str):
+  """Returns (ffi, lib) for a compiled checksums library"""
+  from cffi import FFI
+
+  ffi = FFI()
+  # dat is declared as char * so bytes are passed without copying
+  ffi.cdef("""
+  void checksums_init(void);
+  uint32_t checksum(int type, uint32_t seed, uint32_t extra, const uint8_t *consts, const char *dat, int len);
+  """)
+  lib = ffi.dlopen(lib_path)
+  lib.checksums_init()
+  return ffi, lib
+
+
+@cache
+def load_compiled():
+  """Returns (ffi, lib) for the compiled checksums, or None if they weren't built or are disabled."""
+  lib_path = get_library_path()
+  if os.environ.get("DISABLE_CHECKSUM_ACCEL") == "1" or not os.path.exists(lib_path):
+    return None
+  return load_library(lib_path)
+
+
+def _compiled_checksum(address: int, sig_type: int, ffi, lib) -> ChecksumFunction:
+  checksum = lib.checksum
+  consts = ffi.NULL
+  if sig_type == SignalType.VOLKSWAGEN_MQB_MEB_CHECKSUM and address in VOLKSWAGEN_MQB_MEB_CONSTANTS:
+    consts = ffi.new("uint8_t[16]", VOLKSWAGEN_MQB_MEB_CONSTANTS[address])
+  elif sig_type == SignalType.FCA_GIORGIO_CHECKSUM:
+    extra = FCA_GIORGIO_CHECKSUM_XOR.get(address, 0x0A)
+    return lambda d: checksum(sig_type, 0, extra, consts, _as_char(ffi, d), len(d))
+  elif sig_type == SignalType.HKG_CAN_FD_CHECKSUM:
+    # the final XOR depends on the payload length
+    return lambda d: checksum(sig_type, address, HKG_CAN_FD_CHECKSUM_XOR.get(len(d), 0), consts, _as_char(ffi, d), len(d))
+  return lambda d: checksum(sig_type, 0, 0, consts, _as_char(ffi, d), len(d))
+
+
+def _as_char(ffi, d):
+  return d if isinstance(d, bytes) else ffi.from_buffer(d)
+
+
+# ***** per-address seeds *****
+
+# sum of the two nibbles of each byte value
+NIBBLE_SUMS = [(b >> 4) + (b & 0xF) for b in range(256)]
+
+
+def address_nibble_sum(address: int) -> int:
+  return sum((address >> shift) & 0xF for shift in range(0, address.bit_length(), 4))
+
+
+def address_byte_sum(address: int) -> int:
+  return sum((address >> shift) & 0xFF for shift in range(0, address.bit_length(), 8))
+
+
+def honda_seed(address: int) -> int:
+  # everything but the payload nibbles, the checksum is seed minus their sum
+  return 8 - address_nibble_sum(address) + (3 if address > 0x7FF else 0)
+
+
+def xor_seed(address: int, sig: Signal) -> int:
+  return VOLKSWAGEN_MLB_XOR_STARTING_VALUES.get(address, 0) if sig.type == SignalType.VOLKSWAGEN_MLB_CHECKSUM else 0
+
+
+# ***** bound checksums *****
+
+def _honda(address: int, sig: Signal) -> ChecksumFunction:
+  seed = honda_seed(address)
+  # the checksum is the last nibble
+  return lambda d: (seed - sum(map(NIBBLE_SUMS.__getitem__, d[:-1])) - (d[-1] >> 4)) & 0xF
+
+
+def _toyota(address: int, sig: Signal) -> ChecksumFunction:
+  seed = address_byte_sum(address)
+  return lambda d: (seed + len(d) + sum(d[:-1])) & 0xFF
+
+
+def _subaru(address: int, sig: Signal) -> ChecksumFunction:
+  seed = address_byte_sum(address)
+  return lambda d: (seed + sum(d[1:])) & 0xFF
+
+
+def _tesla(address: int, sig: Signal) -> ChecksumFunction:
+  seed = (address & 0xFF) + ((address >> 8) & 0xFF)
+  checksum_byte = sig.start_bit // 8
+  return lambda d: (seed + sum(d) - d[checksum_byte]) & 0xFF
+
+
+def _xor(address: int, sig: Signal) -> ChecksumFunction:
+  seed = xor_seed(address, sig)
+  checksum_byte = sig.start_bit // 8
+  return lambda d: reduce(xor, d, seed) ^ d[checksum_byte]
+
+
+def _volkswagen_mqb_meb(address: int, sig: Signal) -> ChecksumFunction:
+  const = VOLKSWAGEN_MQB_MEB_CONSTANTS.get(address)
+
+  def checksum(d) -> int:
+    crc = 0xFF
+    for b in d[1:]:
+      crc = CRC8H2F[crc ^ b]
+    if const:
+      crc = CRC8H2F[crc ^ const[d[1] & 0x0F]]
+    return crc ^ 0xFF
+  return checksum
+
+
+def _body(address: int, sig: Signal) -> ChecksumFunction:
+  def checksum(d) -> int:
+    crc = 0xFF
+    for b in d[-2::-1]:
+      crc = CRC8BODY[crc ^ b]
+    return crc
+  return checksum
+
+
+def _crc8_j1850(init: int, final_xor: int) -> ChecksumFunction:
+  # Chrysler's bitwise checksum is the same CRC as FCA's, starting from 0xFF
+  def checksum(d) -> int:
+    crc = init
+    for b in d[:-1]:
+      crc = CRC8J1850[crc ^ b]
+    return crc ^ final_xor
+  return checksum
+
+
+def _hkg_can_fd(address: int, sig: Signal) -> ChecksumFunction:
+  addr_bytes = (address & 0xFF, (address >> 8) & 0xFF)
+
+  def checksum(d) -> int:
+    crc = 0
+    for b in d[2:]:
+      crc = ((crc << 8) ^ CRC16_XMODEM[(crc >> 8) ^ b]) & 0xFFFF
+    for b in addr_bytes:
+      crc = ((crc << 8) ^ CRC16_XMODEM[(crc >> 8) ^ b]) & 0xFFFF
+    # the final XOR depends on the payload length
+    return crc ^ HKG_CAN_FD_CHECKSUM_XOR.get(len(d), 0)
+  return checksum
+
+
+BOUND_CHECKSUMS: dict[int, Callable[[int, Signal], ChecksumFunction]] = {
+  SignalType.HONDA_CHECKSUM: _honda,
+  SignalType.TOYOTA_CHECKSUM: _toyota,
+  SignalType.SUBARU_CHECKSUM: _subaru,
+  SignalType.TESLA_CHECKSUM: _tesla,
+  SignalType.XOR_CHECKSUM: _xor,
+  SignalType.VOLKSWAGEN_MQB_MEB_CHECKSUM: _volkswagen_mqb_meb,
+  SignalType.BODY_CHECKSUM: _body,
+  SignalType.CHRYSLER_CHECKSUM: lambda address, sig: _crc8_j1850(0xFF, 0xFF),
+  SignalType.FCA_GIORGIO_CHECKSUM: lambda address, sig: _crc8_j1850(0, FCA_GIORGIO_CHECKSUM_XOR.get(address, 0x0A)),
+  SignalType.HKG_CAN_FD_CHECKSUM: _hkg_can_fd,
+}
+
+
+def effective_type(address: int, sig: Signal) -> int:
+  # VW MLB uses a plain XOR for some addresses and the MQB CRC for the rest
+  if sig.type == SignalType.VOLKSWAGEN_MLB_CHECKSUM:
+    return SignalType.XOR_CHECKSUM if address in VOLKSWAGEN_MLB_XOR_STARTING_VALUES else SignalType.VOLKSWAGEN_MQB_MEB_CHECKSUM
+  return sig.type
+
+
+def get_checksum_function(address: int, sig: Signal, size: int) -> ChecksumFunction:
+  """Returns a function computing sig's checksum from a payload of the message at address, which is size bytes long"""
+  calc_checksum = sig.calc_checksum
+  assert calc_checksum is not None, f"{sig.name} has no checksum"
+
+  sig_type = effective_type(address, sig)
+  compiled = load_compiled() if sig_type in COMPILED_TYPES and size >= COMPILED_MIN_SIZE else None
+  if compiled is not None:
+    return _compiled_checksum(address, sig_type, *compiled)
+  if sig_type in BOUND_CHECKSUMS:
+    return BOUND_CHECKSUMS[sig_type](address, sig)
+  # PSA masks out the checksum nibble in its payload, so it gets a copy
+  return lambda d: calc_checksum(address, sig, bytearray(d))
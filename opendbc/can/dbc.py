@@ -1,10 +1,10 @@
 import re
 import os
 from collections.abc import Callable
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from functools import cache
 
-from opendbc import DBC_PATH, get_generated_dbcs
+from opendbc import DBC_PATH, get_generated_dbc, get_generated_dbc_hash
 
 # TODO: these should just be passed in along with the DBC file
 from opendbc.car.honda.hondacan import honda_checksum
@@ -51,6 +51,10 @@ class Signal:
   calc_checksum: 'Callable[[int, Signal, bytearray], int] | None' = None
 
 
+def _signal_row(sig: Signal) -> tuple:
+  return tuple(getattr(sig, f.name) for f in fields(sig))
+
+
 @dataclass
 class Msg:
   name: str
@@ -81,23 +85,48 @@ class DBC:
       self._parse_file(name)
     else:
       dbc_path = os.path.join(DBC_PATH, name + ".dbc")
-      if content := get_generated_dbcs().get(name):
-        self._parse_content(name, content)
+      if (sources_hash := get_generated_dbc_hash(name)) is not None:
+        # keyed on the generator sources, so a cache hit doesn't generate the DBC
+        self._parse(name, sources_hash, lambda: get_generated_dbc(name))
       elif os.path.exists(dbc_path):
         self._parse_file(dbc_path)
       else:
         raise FileNotFoundError(f"DBC not found: {name}")
 
   def _parse_file(self, path: str):
-    self.name = os.path.basename(path).replace(".dbc", "")
     with open(path) as f:
-      lines = f.readlines()
-    self._parse_lines(lines)
+      content = f.read()
+    self._parse(os.path.basename(path).replace(".dbc", ""), content, lambda: content)
+
+  def _parse(self, name: str, source: str, get_content: Callable[[], str | None]):
+    """Loads the tables cached for source (the DBC text, or a hash of what it's generated from), or parses get_content()"""
+    from opendbc.can import dbc_cache
 
-  def _parse_content(self, name: str, content: str):
     self.name = name
-    lines = content.splitlines(keepends=True)
-    self._parse_lines(lines)
+    key = dbc_cache.cache_key(name, source) if dbc_cache.cache_enabled() else None
+    if key is not None and (cached := dbc_cache.load(key)) is not None:
+      self._from_rows(*cached)
+      return
+
+    content = get_content()
+    assert content is not None, f"DBC not generated: {name}"
+    self._parse_lines(content.splitlines(keepends=True))
+    if key is not None:
+      dbc_cache.store(key, self._to_rows())
+
+  # plain tuples unpickle several times faster than the dataclasses themselves
+  def _to_rows(self) -> tuple[list, list]:
+    msg_rows = [(msg.name, msg.address, msg.size, [_signal_row(sig) for sig in msg.sigs.values()]) for msg in self.msgs.values()]
+    val_rows = [(val.name, val.address, val.def_val) for val in self.vals]
+    return msg_rows, val_rows
+
+  def _from_rows(self, msg_rows: list, val_rows: list) -> None:
+    self.msgs = {}
+    for name, address, size, sig_rows in msg_rows:
+      self.msgs[address] = Msg(name, address, size, {row[0]: Signal(*row) for row in sig_rows})
+    self.addr_to_msg = dict(self.msgs)
+    self.name_to_msg = {msg.name: msg for msg in self.msgs.values()}
+    self.vals = [Val(*row) for row in val_rows]
 
   def _parse_lines(self, lines: list[str]):
 
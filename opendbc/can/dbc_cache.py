@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""On-disk cache of parsed DBC tables, keyed by a hash of the DBC text (or of the generator sources of a *_generated DBC)
+and the parser version.
+
+Off by default, since it unpickles what it reads. Set OPENDBC_CACHE_DIR to a directory only you can write to to enable
+it, and DISABLE_DBC_CACHE=1 to turn it back off.
+
+  OPENDBC_CACHE_DIR=~/.cache/opendbc python -m opendbc.can.dbc_cache
+"""
+import argparse
+import glob
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+from functools import cache
+
+# bump when the parsed representation changes
+CACHE_VERSION = 1
+
+
+def get_cache_root() -> str:
+  if "OPENDBC_CACHE_DIR" in os.environ:
+    return os.environ["OPENDBC_CACHE_DIR"]
+  base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+  return os.path.join(base, "opendbc")
+
+
+def get_cache_dir() -> str:
+  return os.path.join(get_cache_root(), "dbc")
+
+
+def cache_enabled() -> bool:
+  return "OPENDBC_CACHE_DIR" in os.environ and os.environ.get("DISABLE_DBC_CACHE") != "1"
+
+
+@cache
+def _parser_hash() -> bytes:
+  # changes to the parser or checksum setup invalidate the cache, even without a version bump
+  with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "dbc.py"), "rb") as f:
+    return hashlib.sha256(f.read()).digest()
+
+
+def cache_key(name: str, content: str) -> str:
+  h = hashlib.sha256()
+  h.update(f"{CACHE_VERSION}\0{name}\0".encode())
+  h.update(_parser_hash())
+  h.update(content.encode())
+  return h.hexdigest()
+
+
+def _cache_path(key: str) -> str:
+  return os.path.join(get_cache_dir(), f"{key}.pkl")
+
+
+def load(key: str):
+  """Returns the cached tables, or None on a miss or unreadable entry."""
+  try:
+    with open(_cache_path(key), "rb") as f:
+      version, stored_key, data = pickle.loads(f.read())
+  except Exception:
+    # missing, corrupt, or written by an incompatible version. the caller re-parses and overwrites it
+    return None
+  if version != CACHE_VERSION or stored_key != key:
+    return None
+  return data
+
+
+def store(key: str, data) -> None:
+  cache_dir = get_cache_dir()
+  try:
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+      with os.fdopen(fd, "wb") as f:
+        f.write(pickle.dumps((CACHE_VERSION, key, data), protocol=pickle.HIGHEST_PROTOCOL))
+      # atomic, concurrent writers of the same key produce identical files
+      os.replace(tmp_path, _cache_path(key))
+    except BaseException:
+      os.unlink(tmp_path)
+      raise
+  except OSError:
+    # read-only or full filesystem, just parse every time
+    pass
+
+
+def prewarm() -> list[str]:
+  from opendbc import DBC_PATH, get_generated_dbcs
+  from opendbc.can.dbc import DBC
+
+  static_dbcs = [os.path.basename(dbc).split('.')[0] for dbc in glob.glob(f"{DBC_PATH}/*.dbc")]
+  names = sorted(set(static_dbcs + list(get_generated_dbcs().keys())))
+  for name in names:
+    DBC(name)
+  return names
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Manage the parsed DBC cache",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--clear", action="store_true", help="Delete the cache before prewarming")
+  parser.add_argument("--no-prewarm", action="store_true", help="Don't parse and cache all DBCs")
+  args = parser.parse_args()
+  if not cache_enabled():
+    parser.error("the DBC cache is disabled, set OPENDBC_CACHE_DIR to enable it")
+
+  if args.clear:
+    shutil.rmtree(get_cache_dir(), ignore_errors=True)
+    print(f"Cleared {get_cache_dir()}")
+  if not args.no_prewarm:
+    names = prewarm()
+    print(f"Cached {len(names)} DBCs in {get_cache_dir()}")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,19 +1,128 @@
 import math
 
 from opendbc.car.carlog import carlog
-from opendbc.can.dbc import DBC, Signal, SignalType
+from opendbc.can.checksums import ChecksumFunction, get_checksum_function
+from opendbc.can.dbc import DBC, Msg, Signal, SignalType
+
+
+def _is_counter(sig: Signal) -> bool:
+  return sig.type == SignalType.COUNTER or sig.name == "COUNTER"
+
+
+class PackTemplate:
+  """Packs one message into a single int, converted to bytes once.
+
+  Shifts, masks, the counter and the checksum are looked up once per message. Messages with
+  signals that don't fit in the payload, or with overlapping little and big endian signals,
+  go through set_value.
+  """
+  def __init__(self, msg: Msg):
+    self.address = msg.address
+    self.size = msg.size
+    self.msg = msg
+    # name: (is_little_endian, shift, mask, offset, factor, is_counter)
+    self.writers: dict[str, tuple[bool, int, int, float, float, bool]] = {}
+    self.need_le = False
+    self.need_be = False
+    self.fast = True
+
+    self.counter = next((s for s in msg.sigs.values() if _is_counter(s)), None)
+    self.checksum_sig = next((s for s in msg.sigs.values() if s.type > SignalType.COUNTER), None)
+    self.checksum: ChecksumFunction | None = None
+    if self.checksum_sig is not None and self.checksum_sig.calc_checksum is not None:
+      self.checksum = get_checksum_function(msg.address, self.checksum_sig, msg.size)
+
+    le_bits = be_bits = 0
+    for sig in msg.sigs.values():
+      if not (0 <= sig.lsb // 8 < self.size and 0 <= sig.msb // 8 < self.size):
+        self.fast = False
+        continue
+      mask = (1 << sig.size) - 1
+      if sig.is_little_endian:
+        shift = sig.lsb
+        le_bits |= mask << shift
+        self.need_le = True
+      else:
+        shift = (self.size - 1 - sig.lsb // 8) * 8 + sig.lsb % 8
+        be_bits |= int.from_bytes((mask << shift).to_bytes(self.size, "big"), "little")
+        self.need_be = True
+      self.writers[sig.name] = (sig.is_little_endian, shift, mask, sig.offset, sig.factor, _is_counter(sig))
+    # the two ints are merged at the end, so writes in one can't overwrite the other
+    if le_bits & be_bits:
+      self.fast = False
+
+    # (is_little_endian, shift, mask) of the counter and checksum signals
+    self.counter_writer = self.writers[self.counter.name][:3] if self.fast and self.counter is not None else None
+    self.checksum_writer = self.writers[self.checksum_sig.name][:3] if self.fast and self.checksum is not None else None
+
+  def pack(self, values: dict[str, float], counters: dict[int, int]) -> bytearray:
+    le = be = 0
+    counter_set = False
+    writers = self.writers
+    for name, value in values.items():
+      w = writers.get(name)
+      if w is None:
+        carlog.error(f"unknown signal {name=} in {self.msg.name}")
+        continue
+      is_le, shift, mask, offset, factor, is_counter = w
+      ival = (math.floor((value - offset) / factor + 0.5) & mask) << shift
+      if is_le:
+        le = (le & ~(mask << shift)) | ival
+      else:
+        be = (be & ~(mask << shift)) | ival
+      if is_counter:
+        counters[self.address] = int(value)
+        counter_set = True
+
+    if self.counter_writer is not None and not counter_set:
+      cnt = counters.setdefault(self.address, 0)
+      is_le, shift, mask = self.counter_writer
+      if is_le:
+        le = (le & ~(mask << shift)) | ((cnt & mask) << shift)
+      else:
+        be = (be & ~(mask << shift)) | ((cnt & mask) << shift)
+      counters[self.address] = (cnt + 1) % (mask + 1)
+
+    dat = self._to_bytes(le, be)
+    if self.checksum is not None and self.checksum_writer is not None:
+      is_le, shift, mask = self.checksum_writer
+      checksum = (self.checksum(dat) & mask) << shift
+      if is_le:
+        le = (le & ~(mask << shift)) | checksum
+      else:
+        be = (be & ~(mask << shift)) | checksum
+      dat = self._to_bytes(le, be)
+    return dat
+
+  def _to_bytes(self, le: int, be: int) -> bytearray:
+    if self.need_be:
+      if self.need_le:
+        le |= int.from_bytes(be.to_bytes(self.size, "big"), "little")
+      else:
+        return bytearray(be.to_bytes(self.size, "big"))
+    return bytearray(le.to_bytes(self.size, "little"))
 
 
 class CANPacker:
   def __init__(self, dbc_name: str):
     self.dbc = DBC(dbc_name)
     self.counters: dict[int, int] = {}
+    self.templates: dict[int, PackTemplate] = {}
 
   def pack(self, address: int, values: dict[str, float]) -> bytearray:
-    msg = self.dbc.addr_to_msg.get(address)
-    if msg is None:
-      carlog.error(f"msg not found for {address=}")
-      return bytearray()
+    template = self.templates.get(address)
+    if template is None:
+      msg = self.dbc.addr_to_msg.get(address)
+      if msg is None:
+        carlog.error(f"msg not found for {address=}")
+        return bytearray()
+      template = self.templates[address] = PackTemplate(msg)
+    if template.fast:
+      return template.pack(values, self.counters)
+    return self._pack_slow(template.msg, values)
+
+  def _pack_slow(self, msg: Msg, values: dict[str, float]) -> bytearray:
+    address = msg.address
     dat = bytearray(msg.size)
     counter_set = False
     for name, value in values.items():
@@ -25,10 +134,10 @@ class CANPacker:
       if ival < 0:
         ival = (1 << sig.size) + ival
       set_value(dat, sig, ival)
-      if sig.type == SignalType.COUNTER or sig.name == "COUNTER":
+      if _is_counter(sig):
         self.counters[address] = int(value)
         counter_set = True
-    sig_counter = next((s for s in msg.sigs.values() if s.type == SignalType.COUNTER or s.name == "COUNTER"), None)
+    sig_counter = next((s for s in msg.sigs.values() if _is_counter(s)), None)
     if sig_counter and not counter_set:
       if address not in self.counters:
         self.counters[address] = 0
@@ -1,14 +1,20 @@
+import heapq
 import math
 import numbers
+import numpy as np
+from array import array
 from collections import defaultdict, deque
+from collections.abc import Iterable, Mapping
 from dataclasses import dataclass, field
 
 from opendbc.car.carlog import carlog
-from opendbc.can.dbc import DBC, Signal
+from opendbc.can.checksums import ChecksumFunction, get_checksum_function
+from opendbc.can.dbc import DBC, Signal, SignalType
 
 
 MAX_BAD_COUNTER = 5
 CAN_INVALID_CNT = 5
+BUS_TIMEOUT_THRESHOLD = 500 * 1_000_000
 
 
 def get_raw_value(dat: bytes | bytearray, sig: Signal) -> int:
@@ -26,6 +32,72 @@ def get_raw_value(dat: bytes | bytearray, sig: Signal) -> int:
   return ret
 
 
+class DecodePlan:
+  """Decodes every signal of a message from a single int.from_bytes of the payload.
+
+  Shifts, masks and sign bits are computed once per message. Payloads that don't
+  match the DBC size, and signals that don't fit in it, go through get_raw_value.
+  """
+  def __init__(self, address: int, signals: list[Signal], size: int):
+    self.size = size
+    self.signals = signals
+    self.need_le = False
+    self.need_be = False
+    # (is_little_endian, shift, mask, sign_bit, sign_sub), or None for the get_raw_value fallback
+    self.steps: list[tuple[bool, int, int, int, int] | None] = []
+    # counter and checksum signals, which need their raw values checked
+    self.checked_signals: list[tuple[int, Signal, ChecksumFunction | None]] = []
+    for i, sig in enumerate(signals):
+      if sig.type != SignalType.DEFAULT:
+        checksum = get_checksum_function(address, sig, size) if sig.calc_checksum is not None else None
+        self.checked_signals.append((i, sig, checksum))
+    for sig in signals:
+      if not (0 <= sig.lsb // 8 < size and 0 <= sig.msb // 8 < size):
+        self.steps.append(None)
+        continue
+      if sig.is_little_endian:
+        shift = sig.lsb
+        self.need_le = True
+      else:
+        shift = (size - 1 - sig.lsb // 8) * 8 + sig.lsb % 8
+        self.need_be = True
+      sign_bit = (1 << (sig.size - 1)) if sig.is_signed else 0
+      self.steps.append((sig.is_little_endian, shift, (1 << sig.size) - 1, sign_bit, 1 << sig.size))
+
+  def decode(self, dat: bytes | bytearray) -> list[int]:
+    ret = [0] * len(self.signals)
+    self.decode_into(dat, ret)
+    return ret
+
+  def decode_into(self, dat: bytes | bytearray, out: list[int]) -> None:
+    """Decodes into a preallocated list of len(signals) raw values"""
+    if len(dat) != self.size:
+      for i, sig in enumerate(self.signals):
+        out[i] = self._slow_value(dat, sig)
+      return
+
+    le = int.from_bytes(dat, "little") if self.need_le else 0
+    be = int.from_bytes(dat, "big") if self.need_be else 0
+    i = 0
+    for step in self.steps:
+      if step is None:
+        out[i] = self._slow_value(dat, self.signals[i])
+      else:
+        is_le, shift, mask, sign_bit, sign_sub = step
+        tmp = ((le if is_le else be) >> shift) & mask
+        if tmp & sign_bit:
+          tmp -= sign_sub
+        out[i] = tmp
+      i += 1
+
+  @staticmethod
+  def _slow_value(dat: bytes | bytearray, sig: Signal) -> int:
+    tmp = get_raw_value(dat, sig)
+    if sig.is_signed:
+      tmp -= ((tmp >> (sig.size - 1)) & 0x1) * (1 << sig.size)
+    return tmp
+
+
 @dataclass
 class MessageState:
   address: int
@@ -37,13 +109,22 @@ class MessageState:
   ignore_counter: bool = False
   frequency: float = 0.0
   timeout_threshold: float = 1e5  # default to 1Hz threshold
-  vals: list[float] = field(default_factory=list)
-  all_vals: list[list[float]] = field(default_factory=list)
+  # latest values and all values since the last update(), preallocated and updated in place
+  vals: array = field(init=False)
+  all_vals: list[list[float]] = field(init=False)
   timestamps: deque[int] = field(default_factory=lambda: deque(maxlen=500))
   counter: int = 0
   counter_fail: int = 0
   first_seen_nanos: int = 0
   last_warning_log_nanos: int = 0
+  plan: DecodePlan = field(init=False)
+  raw_vals: list[int] = field(init=False)
+
+  def __post_init__(self):
+    self.plan = DecodePlan(self.address, self.signals, self.size)
+    self.vals = array('d', [0.0]) * len(self.signals)
+    self.all_vals = [[] for _ in self.signals]
+    self.raw_vals = [0] * len(self.signals)
 
   def rate_limited_log(self, last_update_nanos: int, msg: str) -> None:
     if (last_update_nanos - self.last_warning_log_nanos) >= 1_000_000_000:
@@ -51,41 +132,39 @@ class MessageState:
       self.last_warning_log_nanos = last_update_nanos
 
   def parse(self, nanos: int, dat: bytes) -> bool:
-    tmp_vals: list[float] = [0.0] * len(self.signals)
     checksum_failed = False
     counter_failed = False
 
     if self.first_seen_nanos == 0:
       self.first_seen_nanos = nanos
 
-    for i, sig in enumerate(self.signals):
-      tmp = get_raw_value(dat, sig)
-      if sig.is_signed:
-        tmp -= ((tmp >> (sig.size - 1)) & 0x1) * (1 << sig.size)
+    raw_vals = self.raw_vals
+    self.plan.decode_into(dat, raw_vals)
+    for i, sig, checksum in self.plan.checked_signals:
+      tmp = raw_vals[i]
 
-      if not self.ignore_checksum and sig.calc_checksum is not None:
-        expected_checksum = sig.calc_checksum(self.address, sig, bytearray(dat))
+      if not self.ignore_checksum and checksum is not None:
+        expected_checksum = checksum(dat)
         if tmp != expected_checksum:
           checksum_failed = True
           self.rate_limited_log(nanos, f"checksum failed: received {hex(tmp)}, calculated {hex(expected_checksum)}")
 
-      if not self.ignore_counter and sig.type == 1:  # COUNTER
+      if not self.ignore_counter and sig.type == SignalType.COUNTER:
         if not self.update_counter(tmp, sig.size):
           counter_failed = True
 
-      tmp_vals[i] = tmp * sig.factor + sig.offset
-
     # must have good counter and checksum to update data
     if checksum_failed or counter_failed:
       return False
 
-    if not self.vals:
-      self.vals = [0.0] * len(self.signals)
-      self.all_vals = [[] for _ in self.signals]
-
-    for i, v in enumerate(tmp_vals):
-      self.vals[i] = v
-      self.all_vals[i].append(v)
+    vals = self.vals
+    all_vals = self.all_vals
+    i = 0
+    for sig in self.signals:
+      v = raw_vals[i] * sig.factor + sig.offset
+      vals[i] = v
+      all_vals[i].append(v)
+      i += 1
 
     self.timestamps.append(nanos)
 
@@ -114,6 +193,58 @@ class MessageState:
     return True
 
 
+class SignalView(Mapping):
+  """Live, read-only view of one value per signal of a message. copy(), copy.copy() and copy.deepcopy() return a dict snapshot."""
+  __slots__ = ("_index",)
+
+  def __init__(self, index: dict[str, int]):
+    self._index = index
+
+  def __iter__(self):
+    return iter(self._index)
+
+  def __len__(self) -> int:
+    return len(self._index)
+
+  def __repr__(self) -> str:
+    return repr(self.copy())
+
+  def copy(self) -> dict:
+    return {k: self[k] for k in self._index}
+
+  def __copy__(self) -> dict:
+    return self.copy()
+
+  def __deepcopy__(self, memo) -> dict:
+    return self.copy()
+
+
+class SignalValues(SignalView):
+  """A message's latest values, read from MessageState.vals"""
+  __slots__ = ("_vals",)
+
+  def __init__(self, index: dict[str, int], vals: array):
+    super().__init__(index)
+    self._vals = vals
+
+  def __getitem__(self, key: str) -> float:
+    return self._vals[self._index[key]]
+
+
+class SignalTimestamps(SignalView):
+  """When a message's signals were last updated, which is the same for all of them"""
+  __slots__ = ("_timestamps",)
+
+  def __init__(self, index: dict[str, int], timestamps: deque[int]):
+    super().__init__(index)
+    self._timestamps = timestamps
+
+  def __getitem__(self, key: str) -> int:
+    if key not in self._index:
+      raise KeyError(key)
+    return self._timestamps[-1] if self._timestamps else 0
+
+
 class VLDict(dict):
   def __init__(self, parser):
     super().__init__()
@@ -126,17 +257,34 @@ class VLDict(dict):
 
 
 class CANParser:
-  def __init__(self, dbc_name: str, messages: list[tuple[str | int, int]], bus: int):
+  def __init__(self, dbc_name: str, messages: list[tuple[str | int, int]], bus: int, value_views: bool = False):
+    """With value_views, vl and ts_nanos hold read-only views of the message states' buffers, which update() doesn't
+    have to write to. Otherwise they hold plain dicts that update() writes each parsed message's values to."""
     self.dbc_name: str = dbc_name
     self.bus: int = bus
     self.dbc = DBC(dbc_name)
+    self.value_views = value_views
 
-    self.vl: dict[int | str, dict[str, float]] = VLDict(self)
+    self.vl: dict[int | str, dict[str, float] | SignalValues] = VLDict(self)
     self.vl_all: dict[int | str, dict[str, list[float]]] = {}
-    self.ts_nanos: dict[int | str, dict[str, int]] = {}
+    self.ts_nanos: dict[int | str, dict[str, int] | SignalTimestamps] = {}
     self.addresses: set[int] = set()
     self.message_states: dict[int, MessageState] = {}
 
+    # can_valid and bus_timeout aggregates, kept up to date by update()
+    self._order: dict[int, int] = {}  # message_states index, for logging in the same order
+    self._invalid: set[int] = set()  # never seen or timed out
+    self._counter_failed: set[int] = set()
+    self._deadlines: list[tuple[float, int]] = []  # min-heap of (timeout deadline, address)
+    self._scheduled: dict[int, float] = {}  # address: deadline of its live heap entry, others are stale
+    self._deadlines_nanos: float = 0  # time of the last deadline check
+    self._max_update_nanos: float = 0
+    self._alive_count = 0  # messages without ignore_alive
+    self._bus_timeout_threshold: float = BUS_TIMEOUT_THRESHOLD
+    self._vl_all_updated: set[int] = set()
+    # address: (signal names, vl dict, ts_nanos dict) without value_views
+    self._value_dicts: dict[int, tuple[list[str], dict[str, float], dict[str, int]]] = {}
+
     for name_or_addr, freq in messages:
       if isinstance(name_or_addr, numbers.Number):
         msg = self.dbc.addr_to_msg.get(int(name_or_addr))
@@ -162,15 +310,6 @@ class CANParser:
     assert msg.address not in self.addresses
 
     self.addresses.add(msg.address)
-    signal_names = list(msg.sigs.keys())
-    signals_dict = {s: 0.0 for s in signal_names}
-    dict.__setitem__(self.vl, msg.address, signals_dict)
-    dict.__setitem__(self.vl, msg.name, signals_dict)
-    self.vl_all[msg.address] = defaultdict(list)
-    self.vl_all[msg.name] = self.vl_all[msg.address]
-    self.ts_nanos[msg.address] = {s: 0 for s in signal_names}
-    self.ts_nanos[msg.name] = self.ts_nanos[msg.address]
-
     state = MessageState(
       address=msg.address,
       name=msg.name,
@@ -178,6 +317,23 @@ class CANParser:
       signals=list(msg.sigs.values()),
       ignore_alive=freq is not None and math.isnan(freq),
     )
+
+    index = {s.name: i for i, s in enumerate(state.signals)}
+    signal_values: dict[str, float] | SignalValues
+    timestamps: dict[str, int] | SignalTimestamps
+    if self.value_views:
+      signal_values = SignalValues(index, state.vals)
+      timestamps = SignalTimestamps(index, state.timestamps)
+    else:
+      signal_values = dict.fromkeys(index, 0.0)
+      timestamps = dict.fromkeys(index, 0)
+      self._value_dicts[msg.address] = (list(index), signal_values, timestamps)
+    dict.__setitem__(self.vl, msg.address, signal_values)
+    dict.__setitem__(self.vl, msg.name, signal_values)
+    self.vl_all[msg.address] = defaultdict(list, zip(index, state.all_vals, strict=True))
+    self.vl_all[msg.name] = self.vl_all[msg.address]
+    self.ts_nanos[msg.address] = timestamps
+    self.ts_nanos[msg.name] = self.ts_nanos[msg.address]
     if freq is not None and freq > 0:
       state.frequency = freq
     else:
@@ -185,29 +341,65 @@ class CANParser:
       freq = 1
     state.timeout_threshold = (1_000_000_000 / freq) * 10
 
+    self._order[msg.address] = len(self.message_states)
     self.message_states[msg.address] = state
+    if not state.ignore_alive:
+      self._alive_count += 1
+      self._invalid.add(msg.address)
+    self._update_bus_timeout_threshold()
 
-  @property
-  def bus_timeout(self) -> bool:
-    ignore_alive = all(s.ignore_alive for s in self.message_states.values())
-    bus_timeout_threshold = 500 * 1_000_000
+  def _update_bus_timeout_threshold(self) -> None:
+    self._bus_timeout_threshold = BUS_TIMEOUT_THRESHOLD
     for st in self.message_states.values():
       if st.timeout_threshold > 0:
-        bus_timeout_threshold = min(bus_timeout_threshold, st.timeout_threshold)
-    return ((self._last_update_nanos - self.last_nonempty_nanos) > bus_timeout_threshold) and not ignore_alive
+        self._bus_timeout_threshold = min(self._bus_timeout_threshold, st.timeout_threshold)
+
+  def _schedule(self, state: MessageState, not_before: float = -math.inf) -> None:
+    # a little early so float rounding never delays a timeout, popped entries are re-checked with valid()
+    deadline = state.timestamps[-1] + state.timeout_threshold
+    deadline = max(deadline - 4 * math.ulp(deadline), not_before)
+    self._scheduled[state.address] = deadline
+    heapq.heappush(self._deadlines, (deadline, state.address))
+
+  def _check_deadlines(self) -> None:
+    now = self._last_update_nanos
+    if now < self._deadlines_nanos:
+      # time went backwards, timed out messages may be valid again
+      for address in list(self._invalid):
+        state = self.message_states[address]
+        if state.timestamps and state.valid(now, False):
+          self._invalid.discard(address)
+          self._schedule(state)
+    self._deadlines_nanos = now
+
+    heap = self._deadlines
+    while heap and heap[0][0] <= now:
+      deadline, address = heapq.heappop(heap)
+      if self._scheduled.get(address) != deadline:
+        continue
+      state = self.message_states[address]
+      if state.valid(now, False):
+        self._schedule(state, math.nextafter(now, math.inf))
+      else:
+        del self._scheduled[address]
+        self._invalid.add(address)
+
+  @property
+  def bus_timeout(self) -> bool:
+    return ((self._last_update_nanos - self.last_nonempty_nanos) > self._bus_timeout_threshold) and self._alive_count > 0
 
   @property
   def can_valid(self) -> bool:
-    valid = True
-    counters_valid = True
-    bus_timeout = self.bus_timeout
-    for state in self.message_states.values():
-      if state.counter_fail >= MAX_BAD_COUNTER:
-        counters_valid = False
-        state.rate_limited_log(self._last_update_nanos, f"counter invalid, {state.counter_fail=} {MAX_BAD_COUNTER=}")
-      if not state.valid(self._last_update_nanos, bus_timeout):
-        valid = False
-        state.rate_limited_log(self._last_update_nanos, "not valid (timeout or missing)")
+    self._check_deadlines()
+    valid = not self._invalid
+    counters_valid = not self._counter_failed
+    if not (valid and counters_valid):
+      for address in sorted(self._invalid | self._counter_failed, key=self._order.__getitem__):
+        state = self.message_states[address]
+        if state.counter_fail >= MAX_BAD_COUNTER:
+          state.rate_limited_log(self._last_update_nanos, f"counter invalid, {state.counter_fail=} {MAX_BAD_COUNTER=}")
+        if address in self._invalid:
+          state.rate_limited_log(self._last_update_nanos, "not valid (timeout or missing)")
 
     # TODO: probably only want to increment this once per update() call
     self.can_invalid_cnt = 0 if valid else min(self.can_invalid_cnt + 1, CAN_INVALID_CNT)
@@ -217,15 +409,12 @@ class CANParser:
     if strings and not isinstance(strings[0], list | tuple):
       strings = [strings]
 
-    for addr in self.addresses:
-      for k in self.vl_all[addr]:
-        self.vl_all[addr][k].clear()
-
-    updated_addrs: set[int] = set()
+    updated_addrs = self._start_update()
     for entry in strings:
       t = entry[0]
       frames = entry[1]
       bus_empty = True
+      rewound = self._start_entry(t)
       for address, dat, src in frames:
         if src != self.bus:
           continue
@@ -233,24 +422,124 @@ class CANParser:
         state = self.message_states.get(address)
         if state is None or len(dat) > 64:
           continue
-        if state.parse(t, dat):
-          updated_addrs.add(address)
-
-          vl_addr = self.vl[address]
-          vl_all_addr = self.vl_all[address]
-          ts_addr = self.ts_nanos[address]
-
-          for i, sig in enumerate(state.signals):
-            vl_addr[sig.name] = state.vals[i]
-            vl_all_addr[sig.name] = state.all_vals[i]
-            ts_addr[sig.name] = state.timestamps[-1]
+        self._parse(state, t, dat, rewound, updated_addrs)
+      self._end_entry(t, bus_empty)
 
-      if not bus_empty:
-        self.last_nonempty_nanos = t
+    return updated_addrs
 
-      self._last_update_nanos = t
+  # update() steps, shared with CANDispatcher
+
+  def _start_update(self) -> set[int]:
+    # only the messages updated last time have values to clear
+    for addr in self._vl_all_updated:
+      for vals in self.vl_all[addr].values():
+        vals.clear()
+    self._vl_all_updated = set()
+    return self._vl_all_updated
+
+  def _start_entry(self, t: int) -> bool:
+    # older than a previous frame, so deadlines can move earlier and need rescheduling
+    rewound = t < self._max_update_nanos
+    self._max_update_nanos = max(self._max_update_nanos, t)
+    return rewound
+
+  def _parse(self, state: MessageState, t: int, dat: bytes, rewound: bool, updated_addrs: set[int]) -> None:
+    address = state.address
+    timeout_threshold = state.timeout_threshold
+    parsed = state.parse(t, dat)
+    if (state.counter_fail >= MAX_BAD_COUNTER) != (address in self._counter_failed):
+      self._counter_failed ^= {address}
+    if parsed:
+      updated_addrs.add(address)
+      if address in self._value_dicts:
+        names, vl, ts = self._value_dicts[address]
+        for name, val in zip(names, state.vals, strict=True):
+          vl[name] = val
+          ts[name] = t
+      if state.timeout_threshold != timeout_threshold:
+        self._update_bus_timeout_threshold()
+      if not state.ignore_alive and (rewound or address in self._invalid or state.timeout_threshold != timeout_threshold):
+        self._invalid.discard(address)
+        self._schedule(state)
+
+  def _end_entry(self, t: int, bus_empty: bool) -> None:
+    if not bus_empty:
+      self.last_nonempty_nanos = t
+    self._last_update_nanos = t
+
+  def decode_batch(self, addresses, nanos, payloads, buses=None) -> dict:
+    """Decode a whole log at once, from columnar input.
+
+    addresses and nanos are per-frame arrays, payloads is a (frames, bytes) uint8 matrix
+    zero-padded to a fixed width. If buses is passed, frames not on this parser's bus are
+    dropped. Returns an opendbc.can.batch.DecodedMessage for every message in the DBC,
+    keyed by both address and name like vl. Parser state is not modified.
+    """
+    from opendbc.can.batch import decode_message
+
+    addresses = np.asarray(addresses)
+    nanos = np.asarray(nanos, dtype=np.int64)
+    payloads = np.asarray(payloads, dtype=np.uint8).reshape(len(addresses), -1)
+    if buses is not None:
+      on_bus = np.asarray(buses) == self.bus
+      addresses, nanos, payloads = addresses[on_bus], nanos[on_bus], payloads[on_bus]
+
+    order = np.argsort(addresses, kind="stable")
+    sorted_addrs = addresses[order]
+    ret = {}
+    for msg in self.dbc.msgs.values():
+      lo, hi = np.searchsorted(sorted_addrs, [msg.address, msg.address + 1])
+      idx = order[lo:hi]
+      state = self.message_states.get(msg.address)
+      decoded = decode_message(msg, nanos[idx], payloads[idx],
+                               ignore_checksum=state is not None and state.ignore_checksum,
+                               ignore_counter=state is not None and state.ignore_counter)
+      ret[msg.address] = decoded
+      ret[msg.name] = decoded
+    return ret
+
+
+class CANDispatcher:
+  """Updates several CANParsers from the same packets, routing each frame once by (bus, address).
+
+  Equivalent to calling update() on each parser. Messages a parser adds later, like on first
+  access through vl, are routed from the next update().
+  """
+  def __init__(self, parsers: Iterable[CANParser | None]):
+    self.parsers = [cp for cp in parsers if cp is not None]
+    self._build_routes()
+
+  def _build_routes(self) -> None:
+    self._num_messages = [len(cp.message_states) for cp in self.parsers]
+    # address: ((bus, parser index, message state), ...). keyed by address alone so most frames take one lookup
+    self.routes: dict[int, tuple[tuple[int, int, MessageState], ...]] = {}
+    for i, cp in enumerate(self.parsers):
+      for address, state in cp.message_states.items():
+        self.routes[address] = self.routes.get(address, ()) + ((cp.bus, i, state),)
+
+  def update(self, strings) -> list[set[int]]:
+    """Returns the updated addresses of each parser, like CANParser.update()"""
+    if strings and not isinstance(strings[0], list | tuple):
+      strings = [strings]
+    if self._num_messages != [len(cp.message_states) for cp in self.parsers]:
+      self._build_routes()
 
-    return updated_addrs
+    parsers = self.parsers
+    routes = self.routes
+    updated = [cp._start_update() for cp in parsers]
+    for entry in strings:
+      t = entry[0]
+      rewound = [cp._start_entry(t) for cp in parsers]
+      buses = {}
+      for address, dat, src in entry[1]:
+        buses[src] = True
+        if address in routes and len(dat) <= 64:
+          for bus, i, state in routes[address]:
+            if bus == src:
+              parsers[i]._parse(state, t, dat, rewound[i], updated[i])
+      for cp in parsers:
+        cp._end_entry(t, cp.bus not in buses)
+    return updated
 
 
 class CANDefine:
@@ -1,46 +1,308 @@
 #!/usr/bin/env python3
+"""Benchmarks for the CAN layer's hot paths.
+
+  python -m opendbc.can.tests.benchmark                                # run all, print a table
+  python -m opendbc.can.tests.benchmark --only 'update/*' --json out.json
+  python -m opendbc.can.tests.benchmark --save-baseline base.json      # on a quiet machine
+  python -m opendbc.can.tests.benchmark --baseline base.json --threshold 0.25 --threshold-for 'update/*:p99_us=0.5'
+
+Every metric is lower-is-better: ns per CAN frame, p50/p99 latency per call, bytes allocated
+(tracemalloc peak) per call, and milliseconds for one-off work like DBC loading. With a baseline,
+exits with 1 if any metric regressed by more than its threshold. Timings depend on the machine,
+so compare against a baseline saved on the same one.
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
 import time
-from opendbc.can import CANPacker, CANParser
+import tracemalloc
+from collections.abc import Callable, Iterable, Iterator
+from unittest import mock
+
+from opendbc import get_generated_dbcs
+from opendbc.can import CANDispatcher, CANPacker, CANParser
+from opendbc.can.dbc import DBC
+from opendbc.car import DT_CTRL, gen_empty_fingerprint, structs
+from opendbc.car.car_helpers import interfaces
+
+Metrics = dict[str, float]
 
+BASELINE_VERSION = 1
+DEFAULT_THRESHOLD = 0.25
 
-def _benchmark(checks, n):
-  parser = CANParser('toyota_new_mc_pt_generated', checks, 0)
-  packer = CANPacker('toyota_new_mc_pt_generated')
+# a platform per brand, with the DBCs and checksums it uses in parentheses
+BRAND_PLATFORMS = {
+  "body": "COMMA_BODY",
+  "chrysler": "CHRYSLER_PACIFICA_2018_HYBRID",  # chrysler
+  "ford": "FORD_BRONCO_SPORT_MK1",
+  "gm": "CHEVROLET_BOLT_EUV",
+  "honda": "HONDA_CIVIC_BOSCH",  # honda
+  "hyundai": "HYUNDAI_SONATA",
+  "hyundai_canfd": "HYUNDAI_IONIQ_5",  # CRC16 over CAN-FD payloads
+  "mazda": "MAZDA_CX5",
+  "nissan": "NISSAN_XTRAIL",
+  "perodua": "MYVI",
+  "psa": "PSA_PEUGEOT_208",
+  "rivian": "RIVIAN_R1",
+  "subaru": "SUBARU_OUTBACK",
+  "tesla": "TESLA_MODEL_3",
+  "toyota": "TOYOTA_RAV4_TSS2",  # toyota
+  "volkswagen": "VOLKSWAGEN_GOLF_MK7",  # MQB CRC8
+}
 
-  t1 = time.process_time_ns()
-  can_msgs = []
-  for i in range(10000):
-    values = {"ACC_CONTROL": {"ACC_TYPE": 1, "ALLOW_LONG_PRESS": 3}}
-    msgs = [packer.make_can_msg(k, 0, v) for k, v in values.items()]
-    can_msgs.append([int(0.01 * i * 1e9), msgs])
-  t2 = time.process_time_ns()
-  pack_dt = t2 - t1
+# checksum-heavy messages: (dbc, {message: values})
+CHECKSUM_MESSAGES = {
+  "honda": ("honda_civic_touring_2016_can_generated", {"STEERING_CONTROL": {"STEER_TORQUE": 100, "STEER_TORQUE_REQUEST": 1}}),
+  "hyundai_canfd": ("hyundai_canfd_generated", {"LKAS": {"LKA_RcgSta": 1}, "SCC_CONTROL": {"aReqRaw": 0.5}}),
+  "volkswagen": ("vw_mqb", {"HCA_01": {"HCA_01_LM_Offset": 100, "HCA_01_Sendestatus": 1}, "ACC_06": {"ACC_Sollbeschleunigung_02": 0.5}}),
+  "toyota": ("toyota_new_mc_pt_generated", {"ACC_CONTROL": {"ACC_TYPE": 1, "ALLOW_LONG_PRESS": 3}}),
+}
 
+LOAD_DBCS = ['toyota_new_mc_pt_generated', 'honda_civic_touring_2016_can_generated', 'hyundai_canfd_generated', 'vw_mqb']
+
+
+def _measure(fn: Callable, inputs: list, alloc_inputs: list, frames: int) -> Metrics:
+  """Calls fn on each input for latency, then on each alloc_input under tracemalloc. frames is the CAN frame count of inputs."""
   ets = []
-  for _ in range(25):
-    if n > 1:
-      strings = []
-      for i in range(0, len(can_msgs), n):
-        strings.append(can_msgs[i:i + n])
-      t1 = time.process_time_ns()
-      for m in strings:
-        parser.update(m)
-      t2 = time.process_time_ns()
-    else:
-      t1 = time.process_time_ns()
-      for m in can_msgs:
-        parser.update([m])
-      t2 = time.process_time_ns()
-
-    ets.append(t2 - t1)
-
-  et = sum(ets) / len(ets)
-  avg_nanos = et / len(can_msgs)
-  print('[%d] %.1fms to pack, %.1fms to parse %s messages, avg: %dns' % (n, pack_dt/1e6, et/1e6, len(can_msgs), avg_nanos))
+  for x in inputs:
+    t1 = time.perf_counter_ns()
+    fn(x)
+    ets.append(time.perf_counter_ns() - t1)
+  ets.sort()
+
+  allocated = []
+  tracemalloc.start()
+  for x in alloc_inputs:
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    fn(x)
+    allocated.append(tracemalloc.get_traced_memory()[1] - before)
+  tracemalloc.stop()
+
+  return {
+    "ns_per_frame": sum(ets) / max(frames, 1),
+    "p50_us": ets[len(ets) // 2] / 1e3,
+    "p99_us": ets[min(int(len(ets) * 0.99), len(ets) - 1)] / 1e3,
+    "alloc_bytes": sum(allocated) / max(len(allocated), 1),
+  }
+
+
+def _min_ms(fn: Callable, n: int = 5) -> float:
+  ets = []
+  for _ in range(n):
+    t1 = time.perf_counter_ns()
+    fn()
+    ets.append(time.perf_counter_ns() - t1)
+  return min(ets) / 1e6
+
+
+# ***** car interfaces *****
+
+def _car_interface(candidate: str):
+  CarInterface = interfaces[candidate]
+  CP = CarInterface.get_params(candidate, gen_empty_fingerprint(), [], alpha_long=True, is_release=False, docs=False)
+  return CarInterface(CP)
+
+
+def _traffic(can_parsers, n: int) -> list[tuple[int, list]]:
+  """n 100Hz frames of every message the parsers expect, each at its frequency (100Hz if not known yet), with valid counters and checksums"""
+  packers = [(cp, CANPacker(cp.dbc_name)) for cp in can_parsers.values() if cp is not None]
+  ret = []
+  for i in range(n):
+    msgs = []
+    for cp, packer in packers:
+      for address, state in cp.message_states.items():
+        period = max(round(1 / (state.frequency * DT_CTRL)), 1) if state.frequency > 0 else 1
+        if i % period == 0:
+          msgs.append(packer.make_can_msg(address, cp.bus, {}))
+    ret.append((int(i * DT_CTRL * 1e9), msgs))
+  return ret
+
+
+def benchmark_brands(brands: Iterable[str], frames: int) -> Iterator[tuple[str, Metrics]]:
+  CC = structs.CarControl()
+  CC.enabled = CC.latActive = CC.longActive = True
+  CC = CC.as_reader()
+
+  for brand in brands:
+    CI = _car_interface(BRAND_PLATFORMS[brand])
+    # car states add most of their messages on first access
+    CI.update([])
+    CI.update([])
+
+    parsers = [cp for cp in CI.can_parsers.values() if cp is not None]
+    messages = [[(address, float('nan') if state.ignore_alive else state.frequency) for address, state in cp.message_states.items()] for cp in parsers]
+    yield f"parsers/{brand}", {"ms": _min_ms(lambda parsers=parsers, messages=messages: [CANParser(cp.dbc_name, m, cp.bus)
+                                                                                          for cp, m in zip(parsers, messages, strict=True)])}
+
+    traffic = _traffic(CI.can_parsers, frames * 2)
+    packets = [[entry] for entry in traffic]
+    yield f"update/{brand}", _measure(CI.can_dispatcher.update, packets[:frames], packets[frames:frames + frames // 5],
+                                      sum(len(e[1]) for e in traffic[:frames]))
+
+    # the same traffic into parsers with value_views, which don't rewrite the vl and ts_nanos dicts
+    views = CANDispatcher([CANParser(cp.dbc_name, m, cp.bus, value_views=True) for cp, m in zip(parsers, messages, strict=True)])
+    yield f"update_views/{brand}", _measure(views.update, packets[:frames], packets[frames:frames + frames // 5],
+                                            sum(len(e[1]) for e in traffic[:frames]))
+
+    # the car's *can.py message builders, through its CarController
+    # the message count of the first (warm-up) frames stands in for the measured ones, controllers are periodic
+    now_nanos = [traffic[-1][0] + int(i * DT_CTRL * 1e9) for i in range(1, frames * 2 + frames // 5 + 1)]
+    sent = sum(len(CI.apply(CC, t)[1]) for t in now_nanos[:frames])
+    yield f"pack/{brand}", _measure(lambda t, CI=CI: CI.apply(CC, t), now_nanos[frames:frames * 2], now_nanos[frames * 2:], sent)
+
+
+# ***** CAN layer *****
+
+def benchmark_checksums(names: Iterable[str], frames: int) -> Iterator[tuple[str, Metrics]]:
+  for name in names:
+    dbc_name, values = CHECKSUM_MESSAGES[name]
+    packer = CANPacker(dbc_name)
+    parser = CANParser(dbc_name, [(k, 100) for k in values], 0)
+
+    n = frames * 10
+    items = list(values.items()) * n
+    yield f"checksum_pack/{name}", _measure(lambda kv, packer=packer: packer.make_can_msg(kv[0], 0, kv[1]), items, items[:n // 5], len(items))
+
+    msgs = [(int(i * DT_CTRL * 1e9), [packer.make_can_msg(k, 0, v) for k, v in values.items()]) for i in range(n + n // 5)]
+    packets = [[m] for m in msgs]
+    yield f"checksum_parse/{name}", _measure(parser.update, packets[:n], packets[n:], n * len(values))
+
+
+def benchmark_dbc_load(dbc_names: list[str]) -> Iterator[tuple[str, Metrics]]:
+  get_generated_dbcs()
+
+  with tempfile.TemporaryDirectory() as cache_dir, mock.patch.dict(os.environ, {"OPENDBC_CACHE_DIR": cache_dir}):
+    for label, env in (("cold", {"DISABLE_DBC_CACHE": "1"}), ("warm", {})):
+      with mock.patch.dict(os.environ, env):
+        # fill the cache
+        for name in dbc_names:
+          DBC.__wrapped__(name)
+        yield f"dbc_load/{label}", {"ms": _min_ms(lambda: [DBC.__wrapped__(name) for name in dbc_names], 3)}
+
+
+def benchmark_first_parser(dbc_name: str) -> Iterator[tuple[str, Metrics]]:
+  # time to the first CANParser in a fresh process (after imports), generating only this DBC vs. all of them
+  for label, setup in (("single", ""), ("all", "get_generated_dbcs()")):
+    code = f"""
+import time
+from opendbc import get_generated_dbcs
+from opendbc.can import CANParser
+t1 = time.perf_counter_ns()
+{setup}
+CANParser({dbc_name!r}, [], 0)
+print(time.perf_counter_ns() - t1)
+"""
+    ets = [int(subprocess.check_output([sys.executable, "-c", code], env={**os.environ, "DISABLE_DBC_CACHE": "1"})) for _ in range(5)]
+    yield f"first_parser/{label}", {"ms": min(ets) / 1e6}
+
+
+def run(only: list[str] | None = None, frames: int = 300) -> dict[str, Metrics]:
+  def selected(name: str) -> bool:
+    return only is None or any(fnmatch.fnmatch(name, pattern) for pattern in only)
+
+  suites = [
+    lambda: benchmark_first_parser('toyota_new_mc_pt_generated'),
+    lambda: benchmark_dbc_load(LOAD_DBCS),
+    lambda: benchmark_checksums([n for n in CHECKSUM_MESSAGES if selected(f"checksum_pack/{n}") or selected(f"checksum_parse/{n}")], frames),
+    lambda: benchmark_brands([b for b in BRAND_PLATFORMS if any(selected(f"{k}/{b}") for k in ("parsers", "update", "update_views", "pack"))], frames),
+  ]
+  prefixes = [("first_parser/single", "first_parser/all"), ("dbc_load/cold", "dbc_load/warm"), (), ()]
+
+  results = {}
+  for suite, names in zip(suites, prefixes, strict=True):
+    if names and not any(selected(n) for n in names):
+      continue
+    for name, metrics in suite():
+      if selected(name):
+        results[name] = metrics
+        print(f"{name:36s} " + "  ".join(f"{k}={v:.4g}" for k, v in metrics.items()), flush=True)
+  return results
+
+
+# ***** baselines *****
+
+def _threshold(name: str, metric: str, default: float, thresholds: dict[str, float]) -> float:
+  # most specific pattern wins: "update/toyota:p99_us" over "update/*:p99_us" over "update/*"
+  ret = default
+  for pattern, value in sorted(thresholds.items(), key=lambda kv: len(kv[0])):
+    name_pattern, _, metric_pattern = pattern.partition(":")
+    if fnmatch.fnmatch(name, name_pattern) and fnmatch.fnmatch(metric, metric_pattern or "*"):
+      ret = value
+  return ret
+
+
+def compare(results: dict[str, Metrics], baseline: dict, default_threshold: float = DEFAULT_THRESHOLD,
+            thresholds: dict[str, float] | None = None) -> list[str]:
+  """Returns a description of each metric that regressed by more than its threshold"""
+  thresholds = {**baseline.get("thresholds", {}), **(thresholds or {})}
+  regressions = []
+  for name, metrics in results.items():
+    for metric, value in metrics.items():
+      base = baseline["results"].get(name, {}).get(metric)
+      if base is None:
+        continue
+      threshold = _threshold(name, metric, default_threshold, thresholds)
+      if value > base * (1 + threshold):
+        change = (value / base - 1) * 100 if base else float('inf')
+        regressions.append(f"{name} {metric}: {value:.4g} vs. baseline {base:.4g} (+{change:.0f}%, threshold {threshold * 100:.0f}%)")
+  return regressions
+
+
+def _parse_threshold(s: str) -> tuple[str, float]:
+  pattern, _, value = s.rpartition("=")
+  if not pattern:
+    raise argparse.ArgumentTypeError(f"expected PATTERN=FRACTION, got {s!r}")
+  return pattern, float(value)
+
+
+def main(argv: list[str] | None = None) -> int:
+  parser = argparse.ArgumentParser(description="Benchmark the CAN layer", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--only", action="append", help="Only run benchmarks matching this glob, e.g. 'update/*'. Can be repeated")
+  parser.add_argument("--frames", type=int, default=300, help="100Hz frames per benchmark")
+  parser.add_argument("--json", help="Write results to this file")
+  parser.add_argument("--baseline", help="Compare against results saved with --save-baseline")
+  parser.add_argument("--save-baseline", help="Save results as a baseline, keeping the thresholds of an existing one")
+  parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Allowed regression, as a fraction of the baseline")
+  parser.add_argument("--threshold-for", type=_parse_threshold, action="append", default=[], metavar="PATTERN=FRACTION",
+                      help="Threshold for benchmarks matching NAME_GLOB[:METRIC_GLOB]. Can be repeated")
+  args = parser.parse_args(argv)
+
+  results = run(args.only, args.frames)
+  output = {"version": BASELINE_VERSION, "python": sys.version.split()[0], "machine": platform.machine(), "results": results}
+
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump(output, f, indent=2)
+
+  if args.save_baseline:
+    if os.path.exists(args.save_baseline):
+      with open(args.save_baseline) as f:
+        output["thresholds"] = json.load(f).get("thresholds", {})
+    with open(args.save_baseline, "w") as f:
+      json.dump(output, f, indent=2)
+    print(f"Saved baseline to {args.save_baseline}")
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    if baseline.get("version") != BASELINE_VERSION:
+      print(f"Baseline {args.baseline} is from an incompatible version, not comparing")
+      return 0
+    regressions = compare(results, baseline, args.threshold, dict(args.threshold_for))
+    for r in regressions:
+      print(f"REGRESSION: {r}")
+    if regressions:
+      return 1
+    print(f"No regressions against {args.baseline}")
+  return 0
 
 
 if __name__ == "__main__":
-  # python -m cProfile -s cumulative  benchmark.py
-  _benchmark([('ACC_CONTROL', 10)], 1)
-  _benchmark([('ACC_CONTROL', 10)], 5)
-  _benchmark([('ACC_CONTROL', 10)], 10)
+  # python -m cProfile -s cumulative -m opendbc.can.tests.benchmark --only 'update/toyota'
+  sys.exit(main())
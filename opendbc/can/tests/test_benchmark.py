@@ -0,0 +1,30 @@
+import unittest
+
+from opendbc.can.tests.benchmark import compare, run
+
+
+class TestBenchmark(unittest.TestCase):
+  def test_compare(self):
+    baseline = {
+      "results": {"update/toyota": {"ns_per_frame": 1000, "p99_us": 10}, "pack/toyota": {"ns_per_frame": 1000}},
+      "thresholds": {"update/*:p99_us": 1.0},
+    }
+    results = {"update/toyota": {"ns_per_frame": 1200, "p99_us": 19}, "pack/toyota": {"ns_per_frame": 1300}, "update/honda": {"ns_per_frame": 1e9}}
+    regressions = compare(results, baseline, 0.25)
+    self.assertEqual(len(regressions), 1)
+    self.assertTrue(regressions[0].startswith("pack/toyota ns_per_frame"))
+
+    # command line thresholds override the baseline's, and the most specific pattern wins
+    self.assertEqual(len(compare(results, baseline, 0.25, {"update/*:p99_us": 0.5})), 2)
+    self.assertEqual(compare(results, baseline, 0.1, {"*": 0.5, "update/toyota:ns_per_frame": 0.3, "update/*:p99_us": 1.0}), [])
+
+  def test_run(self):
+    results = run(["checksum_*/toyota", "update/body", "pack/body"], frames=10)
+    self.assertEqual(set(results), {"checksum_pack/toyota", "checksum_parse/toyota", "update/body", "pack/body"})
+    for metrics in results.values():
+      self.assertEqual(set(metrics), {"ns_per_frame", "p50_us", "p99_us", "alloc_bytes"})
+      self.assertTrue(all(v >= 0 for v in metrics.values()))
+
+
+if __name__ == "__main__":
+  unittest.main()
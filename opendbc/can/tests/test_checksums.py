@@ -1,6 +1,15 @@
 import copy
+import os
+import random
+import tempfile
 import unittest
+import numpy as np
 from opendbc.can import CANPacker, CANParser
+from opendbc.can.batch import VECTORIZED_CHECKSUMS, calc_checksums
+from opendbc.can.build_checksums import build_library
+from opendbc.can.checksums import BOUND_CHECKSUMS, COMPILED_TYPES, _compiled_checksum, effective_type, get_checksum_function, load_library
+from opendbc.can.dbc import DBC, SignalType
+from opendbc.can.tests import ALL_DBCS
 
 
 class TestCanChecksums(unittest.TestCase):
@@ -28,6 +37,49 @@ class TestCanChecksums(unittest.TestCase):
       with self.subTest(counter=expected[counter_field]):
         assert tested[checksum_field] == expected[checksum_field]
 
+  def test_batch_checksums(self):
+    # vectorized checksums must match calc_checksum on every frame
+    random.seed(0)
+    for dbc_name in ALL_DBCS:
+      for msg in DBC(dbc_name).msgs.values():
+        for sig in msg.sigs.values():
+          if sig.calc_checksum is None:
+            continue
+          with self.subTest(dbc=dbc_name, msg=msg.name):
+            # only PSA is checked a frame at a time
+            assert effective_type(msg.address, sig) in VECTORIZED_CHECKSUMS or sig.type == SignalType.PSA_CHECKSUM
+            payloads = np.frombuffer(random.randbytes(20 * msg.size), dtype=np.uint8).reshape(20, msg.size)
+            expected = [sig.calc_checksum(msg.address, sig, bytearray(row.tobytes())) for row in payloads]
+            assert calc_checksums(msg.address, sig, payloads).tolist() == expected
+            assert len(calc_checksums(msg.address, sig, payloads[:0])) == 0
+
+  def test_checksum_engine(self):
+    # bound, per-message and compiled checksums must match calc_checksum, without modifying the payload
+    with tempfile.TemporaryDirectory() as tmp:
+      compiled = load_library(build_library(os.path.join(tmp, "checksums.so")))
+
+      random.seed(0)
+      for dbc_name in ALL_DBCS:
+        for msg in DBC(dbc_name).msgs.values():
+          for sig in msg.sigs.values():
+            if sig.calc_checksum is None:
+              continue
+            with self.subTest(dbc=dbc_name, msg=msg.name):
+              sig_type = effective_type(msg.address, sig)
+              engines = [get_checksum_function(msg.address, sig, msg.size)]
+              if sig_type in BOUND_CHECKSUMS:
+                engines.append(BOUND_CHECKSUMS[sig_type](msg.address, sig))
+              if sig_type in COMPILED_TYPES:
+                engines.append(_compiled_checksum(msg.address, sig_type, *compiled))
+              for _ in range(20):
+                dat = random.randbytes(msg.size)
+                expected = sig.calc_checksum(msg.address, sig, bytearray(dat))
+                for engine in engines:
+                  buf = bytearray(dat)
+                  assert engine(dat) == expected
+                  assert engine(memoryview(buf)) == expected
+                  assert buf == dat
+
   def verify_fca_giorgio_crc(self, msg_name: str, msg_addr: int, test_messages: list[bytes]):
     """Test modified SAE J1850 CRCs, with special final XOR cases for EPS messages"""
     assert len(test_messages) == 3
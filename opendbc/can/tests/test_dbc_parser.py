@@ -1,6 +1,14 @@
+import os
+import random
+import tempfile
 import unittest
+from unittest import mock
 from opendbc.can import CANParser
+from opendbc.can import dbc_cache
+from opendbc.can.dbc import DBC
+from opendbc.can.parser import DecodePlan, get_raw_value
 from opendbc.can.tests import ALL_DBCS
+from opendbc.dbc.generator.generator import generate_all, generate_dbc
 
 
 class TestDBCParser(unittest.TestCase):
@@ -20,3 +28,70 @@ class TestDBCParser(unittest.TestCase):
     for dbc in ALL_DBCS:
       with self.subTest(dbc=dbc):
         CANParser(dbc, [], 0)
+
+  def test_generate_single_dbc(self):
+    all_dbcs = generate_all()
+    for name, content in all_dbcs.items():
+      with self.subTest(dbc=name):
+        assert generate_dbc(name) == content
+    assert generate_dbc("toyota_nodsu_pt") is None
+    assert generate_dbc("nonexistent_generated") is None
+
+  def test_decode_plan(self):
+    # the compiled decode plan must be bit-identical to walking each signal
+    random.seed(0)
+    for dbc_name in ALL_DBCS:
+      with self.subTest(dbc=dbc_name):
+        for msg in DBC(dbc_name).msgs.values():
+          signals = list(msg.sigs.values())
+          plan = DecodePlan(msg.address, signals, msg.size)
+          for size in (msg.size, msg.size - 1, msg.size + 1):
+            dat = random.randbytes(max(size, 0))
+            expected = []
+            for sig in signals:
+              tmp = get_raw_value(dat, sig)
+              if sig.is_signed:
+                tmp -= ((tmp >> (sig.size - 1)) & 0x1) * (1 << sig.size)
+              expected.append(tmp)
+            assert plan.decode(dat) == expected, (msg.name, dat.hex())
+
+  def test_dbc_cache(self):
+    with tempfile.TemporaryDirectory() as cache_dir, mock.patch.dict(os.environ, {"OPENDBC_CACHE_DIR": cache_dir}):
+      os.environ.pop("DISABLE_DBC_CACHE", None)
+      for dbc_name in ("toyota_nodsu_pt_generated", "honda_civic_touring_2016_can_generated", "vw_mqb"):
+        with self.subTest(dbc=dbc_name):
+          cold = DBC.__wrapped__(dbc_name)
+          assert len(os.listdir(dbc_cache.get_cache_dir())) > 0
+          warm = DBC.__wrapped__(dbc_name)
+          assert warm.msgs == cold.msgs and warm.vals == cold.vals
+          assert warm.name_to_msg == cold.name_to_msg
+          assert warm.addr_to_msg == cold.addr_to_msg
+
+      # generated DBCs are keyed on their sources, a warm load doesn't generate them
+      with mock.patch("opendbc.can.dbc.get_generated_dbc") as get_generated_dbc:
+        warm = DBC.__wrapped__("toyota_nodsu_pt_generated")
+      get_generated_dbc.assert_not_called()
+      assert warm.msgs == DBC("toyota_nodsu_pt_generated").msgs
+
+      with mock.patch.dict(os.environ, {"DISABLE_DBC_CACHE": "0"}):
+        assert dbc_cache.cache_enabled()
+      with mock.patch.dict(os.environ, {"DISABLE_DBC_CACHE": "1"}):
+        assert not dbc_cache.cache_enabled()
+
+      # corrupt entries fall back to parsing
+      for fn in os.listdir(dbc_cache.get_cache_dir()):
+        with open(os.path.join(dbc_cache.get_cache_dir(), fn), "wb") as f:
+          f.write(b"garbage")
+      corrupt = DBC.__wrapped__("vw_mqb")
+      assert corrupt.msgs == DBC("vw_mqb").msgs
+
+    # opt-in
+    with tempfile.TemporaryDirectory() as home, mock.patch.dict(os.environ, {"HOME": home, "XDG_CACHE_HOME": home}):
+      os.environ.pop("OPENDBC_CACHE_DIR", None)
+      assert not dbc_cache.cache_enabled()
+      DBC.__wrapped__("vw_mqb")
+      assert os.listdir(home) == []
+
+      key = dbc_cache.cache_key("vw_mqb", "")
+      assert key != dbc_cache.cache_key("vw_mqb", " ")
+      assert key != dbc_cache.cache_key("vw_pq", "")
@@ -1,8 +1,13 @@
+import copy
+import math
 import unittest
 import random
+from unittest import mock
+import numpy as np
 
-from opendbc.can import CANPacker, CANParser
-from opendbc.can.tests import TEST_DBC
+from opendbc.can import CANDispatcher, CANPacker, CANParser
+from opendbc.can.parser import CAN_INVALID_CNT
+from opendbc.can.tests import ALL_DBCS, TEST_DBC
 
 MAX_BAD_COUNTER = 5
 
@@ -19,6 +24,21 @@ class TestCanParserPacker(unittest.TestCase):
         assert bus == b
         assert dat[0] == i
 
+  def test_pack_template(self):
+    # the compiled templates must be byte-identical to packing with set_value
+    random.seed(0)
+    for dbc_name in ALL_DBCS:
+      with self.subTest(dbc=dbc_name):
+        fast, slow = CANPacker(dbc_name), CANPacker(dbc_name)
+        for msg in fast.dbc.msgs.values():
+          for _ in range(3):
+            sigs = random.sample(list(msg.sigs.values()), random.randint(0, len(msg.sigs)))
+            # in range, out of range, negative and fractional values
+            values = {s.name: random.choice((random.randint(0, (1 << s.size) - 1) * s.factor + s.offset,
+                                             random.uniform(-1e6, 1e6), -s.factor)) for s in sigs}
+            assert fast.pack(msg.address, values) == slow._pack_slow(msg, values), (msg.name, values)
+        assert fast.counters == slow.counters
+
   def test_packer_counter(self):
     msgs = [("CAN_FD_MESSAGE", 0), ]
     packer = CANPacker(TEST_DBC)
@@ -175,6 +195,45 @@ class TestCanParserPacker(unittest.TestCase):
         for sig in ("STEER_TORQUE", "STEER_TORQUE_REQUEST", "COUNTER", "CHECKSUM"):
           assert parser.vl["STEERING_CONTROL"][sig] == parser.vl[228][sig]
 
+  def test_decode_batch(self):
+    # batch decode must match decoding the same frames one update() at a time
+    random.seed(0)
+    for dbc_file in (TEST_DBC, "toyota_nodsu_pt_generated", "honda_civic_touring_2016_can_generated",
+                     "hyundai_canfd_generated", "vw_mqb", "chrysler_pacifica_2017_hybrid_generated"):
+      parser = CANParser(dbc_file, [], 0)
+      packer = CANPacker(dbc_file)
+      msgs = random.sample(list(parser.dbc.msgs.values()), min(10, len(parser.dbc.msgs)))
+      frames = []
+      for i in range(200):
+        msg = random.choice(msgs)
+        if i % 3:
+          frames.append(packer.make_can_msg(msg.address, random.randint(0, 1), {}))
+        else:
+          frames.append((msg.address, random.randbytes(msg.size), random.randint(0, 1)))
+
+      width = max(len(dat) for _, dat, _ in frames)
+      payloads = np.zeros((len(frames), width), dtype=np.uint8)
+      for i, (_, dat, _) in enumerate(frames):
+        payloads[i, :len(dat)] = np.frombuffer(dat, dtype=np.uint8)
+      decoded = parser.decode_batch([f[0] for f in frames], np.arange(len(frames)) * 1000, payloads, [f[2] for f in frames])
+
+      for msg in msgs:
+        with self.subTest(dbc=dbc_file, msg=msg.name):
+          batch = decoded[msg.name]
+          assert decoded[msg.address] is batch
+          on_bus = [(i, dat) for i, (addr, dat, src) in enumerate(frames) if addr == msg.address and src == 0]
+          assert batch.nanos.tolist() == [i * 1000 for i, _ in on_bus]
+
+          state = CANParser(dbc_file, [(msg.name, 0)], 0).message_states[msg.address]
+          for j, (_, dat) in enumerate(on_bus):
+            raw = state.plan.decode(dat)
+            checksum_valid = True
+            for k, sig in enumerate(state.signals):
+              assert batch.values[sig.name][j] == raw[k] * sig.factor + sig.offset
+              if sig.calc_checksum is not None:
+                checksum_valid &= raw[k] == sig.calc_checksum(msg.address, sig, bytearray(dat))
+            assert batch.checksum_valid[j] == checksum_valid
+
   def test_scale_offset(self):
     """Test that both scale and offset are correctly preserved"""
     dbc_file = "honda_civic_touring_2016_can_generated"
@@ -255,6 +314,64 @@ class TestCanParserPacker(unittest.TestCase):
     send_msg()
     assert not parser.bus_timeout
 
+  def test_incremental_can_valid(self):
+    # can_valid and bus_timeout must match scanning every message state, including the logs
+    def get_bus_timeout(parser):
+      ignore_alive = all(s.ignore_alive for s in parser.message_states.values())
+      bus_timeout_threshold = 500 * 1_000_000
+      for st in parser.message_states.values():
+        if st.timeout_threshold > 0:
+          bus_timeout_threshold = min(bus_timeout_threshold, st.timeout_threshold)
+      return ((parser._last_update_nanos - parser.last_nonempty_nanos) > bus_timeout_threshold) and not ignore_alive
+
+    def get_can_valid(parser):
+      valid = True
+      counters_valid = True
+      for state in parser.message_states.values():
+        if state.counter_fail >= MAX_BAD_COUNTER:
+          counters_valid = False
+          state.rate_limited_log(parser._last_update_nanos, f"counter invalid, {state.counter_fail=} {MAX_BAD_COUNTER=}")
+        if not state.valid(parser._last_update_nanos, False):
+          valid = False
+          state.rate_limited_log(parser._last_update_nanos, "not valid (timeout or missing)")
+      parser.can_invalid_cnt = 0 if valid else min(parser.can_invalid_cnt + 1, CAN_INVALID_CNT)
+      return parser.can_invalid_cnt < CAN_INVALID_CNT and counters_valid
+
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    msgs = [("STEERING_CONTROL", 100), ("VSA_STATUS", 50), ("STEER_STATUS", 0), ("GEARBOX_AUTO", float('nan'))]
+    packer = CANPacker(dbc_file)
+    random.seed(0)
+    fast, scan = CANParser(dbc_file, msgs, 0), CANParser(dbc_file, msgs, 0)
+    names = [m[0] for m in msgs]
+    t = 0
+    for step in range(1000):
+      if step == 300:
+        # lazily added messages count too
+        for p in (fast, scan):
+          p.vl["SCM_FEEDBACK"]
+        names.append("SCM_FEEDBACK")
+
+      t = max(t + random.choice((0, 5e6, 10e6, 10e6, 10e6, 20e6, 1.5e8)) + random.choice((0, -2e8)) * (random.random() < 0.01), 0)
+      frames = []
+      for name in random.sample(names, random.randint(0, len(names))):
+        values = {"COUNTER": random.randint(0, 3)} if random.random() < 0.05 else {}
+        frames.append(packer.make_can_msg(name, 0, values))
+      if random.random() < 0.05:
+        addr, dat, bus = packer.make_can_msg("STEER_STATUS", 0, {})
+        frames.append((addr, bytes([dat[0] ^ 1]) + dat[1:], bus))
+      # the corrupted frames log checksum failures
+      with mock.patch("opendbc.can.parser.carlog"):
+        for p in (fast, scan):
+          p.update([int(t), frames])
+
+      with mock.patch("opendbc.can.parser.carlog") as fast_log:
+        fast_valid, fast_bus_timeout = fast.can_valid, fast.bus_timeout
+      with mock.patch("opendbc.can.parser.carlog") as scan_log:
+        scan_valid, scan_bus_timeout = get_can_valid(scan), get_bus_timeout(scan)
+      assert (fast_valid, fast_bus_timeout, fast.can_invalid_cnt) == (scan_valid, scan_bus_timeout, scan.can_invalid_cnt), step
+      assert fast_log.mock_calls == scan_log.mock_calls, step
+      assert not math.isnan(fast._bus_timeout_threshold)
+
   def test_updated(self):
     """Test updated value dict"""
     dbc_file = "honda_civic_touring_2016_can_generated"
@@ -349,6 +466,81 @@ class TestCanParserPacker(unittest.TestCase):
       "CHECKSUM": 0,
     }
 
+  def test_dispatcher(self):
+    # routing through a dispatcher must match updating each parser separately
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    packer = CANPacker(dbc_file)
+    msgs = list(packer.dbc.msgs.values())
+
+    def make_parsers():
+      return [CANParser(dbc_file, [("STEERING_CONTROL", 100), ("VSA_STATUS", 50)], 0),
+              CANParser(dbc_file, [("STEERING_CONTROL", 100), ("GEARBOX_AUTO", 0)], 0),  # same bus and message
+              CANParser(dbc_file, [("STEER_STATUS", 100)], 2),
+              CANParser(dbc_file, [], 1)]
+
+    random.seed(0)
+    separate, dispatched = make_parsers(), make_parsers()
+    dispatcher = CANDispatcher([*dispatched, None])
+    t = 0
+    for step in range(500):
+      if step == 100:
+        # lazily added messages are routed too
+        for parsers in (separate, dispatched):
+          parsers[3].vl["SCM_FEEDBACK"]
+
+      strings = []
+      for _ in range(random.randint(0, 3)):
+        t += random.choice((0, 10e6, 10e6, 3e8))
+        frames = [packer.make_can_msg(msg.address, random.choice((0, 1, 2)), {}) for msg in random.sample(msgs, random.randint(0, 10))]
+        frames += [packer.make_can_msg(name, random.choice((0, 2)), {}) for name in ("STEERING_CONTROL", "STEER_STATUS") if random.random() < 0.8]
+        strings.append([int(t), frames])
+
+      expected = [cp.update(strings) for cp in separate]
+      assert dispatcher.update(strings) == expected, step
+      for a, b in zip(separate, dispatched, strict=True):
+        for name in a.vl:
+          assert a.vl[name] == b.vl[name] and a.vl_all[name] == b.vl_all[name] and a.ts_nanos[name] == b.ts_nanos[name]
+        assert (a.can_valid, a.bus_timeout, a.last_nonempty_nanos) == (b.can_valid, b.bus_timeout, b.last_nonempty_nanos), step
+
+  def test_value_dicts(self):
+    # by default vl and ts_nanos hold plain dicts, updated in place
+    dbc_file = "toyota_nodsu_pt_generated"
+    parser = CANParser(dbc_file, [("ACC_CONTROL", 0)], 0)
+    packer = CANPacker(dbc_file)
+    vl, ts_nanos = parser.vl["ACC_CONTROL"], parser.ts_nanos["ACC_CONTROL"]
+    assert type(vl) is dict and type(ts_nanos) is dict
+    assert vl["ACC_TYPE"] == 0 and ts_nanos["ACC_TYPE"] == 0
+
+    parser.update([[100, [packer.make_can_msg("ACC_CONTROL", 0, {"ACC_TYPE": 1})]]])
+    assert vl["ACC_TYPE"] == 1 and ts_nanos["ACC_TYPE"] == 100 and parser.vl_all["ACC_CONTROL"]["ACC_TYPE"] == [1]
+    vl["ACC_TYPE"] = 5
+    parser.update([[200, [packer.make_can_msg("ACC_CONTROL", 0, {"ACC_TYPE": 2})]]])
+    assert vl["ACC_TYPE"] == 2 and ts_nanos["ACC_TYPE"] == 200
+
+  def test_value_views(self):
+    dbc_file = "toyota_nodsu_pt_generated"
+    parser = CANParser(dbc_file, [("ACC_CONTROL", 0), ("PCM_CRUISE", 0)], 0, value_views=True)
+    packer = CANPacker(dbc_file)
+    vl, vl_all, ts_nanos = parser.vl["ACC_CONTROL"], parser.vl_all["ACC_CONTROL"], parser.ts_nanos["ACC_CONTROL"]
+
+    parser.update([[100, [packer.make_can_msg("ACC_CONTROL", 0, {"ACC_TYPE": 1})]]])
+    snapshot, deep_snapshot = copy.copy(vl), copy.deepcopy(vl)
+    assert type(snapshot) is dict and snapshot == deep_snapshot == vl == parser.vl[parser.dbc.name_to_msg["ACC_CONTROL"].address]
+    assert vl["ACC_TYPE"] == 1 and vl_all["ACC_TYPE"] == [1] and ts_nanos["ACC_TYPE"] == 100
+
+    # views follow the parser, snapshots don't
+    parser.update([[200, [packer.make_can_msg("ACC_CONTROL", 0, {"ACC_TYPE": 2}), packer.make_can_msg("ACC_CONTROL", 0, {"ACC_TYPE": 3})]]])
+    assert vl["ACC_TYPE"] == 3 and vl_all["ACC_TYPE"] == [2, 3] and ts_nanos["ACC_TYPE"] == 200
+    assert snapshot["ACC_TYPE"] == 1
+
+    # messages that aren't updated have no values in vl_all, but keep their latest value
+    parser.update([[300, [packer.make_can_msg("PCM_CRUISE", 0, {})]]])
+    assert vl["ACC_TYPE"] == 3 and vl_all["ACC_TYPE"] == [] and len(parser.vl_all["PCM_CRUISE"]["CRUISE_STATE"]) == 1
+    with self.assertRaises(KeyError):
+      vl["NOT_A_SIGNAL"]
+    with self.assertRaises(KeyError):
+      ts_nanos["NOT_A_SIGNAL"]
+
   def test_disallow_duplicate_messages(self):
     CANParser("toyota_nodsu_pt_generated", [("ACC_CONTROL", 5)], 0)
 
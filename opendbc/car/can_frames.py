@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Columnar CAN frames from logs, cached on disk as memory-mappable .npy files.
+
+  frames, events = read_can_frames("rlog.zst")     # or msg_type="sendcan"
+  frames["mono_time"], frames["bus"], frames["address"], frames["dlc"], frames["dat"]
+
+Each row of frames is one frame, in log order. "dat" is a fixed-width payload matrix, as wide as the longest frame in the
+log (at least 8 bytes) and zero padded past "dlc", the payload length in bytes. events has a row per event, including those without frames,
+with its "mono_time" and the index of its first frame, "start". Logs are keyed by a hash of their content (or their URL),
+so reading a log again memory-maps the cached frames instead of parsing capnp. Set OPENDBC_CACHE_DIR to move the cache.
+
+  python -m opendbc.car.can_frames rlog.zst
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+from collections.abc import Iterator
+
+import numpy as np
+
+from opendbc.can.dbc_cache import get_cache_root
+from opendbc.car.can_definitions import CanData
+from opendbc.car.logreader import LogReader
+
+# bump when the extracted columns change
+CACHE_VERSION = 2
+CHUNK_FRAMES = 1 << 16
+
+
+def frame_dtype(width: int) -> np.dtype:
+  return np.dtype([("mono_time", "<u8"), ("address", "<u4"), ("bus", "u1"), ("dlc", "u1"), ("dat", "u1", (width,))])
+
+
+EVENT_DTYPE = np.dtype([("mono_time", "<u8"), ("start", "<u4")])
+
+
+def get_cache_dir() -> str:
+  return os.path.join(get_cache_root(), "can_frames")
+
+
+def cache_key(fn: str, msg_type: str) -> str:
+  h = hashlib.sha256(f"{CACHE_VERSION}\0{msg_type}\0".encode())
+  if fn.startswith("http"):
+    # logs aren't modified once uploaded
+    h.update(fn.encode())
+  else:
+    with open(fn, "rb") as f:
+      while block := f.read(1 << 20):
+        h.update(block)
+  return h.hexdigest()
+
+
+class _FrameChunks:
+  """Frames collected into numpy chunks of up to CHUNK_FRAMES rows. Payloads are padded to the widest frame so far,
+  8 bytes until a CAN-FD frame appears. A wider frame starts a new chunk, narrower chunks are padded once in finish()."""
+  def __init__(self):
+    self.width = 8
+    self.chunks: list[np.ndarray] = []
+    self._start_chunk()
+
+  def _start_chunk(self) -> None:
+    self.mono_times: list[int] = []
+    self.addresses: list[int] = []
+    self.buses: list[int] = []
+    self.lens: list[int] = []
+    self.dat = bytearray()
+
+  def _flush(self) -> None:
+    if not len(self.lens):
+      return
+    chunk: np.ndarray = np.empty(len(self.lens), dtype=frame_dtype(self.width))
+    chunk["mono_time"] = self.mono_times
+    chunk["address"] = self.addresses
+    chunk["bus"] = self.buses
+    chunk["dlc"] = self.lens
+    chunk["dat"] = np.frombuffer(self.dat, dtype=np.uint8).reshape(-1, self.width)
+    self.chunks.append(chunk)
+    self._start_chunk()
+
+  def add(self, mono_time: int, frames) -> None:
+    if not len(frames):
+      return
+    addresses, buses, dats = zip(*[(frame.address, frame.src, frame.dat) for frame in frames], strict=True)
+    lens = list(map(len, dats))
+    if max(lens) > self.width:
+      self._flush()
+      self.width = max(lens)
+    self.mono_times += [mono_time] * len(lens)
+    self.addresses += addresses
+    self.buses += buses
+    self.lens += lens
+    self.dat += b"".join(frame_dat.ljust(self.width, b"\x00") for frame_dat in dats)
+    if len(self.lens) >= CHUNK_FRAMES:
+      self._flush()
+
+  def finish(self) -> np.ndarray:
+    self._flush()
+    frames: np.ndarray = np.zeros(sum(len(chunk) for chunk in self.chunks), dtype=frame_dtype(self.width))
+    start = 0
+    for chunk in self.chunks:
+      rows = frames[start:start + len(chunk)]
+      for name in ("mono_time", "address", "bus", "dlc"):
+        rows[name] = chunk[name]
+      rows["dat"][:, :chunk.dtype["dat"].shape[0]] = chunk["dat"]
+      start += len(chunk)
+    return frames
+
+
+def extract_can_frames(fn: str, msg_type: str = "can") -> tuple[np.ndarray, np.ndarray]:
+  """Reads the frames and events of all msg_type events in one pass, sorted by event time"""
+  event_times: list[int] = []
+  starts: list[int] = []
+  chunks = _FrameChunks()
+  n_frames = 0
+  for evt in LogReader(fn, only_union_types=True, sort_by_time=True, streaming=True):
+    if evt.which() != msg_type:
+      continue
+    frames = getattr(evt, msg_type)
+    event_times.append(evt.logMonoTime)
+    starts.append(n_frames)
+    chunks.add(evt.logMonoTime, frames)
+    n_frames += len(frames)
+
+  events: np.ndarray = np.empty(len(starts), dtype=EVENT_DTYPE)
+  events["mono_time"] = event_times
+  events["start"] = starts
+  return chunks.finish(), events
+
+
+def _load(path: str, names: tuple[str, ...] | None) -> np.ndarray | None:
+  try:
+    arr = np.load(path, mmap_mode="r")
+  except Exception:
+    # missing or partially written, re-extract and overwrite it
+    return None
+  if arr.dtype.names != names:
+    return None
+  return arr
+
+
+def _store(path: str, arr: np.ndarray) -> None:
+  try:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+      with os.fdopen(fd, "wb") as f:
+        np.save(f, arr)
+      os.replace(tmp_path, path)
+    except BaseException:
+      os.unlink(tmp_path)
+      raise
+  except OSError:
+    # read-only or full filesystem, just extract every time
+    pass
+
+
+def read_can_frames(fn: str, msg_type: str = "can", cache: bool = True) -> tuple[np.ndarray, np.ndarray]:
+  """Frames and events of a log, memory-mapped from the cache when possible"""
+  if not cache:
+    return extract_can_frames(fn, msg_type)
+
+  path = os.path.join(get_cache_dir(), cache_key(fn, msg_type))
+  frames, events = _load(f"{path}.frames.npy", frame_dtype(8).names), _load(f"{path}.events.npy", EVENT_DTYPE.names)
+  if frames is None or events is None:
+    frames, events = extract_can_frames(fn, msg_type)
+    _store(f"{path}.events.npy", events)
+    _store(f"{path}.frames.npy", frames)
+  return frames, events
+
+
+def iter_can_data(frames: np.ndarray, events: np.ndarray) -> Iterator[tuple[int, list[CanData]]]:
+  """Groups frames back into (mono_time, [CanData, ...]) per event, as replays and CarInterface.update take them"""
+  addresses, buses, lens = frames["address"].tolist(), frames["bus"].tolist(), frames["dlc"].tolist()
+  dat, width = frames["dat"].tobytes(), frames.dtype["dat"].shape[0]
+
+  starts = events["start"].tolist()
+  ends = starts[1:] + [len(frames)] if len(starts) else []
+  for mono_time, start, end in zip(events["mono_time"].tolist(), starts, ends, strict=True):
+    yield mono_time, [CanData(addresses[i], dat[i * width:i * width + lens[i]], buses[i]) for i in range(start, end)]
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Extract and cache the CAN frames of logs", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("logs", nargs="+", help="Log paths or URLs")
+  parser.add_argument("--msg-type", default="can", choices=("can", "sendcan"))
+  args = parser.parse_args()
+
+  for fn in args.logs:
+    frames, events = read_can_frames(fn, args.msg_type)
+    print(f"{fn}: {len(events)} events, {len(frames)} frames, {len(np.unique(frames['address']))} addresses, {frames.nbytes / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+  main()
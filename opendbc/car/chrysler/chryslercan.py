@@ -98,16 +98,13 @@ def chrysler_checksum(address: int, sig, d: bytearray) -> int:
   return (~checksum) & 0xFF
 
 
+# final XOR value of the checksum, by address
+FCA_GIORGIO_CHECKSUM_XOR = {0xDE: 0x10, 0x106: 0xF6, 0x122: 0xF1}
+
+
 def fca_giorgio_checksum(address: int, sig, d: bytearray) -> int:
   crc = 0
   for i in range(len(d) - 1):
     crc ^= d[i]
     crc = CRC8J1850[crc]
-  if address == 0xDE:
-    return crc ^ 0x10
-  elif address == 0x106:
-    return crc ^ 0xF6
-  elif address == 0x122:
-    return crc ^ 0xF1
-  else:
-    return crc ^ 0x0A
+  return crc ^ FCA_GIORGIO_CHECKSUM_XOR.get(address, 0x0A)
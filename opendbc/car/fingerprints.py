@@ -1,3 +1,6 @@
+from collections import defaultdict
+from functools import cache
+
 from opendbc.car.interfaces import get_interface_attr
 from opendbc.car.body.values import CAR as BODY
 from opendbc.car.chrysler.values import CAR as CHRYSLER
@@ -26,6 +29,37 @@ def is_valid_for_fingerprint(msg, car_fingerprint: dict[int, int]):
   return (adr in car_fingerprint and car_fingerprint[adr] == len(msg.dat)) or adr >= 0x800
 
 
+@cache
+def _fingerprint_index() -> tuple[dict[str, int], dict[tuple[int, int], int]]:
+  """Returns each car's bit, and a map from (address, length) to a bitmask of the cars with any fingerprint containing it"""
+  car_bits = {car_name: i for i, car_name in enumerate(_FINGERPRINTS)}
+  index: dict[tuple[int, int], int] = defaultdict(int)
+  for car_name, car_fingerprints in _FINGERPRINTS.items():
+    for fingerprint in car_fingerprints:
+      # add alien debug address
+      for address_length in (fingerprint | _DEBUG_ADDRESS).items():
+        index[address_length] |= 1 << car_bits[car_name]
+  return car_bits, dict(index)
+
+
+def all_fingerprint_cars_mask() -> int:
+  return (1 << len(_FINGERPRINTS)) - 1
+
+
+def compatible_cars_mask(address: int, length: int) -> int:
+  """Returns a bitmask of the cars that could have sent a message of length bytes at address. Cars have the bits
+     of their positions in all_legacy_fingerprint_cars()
+  """
+  # ignore addresses that are more than 11 bits
+  if address >= 0x800:
+    return all_fingerprint_cars_mask()
+  return _fingerprint_index()[1].get((address, length), 0)
+
+
+def cars_from_mask(mask: int) -> list[str]:
+  return [car_name for i, car_name in enumerate(_FINGERPRINTS) if (mask >> i) & 1]
+
+
 def eliminate_incompatible_cars(msg, candidate_cars):
   """Removes cars that could not have sent msg.
 
@@ -36,18 +70,9 @@ def eliminate_incompatible_cars(msg, candidate_cars):
      Returns:
       A list containing the subset of candidate_cars that could have sent msg.
   """
-  compatible_cars = []
-
-  for car_name in candidate_cars:
-    car_fingerprints = _FINGERPRINTS[car_name]
-
-    for fingerprint in car_fingerprints:
-      # add alien debug address
-      if is_valid_for_fingerprint(msg, fingerprint | _DEBUG_ADDRESS):
-        compatible_cars.append(car_name)
-        break
-
-  return compatible_cars
+  car_bits = _fingerprint_index()[0]
+  mask = compatible_cars_mask(msg.address, len(msg.dat))
+  return [car_name for car_name in candidate_cars if (mask >> car_bits[car_name]) & 1]
 
 
 def all_legacy_fingerprint_cars():
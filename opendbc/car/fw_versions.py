@@ -1,5 +1,7 @@
 from collections import defaultdict
 from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from functools import cache
 from typing import Protocol, TypeVar
 
 from tqdm import tqdm
@@ -10,9 +12,9 @@ from opendbc.car.carlog import carlog
 from opendbc.car.structs import CarParams
 from opendbc.car.ecu_addrs import get_ecu_addrs
 from opendbc.car.fingerprints import FW_VERSIONS
-from opendbc.car.fw_query_definitions import ESSENTIAL_ECUS, AddrType, EcuAddrBusType, FwQueryConfig, LiveFwVersions, OfflineFwVersions
+from opendbc.car.fw_query_definitions import ESSENTIAL_ECUS, AddrType, EcuAddrBusType, FwQueryConfig, LiveFwVersions, OfflineFwVersions, Request
 from opendbc.car.interfaces import get_interface_attr
-from opendbc.car.isotp_parallel_query import IsoTpParallelQuery
+from opendbc.car.isotp_parallel_query import IsoTpParallelQuery, get_data_concurrent
 
 Ecu = CarParams.Ecu
 FUZZY_EXCLUDE_ECUS = [Ecu.fwdCamera, Ecu.fwdRadar, Ecu.eps, Ecu.debug]
@@ -51,20 +53,14 @@ class MatchFwToCar(Protocol):
     ...
 
 
-def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str | None = None, log: bool = True, exclude: str | None = None) -> set[str]:
-  """Do a fuzzy FW match. This function will return a match, and the number of firmware version
-  that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
-  the match is rejected."""
-
-  # Build lookup table from (addr, sub_addr, fw) to list of candidate cars
+@cache
+def _fuzzy_fw_candidates(match_brand: str | None) -> dict[tuple[int, int | None, bytes], tuple[str, ...]]:
+  """Lookup table from (addr, sub_addr, fw) to the candidate cars of match_brand with that FW"""
   all_fw_versions = defaultdict(list)
   for candidate, fw_by_addr in FW_VERSIONS.items():
     if not is_brand(MODEL_TO_BRAND[candidate], match_brand):
       continue
 
-    if candidate == exclude:
-      continue
-
     for addr, fws in fw_by_addr.items():
       # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
       # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
@@ -74,6 +70,15 @@ def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str | N
         continue
       for f in fws:
         all_fw_versions[(addr[1], addr[2], f)].append(candidate)
+  return {k: tuple(v) for k, v in all_fw_versions.items()}
+
+
+def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str | None = None, log: bool = True, exclude: str | None = None) -> set[str]:
+  """Do a fuzzy FW match. This function will return a match, and the number of firmware version
+  that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
+  the match is rejected."""
+
+  all_fw_versions = _fuzzy_fw_candidates(match_brand)
 
   matched_ecus = set()
   match: str | None = None
@@ -81,7 +86,9 @@ def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str | N
     ecu_key = (addr[0], addr[1])
     for version in versions:
       # All cars that have this FW response on the specified address
-      candidates = all_fw_versions[(*ecu_key, version)]
+      candidates = all_fw_versions.get((*ecu_key, version), ())
+      if exclude in candidates:
+        candidates = tuple(c for c in candidates if c != exclude)
 
       if len(candidates) == 1:
         matched_ecus.add(ecu_key)
@@ -101,6 +108,30 @@ def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str | N
     return set()
 
 
+@cache
+def _exact_fw_checks(match_brand: str | None) -> dict[str, tuple[tuple[tuple, AddrType, frozenset[bytes], bool], ...]]:
+  """For each candidate car of match_brand, its ECUs as (ecu, addr, expected versions, essential)"""
+  checks = {}
+  for candidate, fws in FW_VERSIONS.items():
+    if not is_brand(MODEL_TO_BRAND[candidate], match_brand):
+      continue
+
+    config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
+    candidate_checks = []
+    for ecu, expected_versions in fws.items():
+      ecu_type = ecu[0]
+      # Virtual debug ecu doesn't need to match the database
+      if ecu_type == Ecu.debug:
+        continue
+
+      # Some models can sometimes miss an ecu, or show on two different addresses
+      # FIXME: this logic can be improved to be more specific, should require one of the two addresses
+      essential = ecu_type in ESSENTIAL_ECUS and candidate not in config.non_essential_ecus.get(ecu_type, [])
+      candidate_checks.append((ecu, ecu[1:], frozenset(expected_versions), essential))
+    checks[candidate] = tuple(candidate_checks)
+  return checks
+
+
 def match_fw_to_car_exact(live_fw_versions: LiveFwVersions, match_brand: str | None = None,
                           log: bool = True, extra_fw_versions: dict | None = None) -> set[str]:
   """Do an exact FW match. Returns all cars that match the given
@@ -110,37 +141,25 @@ def match_fw_to_car_exact(live_fw_versions: LiveFwVersions, match_brand: str | N
   if extra_fw_versions is None:
     extra_fw_versions = {}
 
-  invalid = set()
-  candidates = {c: f for c, f in FW_VERSIONS.items() if
-                is_brand(MODEL_TO_BRAND[c], match_brand)}
-
-  for candidate, fws in candidates.items():
-    config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
-    for ecu, expected_versions in fws.items():
-      expected_versions = expected_versions + extra_fw_versions.get(candidate, {}).get(ecu, [])
-      ecu_type = ecu[0]
-      addr = ecu[1:]
-
-      found_versions = live_fw_versions.get(addr, set())
-      if not len(found_versions):
-        # Some models can sometimes miss an ecu, or show on two different addresses
-        # FIXME: this logic can be improved to be more specific, should require one of the two addresses
-        if candidate in config.non_essential_ecus.get(ecu_type, []):
-          continue
-
+  matches = set()
+  for candidate, checks in _exact_fw_checks(match_brand).items():
+    extra = extra_fw_versions.get(candidate, {})
+    for ecu, addr, expected_versions, essential in checks:
+      found_versions = live_fw_versions.get(addr)
+      if not found_versions:
         # Ignore non essential ecus
-        if ecu_type not in ESSENTIAL_ECUS:
-          continue
-
-      # Virtual debug ecu doesn't need to match the database
-      if ecu_type == Ecu.debug:
+        if essential:
+          break
         continue
 
-      if not any(found_version in expected_versions for found_version in found_versions):
-        invalid.add(candidate)
+      if ecu in extra:
+        expected_versions = expected_versions.union(extra[ecu])
+      if expected_versions.isdisjoint(found_versions):
         break
+    else:
+      matches.add(candidate)
 
-  return set(candidates.keys()) - invalid
+  return matches
 
 
 def match_fw_to_car(fw_versions: list[CarParams.CarFw], vin: str, allow_exact: bool = True,
@@ -152,11 +171,12 @@ def match_fw_to_car(fw_versions: list[CarParams.CarFw], vin: str, allow_exact: b
   if allow_fuzzy:
     exact_matches.append((False, match_fw_to_car_fuzzy))
 
+  fw_versions_dicts = {brand: build_fw_dict(fw_versions, filter_brand=brand) for brand in VERSIONS.keys()}
+
   for exact_match, match_func in exact_matches:
     # For each brand, attempt to fingerprint using all FW returned from its queries
     matches: set[str] = set()
-    for brand in VERSIONS.keys():
-      fw_versions_dict = build_fw_dict(fw_versions, filter_brand=brand)
+    for brand, fw_versions_dict in fw_versions_dicts.items():
       matches |= match_func(fw_versions_dict, match_brand=brand, log=log)
 
       # If specified and no matches so far, fall back to brand's fuzzy fingerprinting function
@@ -233,32 +253,56 @@ def get_fw_versions_ordered(can_recv: CanRecvCallable, can_send: CanSendCallable
 
   # Sort brands by number of matching ECUs first, then percentage of matching ECUs in the database
   # This allows brands with only one ECU to be queried first (e.g. Tesla)
-  for brand in sorted(brand_matches, key=lambda b: (brand_matches[b].count(True), brand_matches[b].count(True) / len(brand_matches[b])), reverse=True):
-    # Skip this brand if there are no matching present ECUs
-    if True not in brand_matches[brand]:
-      continue
-
-    car_fw = get_fw_versions(can_recv, can_send, set_obd_multiplexing, query_brand=brand, timeout=timeout, progress=progress)
-    all_car_fw.extend(car_fw)
-
-    # If there is a match using this brand's FW alone, finish querying early
-    _, matches = match_fw_to_car(car_fw, vin, log=False)
-    if len(matches) == 1:
-      break
+  # Skip brands if there are no matching present ECUs
+  brands = [brand for brand in sorted(brand_matches, key=lambda b: (brand_matches[b].count(True), brand_matches[b].count(True) / len(brand_matches[b])),
+                                      reverse=True) if True in brand_matches[brand]]
+
+  # Queries of less likely brands fill in where they don't conflict with more likely ones, but the FW of each brand
+  # is only checked (and kept) in order, so the result is the same as querying brand by brand
+  queries, ecu_types = [], {}
+  for brand in brands:
+    brand_queries, brand_ecu_types = _get_fw_queries({brand: VERSIONS[brand]}, brand)
+    queries += brand_queries
+    ecu_types.update(brand_ecu_types)
+
+  brand_queries_left = {brand: sum(q.brand == brand for q in queries) for brand in brands}
+  responses: dict[int, dict[AddrType, bytes]] = {}
+  for round_responses in _run_fw_queries(can_recv, can_send, set_obd_multiplexing, queries, timeout, progress):
+    responses.update(round_responses)
+    for i in round_responses:
+      brand_queries_left[queries[i].brand] -= 1
+
+    while len(brands) and brand_queries_left[brands[0]] == 0:
+      brand = brands.pop(0)
+      car_fw = [fw for i, q in enumerate(queries) if q.brand == brand for fw in _build_car_fw(q, responses[i], ecu_types)]
+      all_car_fw.extend(car_fw)
+
+      # If there is a match using this brand's FW alone, finish querying early
+      _, matches = match_fw_to_car(car_fw, vin, log=False)
+      if len(matches) == 1:
+        return all_car_fw
 
   return all_car_fw
 
 
-def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, query_brand: str | None = None,
-                    extra: OfflineFwVersions | None = None, timeout: float = 0.1, progress: bool = False) -> list[CarParams.CarFw]:
-  versions = VERSIONS.copy()
+@dataclass
+class FwQuery:
+  brand: str
+  request: Request
+  addrs: list[AddrType]
 
-  if query_brand is not None:
-    versions = {query_brand: versions[query_brand]}
+  @property
+  def obd_multiplexing(self) -> bool | None:
+    """The OBD multiplexing mode this query needs, if any. Only bus 1 (the OBD port) is multiplexed"""
+    return self.request.obd_multiplexing if self.request.bus % 4 == 1 else None
 
-  if extra is not None:
-    versions.update(extra)
+  def ecus(self) -> set[tuple[int, int]]:
+    """The (bus, address) pairs this query sends or expects responses on"""
+    r = self.request
+    return {(r.bus, a) for a, _ in self.addrs} | {(r.bus, uds.get_rx_addr_for_tx_addr(a, r.rx_offset)) for a, _ in self.addrs}
 
+
+def _get_fw_queries(versions: OfflineFwVersions, query_brand: str | None) -> tuple[list[FwQuery], dict[tuple[str, int, int | None], Ecu]]:
   # Extract ECU addresses to query from fingerprints
   # ECUs using a subaddress need be queried one by one, the rest can be done in parallel
   addrs = []
@@ -281,40 +325,119 @@ def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_ob
 
   addrs.insert(0, parallel_addrs)
 
-  # Get versions and build capnp list to put into CarParams
-  car_fw = []
+  queries = []
   requests = [(brand, config, r) for brand, config, r in REQUESTS if is_brand(brand, query_brand)]
-  for addr_group in tqdm(addrs, disable=not progress):  # split by subaddr, if any
+  for addr_group in addrs:  # split by subaddr, if any
     for addr_chunk in chunks(addr_group):
-      for brand, config, r in requests:
-        # Toggle OBD multiplexing for each request
-        if r.bus % 4 == 1:
-          set_obd_multiplexing(r.obd_multiplexing)
-
-        try:
-          query_addrs = [(a, s) for (b, a, s) in addr_chunk if b in (brand, 'any') and
-                         (len(r.whitelist_ecus) == 0 or ecu_types[(b, a, s)] in r.whitelist_ecus)]
-
-          if query_addrs:
-            query = IsoTpParallelQuery(can_send, can_recv, r.bus, query_addrs, r.request, r.response, r.rx_offset)
-            for (tx_addr, sub_addr), version in query.get_data(timeout).items():
-              f = CarParams.CarFw()
-
-              f.ecu = ecu_types.get((brand, tx_addr, sub_addr), Ecu.unknown)
-              f.fwVersion = version
-              f.address = tx_addr
-              f.responseAddress = uds.get_rx_addr_for_tx_addr(tx_addr, r.rx_offset)
-              f.request = r.request
-              f.brand = brand
-              f.bus = r.bus
-              f.logging = r.logging or (f.ecu, tx_addr, sub_addr) in config.extra_ecus
-              f.obdMultiplexing = r.obd_multiplexing
-
-              if sub_addr is not None:
-                f.subAddress = sub_addr
-
-              car_fw.append(f)
-        except Exception:
-          carlog.exception("FW query exception")
-
+      for brand, _, r in requests:
+        query_addrs = [(a, s) for (b, a, s) in addr_chunk if b in (brand, 'any') and
+                       (len(r.whitelist_ecus) == 0 or ecu_types[(b, a, s)] in r.whitelist_ecus)]
+        if query_addrs:
+          queries.append(FwQuery(brand, r, query_addrs))
+  return queries, ecu_types
+
+
+def schedule_fw_queries(queries: list[FwQuery], max_addrs: int = 128) -> list[list[int]]:
+  """Packs queries (by index) into rounds that can run at once. Queries in a round don't share an ECU, OBD port
+     queries in a round need the same OBD multiplexing mode, and a round queries at most max_addrs addresses.
+     A query sharing an ECU with an earlier query always runs in a later round.
+  """
+  rounds: list[list[int]] = []
+  modes: list[bool | None] = []
+  sizes: list[int] = []
+  last_round: dict[tuple[int, int], int] = {}
+
+  for i, query in enumerate(queries):
+    ecus = query.ecus()
+    mode = query.obd_multiplexing
+    # rounds after the last one using any of these ECUs are free of them
+    j = max((last_round[ecu] + 1 for ecu in ecus if ecu in last_round), default=0)
+    while j < len(rounds) and ((mode is not None and modes[j] not in (None, mode)) or sizes[j] + len(query.addrs) > max_addrs):
+      j += 1
+    if j == len(rounds):
+      rounds.append([])
+      modes.append(None)
+      sizes.append(0)
+
+    rounds[j].append(i)
+    sizes[j] += len(query.addrs)
+    if mode is not None:
+      modes[j] = mode
+    for ecu in ecus:
+      last_round[ecu] = j
+  return rounds
+
+
+def _run_fw_queries(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, queries: list[FwQuery],
+                    timeout: float, progress: bool) -> Iterator[dict[int, dict[AddrType, bytes]]]:
+  """Runs the queries round by round, yielding the responses of each round by query index"""
+  obd_multiplexing = None
+  for round_queries in tqdm(schedule_fw_queries(queries), disable=not progress):
+    # Toggle OBD multiplexing once per round, and only when it changes
+    mode = next((queries[i].obd_multiplexing for i in round_queries if queries[i].obd_multiplexing is not None), None)
+    if mode is not None and mode != obd_multiplexing:
+      set_obd_multiplexing(mode)
+      obd_multiplexing = mode
+
+    round_responses: dict[int, dict[AddrType, bytes]] = {i: {} for i in round_queries}
+    isotp_queries: dict[int, IsoTpParallelQuery] = {}
+    for i in round_queries:
+      try:
+        isotp_queries[i] = IsoTpParallelQuery(can_send, can_recv, queries[i].request.bus, queries[i].addrs, queries[i].request.request,
+                                              queries[i].request.response, queries[i].request.rx_offset)
+      except Exception:
+        carlog.exception("FW query exception")
+
+    if len(isotp_queries):
+      try:
+        results = get_data_concurrent(list(isotp_queries.values()), timeout)
+      except Exception:
+        carlog.exception("FW query exception")
+        # keep the responses that completed before the round was cut short
+        results = [query.results for query in isotp_queries.values()]
+      round_responses.update(zip(isotp_queries, results, strict=True))
+    yield round_responses
+
+
+def _build_car_fw(query: FwQuery, responses: dict[AddrType, bytes], ecu_types: dict[tuple[str, int, int | None], Ecu]) -> list[CarParams.CarFw]:
+  brand, r = query.brand, query.request
+  config = FW_QUERY_CONFIGS[brand]
+  car_fw = []
+  for (tx_addr, sub_addr), version in responses.items():
+    f = CarParams.CarFw()
+
+    f.ecu = ecu_types.get((brand, tx_addr, sub_addr), Ecu.unknown)
+    f.fwVersion = version
+    f.address = tx_addr
+    f.responseAddress = uds.get_rx_addr_for_tx_addr(tx_addr, r.rx_offset)
+    f.request = r.request
+    f.brand = brand
+    f.bus = r.bus
+    f.logging = r.logging or (f.ecu, tx_addr, sub_addr) in config.extra_ecus
+    f.obdMultiplexing = r.obd_multiplexing
+
+    if sub_addr is not None:
+      f.subAddress = sub_addr
+
+    car_fw.append(f)
   return car_fw
+
+
+def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, query_brand: str | None = None,
+                    extra: OfflineFwVersions | None = None, timeout: float = 0.1, progress: bool = False) -> list[CarParams.CarFw]:
+  versions = VERSIONS.copy()
+
+  if query_brand is not None:
+    versions = {query_brand: versions[query_brand]}
+
+  if extra is not None:
+    versions.update(extra)
+
+  # Queries that don't share an ECU run concurrently, see schedule_fw_queries
+  queries, ecu_types = _get_fw_queries(versions, query_brand)
+  responses: dict[int, dict[AddrType, bytes]] = {}
+  for round_responses in _run_fw_queries(can_recv, can_send, set_obd_multiplexing, queries, timeout, progress):
+    responses.update(round_responses)
+
+  # Get versions and build capnp list to put into CarParams, in query order
+  return [fw for i, query in enumerate(queries) for fw in _build_car_fw(query, responses[i], ecu_types)]
@@ -233,18 +233,14 @@ def create_adrv_messages(packer, CAN, frame):
   return ret
 
 
+# final XOR value of the checksum, by message length
+HKG_CAN_FD_CHECKSUM_XOR = {8: 0x5F29, 16: 0x041D, 24: 0x819D, 32: 0x9F5B}
+
+
 def hkg_can_fd_checksum(address: int, sig, d: bytearray) -> int:
   crc = 0
   for i in range(2, len(d)):
     crc = ((crc << 8) ^ CRC16_XMODEM[(crc >> 8) ^ d[i]]) & 0xFFFF
   crc = ((crc << 8) ^ CRC16_XMODEM[(crc >> 8) ^ ((address >> 0) & 0xFF)]) & 0xFFFF
   crc = ((crc << 8) ^ CRC16_XMODEM[(crc >> 8) ^ ((address >> 8) & 0xFF)]) & 0xFFFF
-  if len(d) == 8:
-    crc ^= 0x5F29
-  elif len(d) == 16:
-    crc ^= 0x041D
-  elif len(d) == 24:
-    crc ^= 0x819D
-  elif len(d) == 32:
-    crc ^= 0x9F5B
-  return crc
+  return crc ^ HKG_CAN_FD_CHECKSUM_XOR.get(len(d), 0)
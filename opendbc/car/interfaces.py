@@ -15,7 +15,7 @@ from opendbc.car.common.basedir import BASEDIR
 from opendbc.car.common.conversions import Conversions as CV
 from opendbc.car.common.simple_kalman import KF1D, get_kalman_gain
 from opendbc.car.values import PLATFORMS
-from opendbc.can import CANParser
+from opendbc.can import CANDispatcher, CANParser
 
 GearShifter = structs.CarState.GearShifter
 ButtonType = structs.CarState.ButtonEvent.Type
@@ -106,6 +106,8 @@ class CarInterfaceBase(ABC):
 
     self.CS: CarStateBase = self.CarState(CP)
     self.can_parsers: dict[StrEnum, CANParser] = self.CS.get_can_parsers(CP)
+    # parses each frame once for all the parsers
+    self.can_dispatcher = CANDispatcher(self.can_parsers.values())
 
     dbc_names = {bus: cp.dbc_name for bus, cp in self.can_parsers.items()}
     self.CC: CarControllerBase = self.CarController(dbc_names, CP)
@@ -233,9 +235,7 @@ class CarInterfaceBase(ABC):
 
   def update(self, can_packets: list[tuple[int, list[CanData]]]) -> structs.CarState:
     # parse can
-    for cp in self.can_parsers.values():
-      if cp is not None:
-        cp.update(can_packets)
+    self.can_dispatcher.update(can_packets)
 
     # get CarState
     ret = self.CS.update(self.can_parsers)
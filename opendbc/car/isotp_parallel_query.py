@@ -1,5 +1,8 @@
+import heapq
+import itertools
 import time
 from collections import defaultdict
+from collections.abc import Callable
 from functools import partial
 
 from opendbc.car import uds
@@ -7,6 +10,9 @@ from opendbc.car.can_definitions import CanData, CanRecvCallable, CanSendCallabl
 from opendbc.car.carlog import carlog
 from opendbc.car.fw_query_definitions import AddrType
 
+# how long to sleep when can_recv returns without waiting for a packet
+RECV_POLL_INTERVAL = 0.001
+
 
 class IsoTpParallelQuery:
   def __init__(self, can_send: CanSendCallable, can_recv: CanRecvCallable, bus: int, addrs: list[int] | list[AddrType],
@@ -25,16 +31,11 @@ class IsoTpParallelQuery:
       assert tx_addr not in uds.FUNCTIONAL_ADDRS, f"Functional address should be defined in functional_addrs: {hex(tx_addr)}"
 
     self.msg_addrs = {tx_addr: uds.get_rx_addr_for_tx_addr(tx_addr[0], rx_offset=response_offset) for tx_addr in real_addrs}
+    self.rx_to_tx_addrs: dict[int, list[AddrType]] = defaultdict(list)  # ECUs with sub-addresses share an rx address
+    for tx_addr, rx_addr in self.msg_addrs.items():
+      self.rx_to_tx_addrs[rx_addr].append(tx_addr)
     self.msg_buffer: dict[int, list[CanData]] = defaultdict(list)
-
-  def rx(self) -> None:
-    """Drain can socket and sort messages into buffers based on address"""
-    can_packets = self.can_recv(wait_for_one=True)
-
-    for packet in can_packets:
-      for msg in packet:
-        if msg.src == self.bus and msg.address in self.msg_addrs.values():
-          self.msg_buffer[msg.address].append(CanData(msg.address, msg.dat, msg.src))
+    self.results: dict[AddrType, bytes] = {}
 
   def _can_tx(self, tx_addr: int, dat: bytes, bus: int):
     """Helper function to send single message"""
@@ -60,10 +61,6 @@ class IsoTpParallelQuery:
     self.msg_buffer[addr] = keep_msgs
     return msgs
 
-  def _drain_rx(self) -> None:
-    self.can_recv()
-    self.msg_buffer = defaultdict(list)
-
   def _create_isotp_msg(self, tx_addr: int, sub_addr: int | None, rx_addr: int):
     can_client = uds.CanClient(self._can_tx, partial(self._can_rx, rx_addr, sub_addr=sub_addr), tx_addr, rx_addr,
                                self.bus, sub_addr=sub_addr)
@@ -74,97 +71,198 @@ class IsoTpParallelQuery:
     return uds.IsoTpMessage(can_client, timeout=0, separation_time=0.01)
 
   def get_data(self, timeout: float, total_timeout: float = 60.) -> dict[AddrType, bytes]:
-    self._drain_rx()
+    return get_data_concurrent([self], timeout, total_timeout)[0]
 
-    # Create message objects
-    msgs = {}
-    request_counter = {}
-    request_done = {}
-    for tx_addr, rx_addr in self.msg_addrs.items():
-      msgs[tx_addr] = self._create_isotp_msg(*tx_addr, rx_addr)
-      request_counter[tx_addr] = 0
-      request_done[tx_addr] = False
+  def _start(self, timeout: float) -> None:
+    self.timeout = timeout
+    self.msg_buffer = defaultdict(list)
+    self.updated_rx_addrs: set[int] = set()  # addresses with buffered frames, filled by the receive loop
+
+    self.msgs = {}
+    self.request_counter = {}
+    self.results: dict[AddrType, bytes] = {}
+    self.addrs_responded = set()  # track addresses that have ever sent a valid iso-tp frame for timeout logging
+    start_time = time.monotonic()
 
-    # Send first request to functional addrs, subsequent responses are handled on physical addrs
     if len(self.functional_addrs):
+      # Send first request to functional addrs, subsequent responses are handled on physical addrs. Their
+      # IsoTpMessages are only set up once a response arrives, see _add_responders
       for addr in self.functional_addrs:
         self._create_isotp_msg(addr, None, -1).send(self.request[0])
+      self.pending_addrs = set()
+      self.listen_until = start_time + timeout
+    else:
+      # Send first frame (single or first) to all addresses and receive asynchronously in the loop below
+      self.pending_addrs = set(self.msg_addrs)
+      self.listen_until = start_time
+      for tx_addr, rx_addr in self.msg_addrs.items():
+        self.msgs[tx_addr] = self._create_isotp_msg(*tx_addr, rx_addr)
+        self.msgs[tx_addr].send(self.request[0])
+        self.request_counter[tx_addr] = 0
 
-    # Send first frame (single or first) to all addresses and receive asynchronously in the loop below.
-    # If querying functional addrs, only set up physical IsoTpMessages to send consecutive frames
-    for msg in msgs.values():
-      msg.send(self.request[0], setup_only=len(self.functional_addrs) > 0)
+    # extending a timeout pushes a new deadline, stale ones are skipped when popped
+    self.response_timeouts = {tx_addr: start_time + timeout for tx_addr in self.pending_addrs}
+    self.deadlines = [(start_time + timeout, i, tx_addr) for i, tx_addr in enumerate(self.pending_addrs)]
+    self.deadlines.append((self.listen_until, len(self.deadlines), None))
+    heapq.heapify(self.deadlines)
+    self.deadline_counter = itertools.count(len(self.deadlines))
 
-    results = {}
-    start_time = time.monotonic()
-    addrs_responded = set()  # track addresses that have ever sent a valid iso-tp frame for timeout logging
-    response_timeouts = {tx_addr: start_time + timeout for tx_addr in self.msg_addrs}
-    while True:
-      self.rx()
-
-      for tx_addr, msg in msgs.items():
-        try:
-          dat, rx_in_progress = msg.recv()
-        except Exception:
-          carlog.exception(f"Error processing UDS response: {tx_addr}")
-          request_done[tx_addr] = True
+  def _add_responders(self, rx_addrs: set[int]) -> None:
+    """Sets up the physical IsoTpMessages of addresses responding to a functional request, to send consecutive frames"""
+    for rx_addr in rx_addrs:
+      for tx_addr in self.rx_to_tx_addrs[rx_addr]:
+        if tx_addr in self.msgs:
           continue
+        # setting up drains the client, keep the frames that were just received
+        buffered = self.msg_buffer.pop(rx_addr, [])
+        self.msgs[tx_addr] = self._create_isotp_msg(*tx_addr, rx_addr)
+        self.msgs[tx_addr].send(self.request[0], setup_only=True)
+        self.msg_buffer[rx_addr] = buffered
+        self.request_counter[tx_addr] = 0
+        self.pending_addrs.add(tx_addr)
+        self.response_timeouts[tx_addr] = self.listen_until
+        heapq.heappush(self.deadlines, (self.listen_until, next(self.deadline_counter), tx_addr))
 
-        # Extend timeout for each consecutive ISO-TP frame to avoid timing out on long responses
-        if rx_in_progress:
-          addrs_responded.add(tx_addr)
-          response_timeouts[tx_addr] = time.monotonic() + timeout
+  def _set_timeout(self, tx_addr: AddrType, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    self.response_timeouts[tx_addr] = deadline
+    heapq.heappush(self.deadlines, (deadline, next(self.deadline_counter), tx_addr))
 
-        if dat is None:
-          continue
+  def _stop_listening(self) -> None:
+    """Stops setting up new responders to a functional request"""
+    self.listen_until = min(self.listen_until, time.monotonic())
 
-        # Log unexpected empty responses
-        if len(dat) == 0:
-          carlog.error(f"iso-tp query empty response: {tx_addr}")
-          request_done[tx_addr] = True
-          continue
+  def _receiving(self) -> bool:
+    """True while a pending address is partway through its response"""
+    return any(tx_addr in self.addrs_responded or self.request_counter[tx_addr] > 0 for tx_addr in self.pending_addrs)
+
+  def _next_deadline(self) -> float:
+    return self.deadlines[0][0] if len(self.deadlines) else float("inf")
+
+  def _update(self) -> bool:
+    """Processes the buffered frames, returns True when all requests are done (finished or timed out)"""
+    timeout = self.timeout
+    request_counter = self.request_counter
+    pending_addrs = self.pending_addrs
+
+    cur_time = time.monotonic()
+    if cur_time < self.listen_until:
+      self._add_responders(self.updated_rx_addrs)
 
-        counter = request_counter[tx_addr]
-        expected_response = self.response[counter]
-        response_valid = dat.startswith(expected_response)
-
-        if response_valid:
-          if counter + 1 < len(self.request):
-            response_timeouts[tx_addr] = time.monotonic() + timeout
-            msg.send(self.request[counter + 1])
-            request_counter[tx_addr] += 1
-          else:
-            results[tx_addr] = dat[len(expected_response):]
-            request_done[tx_addr] = True
+    updated_tx_addrs = [tx_addr for rx_addr in self.updated_rx_addrs for tx_addr in self.rx_to_tx_addrs[rx_addr] if tx_addr in self.msgs]
+    self.updated_rx_addrs.clear()
+    for tx_addr in updated_tx_addrs:
+      msg = self.msgs[tx_addr]
+      try:
+        dat, rx_in_progress = msg.recv()
+      except Exception:
+        carlog.exception(f"Error processing UDS response: {tx_addr}")
+        pending_addrs.discard(tx_addr)
+        continue
+
+      # Extend timeout for each consecutive ISO-TP frame to avoid timing out on long responses
+      if rx_in_progress:
+        self.addrs_responded.add(tx_addr)
+        self._set_timeout(tx_addr, timeout)
+
+      if dat is None:
+        continue
+
+      # Log unexpected empty responses
+      if len(dat) == 0:
+        carlog.error(f"iso-tp query empty response: {tx_addr}")
+        pending_addrs.discard(tx_addr)
+        continue
+
+      counter = request_counter[tx_addr]
+      expected_response = self.response[counter]
+      response_valid = dat.startswith(expected_response)
+
+      if response_valid:
+        if counter + 1 < len(self.request):
+          self._set_timeout(tx_addr, timeout)
+          msg.send(self.request[counter + 1])
+          request_counter[tx_addr] += 1
         else:
-          error_code = dat[2] if len(dat) > 2 else -1
-          if error_code == 0x78:
-            response_timeouts[tx_addr] = time.monotonic() + self.response_pending_timeout
-            carlog.error(f"iso-tp query response pending: {tx_addr}")
-          else:
-            request_done[tx_addr] = True
-            carlog.error(f"iso-tp query bad response: {tx_addr} - 0x{dat.hex()}")
-
-      # Mark request done if address timed out
-      cur_time = time.monotonic()
-      for tx_addr in response_timeouts:
-        if cur_time - response_timeouts[tx_addr] > 0:
-          if not request_done[tx_addr]:
-            if request_counter[tx_addr] > 0:
-              carlog.error(f"iso-tp query timeout after receiving partial response: {tx_addr}")
-            elif tx_addr in addrs_responded:
-              carlog.error(f"iso-tp query timeout while receiving response: {tx_addr}")
-            # TODO: handle functional addresses
-            # else:
-            #   carlog.error(f"iso-tp query timeout with no response: {tx_addr}")
-          request_done[tx_addr] = True
-
-      # Break if all requests are done (finished or timed out)
-      if all(request_done.values()):
-        break
-
-      if cur_time - start_time > total_timeout:
-        carlog.error("iso-tp query timeout while receiving data")
-        break
-
-    return results
+          self.results[tx_addr] = dat[len(expected_response):]
+          pending_addrs.discard(tx_addr)
+      else:
+        error_code = dat[2] if len(dat) > 2 else -1
+        if error_code == 0x78:
+          self._set_timeout(tx_addr, self.response_pending_timeout)
+          carlog.error(f"iso-tp query response pending: {tx_addr}")
+        else:
+          pending_addrs.discard(tx_addr)
+          carlog.error(f"iso-tp query bad response: {tx_addr} - 0x{dat.hex()}")
+
+    # Mark request done if address timed out
+    cur_time = time.monotonic()
+    deadlines = self.deadlines
+    while len(deadlines) and cur_time >= deadlines[0][0]:
+      deadline, _, tx_addr = heapq.heappop(deadlines)
+      if tx_addr not in pending_addrs or deadline != self.response_timeouts[tx_addr]:
+        continue
+      if request_counter[tx_addr] > 0:
+        carlog.error(f"iso-tp query timeout after receiving partial response: {tx_addr}")
+      elif tx_addr in self.addrs_responded:
+        carlog.error(f"iso-tp query timeout while receiving response: {tx_addr}")
+      # TODO: handle functional addresses
+      # else:
+      #   carlog.error(f"iso-tp query timeout with no response: {tx_addr}")
+      pending_addrs.discard(tx_addr)
+
+    return not len(pending_addrs) and cur_time >= self.listen_until
+
+
+def get_data_concurrent(queries: list[IsoTpParallelQuery], timeout: float, total_timeout: float = 60.,
+                        stop: Callable[[], bool] | None = None) -> list[dict[AddrType, bytes]]:
+  """Runs several queries at once, sharing one receive loop that sorts frames by bus and rx address.
+     The queries must use the same can_recv, and not expect responses on the same bus and address.
+
+     Only addresses that received frames are processed, and timeouts are kept in a heap. If can_recv returns without
+     waiting for a packet, the loop sleeps until the next poll or deadline instead of spinning. Once stop() is true, no
+     new responders are set up and it returns with the results so far when the responses being received are done.
+  """
+  # (bus, rx_addr) -> query waiting on it
+  buffers: dict[tuple[int, int], IsoTpParallelQuery] = {}
+  for query in queries:
+    for rx_addr in query.rx_to_tx_addrs:
+      assert (query.bus, rx_addr) not in buffers, f"Concurrent queries expect responses on the same address: {query.bus}, {hex(rx_addr)}"
+      buffers[(query.bus, rx_addr)] = query
+
+  can_recv = queries[0].can_recv
+  can_recv()  # drain
+  for query in queries:
+    query._start(timeout)
+
+  start_time = time.monotonic()
+  pending = list(queries)
+  stopping = False
+  while len(pending):
+    packets = can_recv(wait_for_one=True)
+    for packet in packets:
+      for msg in packet:
+        query = buffers.get((msg.src, msg.address))
+        if query is not None:
+          query.msg_buffer[msg.address].append(CanData(msg.address, msg.dat, msg.src))
+          query.updated_rx_addrs.add(msg.address)
+
+    pending = [query for query in pending if not query._update()]
+    if not stopping and stop is not None and stop():
+      stopping = True
+      for query in pending:
+        query._stop_listening()
+    if stopping:
+      # don't cut off responders in the middle of a multi-frame response
+      pending = [query for query in pending if query._receiving()]
+
+    cur_time = time.monotonic()
+    if len(pending) and cur_time - start_time > total_timeout:
+      carlog.error("iso-tp query timeout while receiving data")
+      break
+
+    if not len(packets) and len(pending):
+      next_deadline = min(query._next_deadline() for query in pending)
+      time.sleep(min(max(next_deadline - cur_time, 0.), RECV_POLL_INTERVAL))
+
+  return [query.results for query in queries]
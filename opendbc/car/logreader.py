@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
+import heapq
 import os
 import capnp
+import struct
 import urllib.parse
 import warnings
+from collections.abc import Iterator
 from urllib.request import urlopen
 import zstandard as zstd
 
@@ -10,6 +13,11 @@ from opendbc.car.common.basedir import BASEDIR
 
 capnp_log = capnp.load(os.path.join(BASEDIR, "rlog.capnp"))
 
+# https://github.com/facebook/zstd/blob/dev/doc/zstd_compression_format.md#zstandard-frames
+ZSTD_MAGIC = b'\x28\xB5\x2F\xFD'
+CHUNK_SIZE = 1 << 20  # decompressed bytes parsed at a time when streaming
+SORT_WINDOW = 4096  # events buffered to sort by time when streaming
+
 
 def decompress_stream(data: bytes):
   dctx = zstd.ZstdDecompressor()
@@ -21,47 +29,103 @@ def decompress_stream(data: bytes):
   return decompressed_data
 
 
-class LogReader:
-  def __init__(self, fn, only_union_types=False, sort_by_time=False):
-    self._only_union_types = only_union_types
-    _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
-
-    if fn.startswith("http"):
-      with urlopen(fn) as f:
-        dat = f.read()
-    else:
-      with open(fn, "rb") as f:
-        dat = f.read()
-
-    if ext == ".zst" or dat.startswith(b'\x28\xB5\x2F\xFD'):
-      # https://github.com/facebook/zstd/blob/dev/doc/zstd_compression_format.md#zstandard-frames
-      dat = decompress_stream(dat)
-
-    ents = capnp_log.Event.read_multiple_bytes(dat)
+def _complete_messages_len(buf: bytes | memoryview) -> int:
+  """Length of the complete capnp messages at the start of buf, from their segment tables"""
+  pos, size = 0, len(buf)
+  while pos + 4 <= size:
+    segments = struct.unpack_from("<I", buf, pos)[0] + 1
+    header_len = (4 + 4 * segments + 7) & ~7
+    if pos + header_len > size:
+      break
+    msg_len = header_len + 8 * sum(struct.unpack_from(f"<{segments}I", buf, pos + 4))
+    if pos + msg_len > size:
+      break
+    pos += msg_len
+  return pos
+
+
+def _sorted_window(events: Iterator, window: int) -> Iterator:
+  """Sorts by logMonoTime, assuming events are never more than `window` events out of order"""
+  heap: list = []
+  for i, e in enumerate(events):
+    heapq.heappush(heap, (e.logMonoTime, i, e))
+    if len(heap) > window:
+      yield heapq.heappop(heap)[2]
+  while heap:
+    yield heapq.heappop(heap)[2]
 
-    self._ents = []
-    try:
-      for e in ents:
-        self._ents.append(e)
-    except capnp.KjException:
-      warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
 
-    if sort_by_time:
-      self._ents.sort(key=lambda x: x.logMonoTime)
+class LogReader:
+  """Reads an rlog or qlog, optionally zstd compressed, from a path or URL.
 
-  def __iter__(self):
-    for ent in self._ents:
-      if self._only_union_types:
+     By default, all events are read into memory. With streaming=True, the file is decompressed and parsed in chunks
+     on each iteration instead, which keeps memory constant regardless of log length. sort_by_time then sorts within
+     a window of sort_window events, rather than the whole log."""
+  def __init__(self, fn, only_union_types=False, sort_by_time=False, streaming=False, sort_window=SORT_WINDOW):
+    self._fn = fn
+    self._only_union_types = only_union_types
+    self._sort_by_time = sort_by_time
+    self._streaming = streaming
+    self._sort_window = sort_window
+    _, self._ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+
+    self._ents = None
+    if not streaming:
+      self._ents = list(self._read())
+      if sort_by_time:
+        self._ents.sort(key=lambda x: x.logMonoTime)
+
+  def _open(self):
+    return urlopen(self._fn) if self._fn.startswith("http") else open(self._fn, "rb")
+
+  def _read(self) -> Iterator:
+    with self._open() as f:
+      reader = f
+      if self._ext == ".zst" or f.peek(4)[:4] == ZSTD_MAGIC:
+        reader = zstd.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+
+      buf = b""
+      while True:
+        chunk = reader.read(CHUNK_SIZE)
+        buf = buf + chunk if buf else chunk
+        end = _complete_messages_len(buf)
         try:
-          ent.which()
-          yield ent
+          if end:
+            yield from capnp_log.Event.read_multiple_bytes(buf[:end])
+        except capnp.KjException:
+          warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+          return
+        buf = buf[end:]
+        if not chunk:
+          break
+
+      if buf:
+        warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+
+  def _events(self, msg_type: str | None = None) -> Iterator:
+    ents = self._ents if self._ents is not None else self._read()
+    for ent in ents:
+      if self._only_union_types or msg_type is not None:
+        try:
+          which = ent.which()
         except capnp.lib.capnp.KjException:
-          pass
-      else:
-        yield ent
+          continue
+        if msg_type is not None and which != msg_type:
+          continue
+      yield ent
+
+  def _iter(self, msg_type: str | None = None) -> Iterator:
+    # skip other types before sorting, so only matching events are buffered
+    events = self._events(msg_type)
+    if self._streaming and self._sort_by_time:
+      events = _sorted_window(events, self._sort_window)
+    return events
+
+  def __iter__(self):
+    return self._iter()
 
   def filter(self, msg_type: str):
-    return (getattr(m, m.which()) for m in filter(lambda m: m.which() == msg_type, self))
+    return (getattr(m, msg_type) for m in self._iter(msg_type))
 
   def first(self, msg_type: str):
     return next(self.filter(msg_type), None)
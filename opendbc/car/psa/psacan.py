@@ -1,5 +1,8 @@
+PSA_CHECKSUM_INIT = {0x452: 0x4, 0x38D: 0x7, 0x42D: 0xC}
+
+
 def psa_checksum(address: int, sig, d: bytearray) -> int:
-  chk_ini = {0x452: 0x4, 0x38D: 0x7, 0x42D: 0xC}.get(address, 0xB)
+  chk_ini = PSA_CHECKSUM_INIT.get(address, 0xB)
   byte = sig.start_bit // 8
   d[byte] &= 0x0F if sig.start_bit % 8 >= 4 else 0xF0
   checksum = sum((b >> 4) + (b & 0xF) for b in d)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""End-to-end FW fingerprinting time per brand, against a simulated network of the brand's ECUs.
+
+  python -m opendbc.car.tests.benchmark_fw_query                       # a platform per brand
+  python -m opendbc.car.tests.benchmark_fw_query --brand toyota --latency 0.02 --pending-rate 0.5
+  python -m opendbc.car.tests.benchmark_fw_query --platform HONDA_CIVIC --drop-rate 0.01 --json out.json
+
+Runs what car_helpers.fingerprint does before CAN fingerprinting: get_vin, get_present_ecus, get_fw_versions_ordered
+and match_fw_to_car. Times are in virtual seconds, so they are exact and don't depend on the machine.
+"""
+import argparse
+import json
+import random
+import sys
+from collections.abc import Iterable, Iterator
+
+from opendbc.car.fw_versions import VERSIONS, get_fw_versions_ordered, get_present_ecus, match_fw_to_car
+from opendbc.car.tests.ecu_sim import SimulatedCanNetwork, ecus_for_platform
+from opendbc.car.vin import get_vin
+
+TEST_VIN = "1GBHK26L5EF123456"
+
+Metrics = dict[str, float]
+
+
+def default_platforms(brands: Iterable[str] | None = None) -> list[str]:
+  """The first platform with FW versions of each brand"""
+  return [next(p for p, fw in VERSIONS[brand].items() if len(fw)) for brand in (brands or sorted(VERSIONS))
+          if any(len(fw) for fw in VERSIONS[brand].values())]
+
+
+def benchmark_platform(platform: str, seed: int = 0, **ecu_kwargs) -> Metrics:
+  rng = random.Random(seed)
+  network = SimulatedCanNetwork(ecus_for_platform(platform, vin=TEST_VIN, rng=rng, **ecu_kwargs), seed=seed)
+  metrics: Metrics = {}
+  with network.patch_time():
+    network.set_obd_multiplexing(True)
+    start = network.now
+    _, _, vin = get_vin(network.can_recv, network.can_send, (0, 1))
+    metrics["vin_s"] = network.now - start
+
+    start = network.now
+    ecu_rx_addrs = get_present_ecus(network.can_recv, network.can_send, network.set_obd_multiplexing)
+    metrics["present_ecus_s"] = network.now - start
+
+    start = network.now
+    car_fw = get_fw_versions_ordered(network.can_recv, network.can_send, network.set_obd_multiplexing, vin, ecu_rx_addrs)
+    metrics["fw_s"] = network.now - start
+
+  exact_match, matches = match_fw_to_car(car_fw, vin, log=False)
+  metrics["total_s"] = metrics["vin_s"] + metrics["present_ecus_s"] + metrics["fw_s"]
+  metrics["vin_ok"] = float(vin == TEST_VIN)
+  metrics["match_ok"] = float(matches == {platform})
+  metrics["exact_match"] = float(exact_match and matches == {platform})
+  metrics["ecus_present"] = len(ecu_rx_addrs)
+  metrics["fw_count"] = len(car_fw)
+  metrics["frames_sent"] = network.frames_sent
+  metrics["frames_received"] = network.frames_received
+  metrics["obd_multiplexing_changes"] = network.obd_multiplexing_changes
+  return metrics
+
+
+def run(platforms: list[str], seed: int = 0, **ecu_kwargs) -> Iterator[tuple[str, Metrics]]:
+  for platform in platforms:
+    yield platform, benchmark_platform(platform, seed, **ecu_kwargs)
+
+
+def main(argv: list[str] | None = None) -> int:
+  parser = argparse.ArgumentParser(description="Benchmark FW fingerprinting on a simulated CAN network",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--brand", action="append", help="Benchmark the first platform with FW of this brand. Can be repeated")
+  parser.add_argument("--platform", action="append", help="Benchmark this platform. Can be repeated")
+  parser.add_argument("--seed", type=int, default=0, help="Seeds the FW versions ECUs respond with, and which responses are pending or dropped")
+  parser.add_argument("--latency", type=float, default=0.005, help="ECU response latency, in seconds")
+  parser.add_argument("--separation-time", type=float, default=0., help="ECU separation time between consecutive frames, in seconds")
+  parser.add_argument("--pending-rate", type=float, default=0., help="Fraction of requests first answered with response pending")
+  parser.add_argument("--pending-time", type=float, default=0.05, help="Time between response pending and the response, in seconds")
+  parser.add_argument("--drop-rate", type=float, default=0., help="Fraction of ECU frames lost")
+  parser.add_argument("--json", help="Write results to this file")
+  args = parser.parse_args(argv)
+
+  platforms = (args.platform or []) + default_platforms(args.brand) if args.brand or not args.platform else args.platform
+  ecu_kwargs = {"response_latency": args.latency, "separation_time": args.separation_time, "response_pending_rate": args.pending_rate,
+                "response_pending_time": args.pending_time, "drop_rate": args.drop_rate}
+
+  results = {}
+  print(f"{'platform':<36} {'vin':>6} {'ecus':>6} {'fw':>6} {'total':>6}  {'frames':>7}  match")
+  for platform, metrics in run(platforms, args.seed, **ecu_kwargs):
+    results[platform] = metrics
+    match = "exact" if metrics["exact_match"] else "fuzzy" if metrics["match_ok"] else "FAIL"
+    print(f"{platform:<36} {metrics['vin_s']:>6.2f} {metrics['present_ecus_s']:>6.2f} {metrics['fw_s']:>6.2f} {metrics['total_s']:>6.2f}  " +
+          f"{metrics['frames_sent'] + metrics['frames_received']:>7.0f}  {match}{'' if metrics['vin_ok'] else ', no VIN'}")
+
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump(results, f, indent=2)
+  return 0 if all(m["match_ok"] for m in results.values()) else 1
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""ISO-TP throughput on a simulated bus, with classic CAN and CAN-FD frames.
+
+  python -m opendbc.car.tests.benchmark_isotp
+  python -m opendbc.car.tests.benchmark_isotp --size 4095 --size 100000 --separation-time 0.001
+
+Reads a DID of each size from an ECU (like a FW dump with request_upload and transfer_data), then writes a block of
+that size with transfer_data. The UdsClient negotiates the frame length from the ECU's responses. Times are in virtual
+seconds, and include the bus time of every frame.
+"""
+import argparse
+import sys
+from collections.abc import Iterator
+
+from opendbc.car import uds
+from opendbc.car.tests.ecu_sim import SimulatedCanNetwork, SimulatedEcu
+
+DID = uds.DATA_IDENTIFIER_TYPE.APPLICATION_SOFTWARE_IDENTIFICATION
+DEFAULT_SIZES = (256, 4095, 65536)
+TX_DLS = (8, 16, 32, 64)
+
+Metrics = dict[str, float]
+
+
+def benchmark_transfer(size: int, tx_dl: int, **ecu_kwargs) -> Metrics:
+  payload = bytes(i & 0xFF for i in range(size))
+  read_request = bytes([uds.SERVICE_TYPE.READ_DATA_BY_IDENTIFIER]) + DID.to_bytes(2)
+  # a write request of the same size as the read response
+  block = payload[:size - 2]
+  transfer_request = bytes([uds.SERVICE_TYPE.TRANSFER_DATA, 1]) + block
+  ecu = SimulatedEcu(0, 0x7E0, 0x7E8, {
+    read_request: bytes([read_request[0] + 0x40]) + read_request[1:] + payload[:size - 3],
+    transfer_request: bytes([transfer_request[0] + 0x40, 1]),
+  }, tx_dl=tx_dl, **ecu_kwargs)
+  network = SimulatedCanNetwork([ecu])
+  client = uds.UdsClient(network.panda(), 0x7E0, timeout=10)
+
+  metrics: Metrics = {}
+  with network.patch_time():
+    start, frames = network.now, network.frames_received
+    assert client.read_data_by_identifier(DID) == payload[:size - 3]
+    metrics["read_s"] = network.now - start
+    metrics["read_frames"] = network.frames_received - frames
+
+    start, frames = network.now, network.frames_sent
+    assert client.transfer_data(1, block) == b""
+    metrics["write_s"] = network.now - start
+    metrics["write_frames"] = network.frames_sent - frames
+  metrics["read_kbps"] = size / metrics["read_s"] / 1000
+  metrics["write_kbps"] = size / metrics["write_s"] / 1000
+  metrics["tx_dl"] = client.tx_dl
+  return metrics
+
+
+def run(sizes=DEFAULT_SIZES, tx_dls=TX_DLS, **ecu_kwargs) -> Iterator[tuple[str, Metrics]]:
+  for size in sizes:
+    for tx_dl in tx_dls:
+      yield f"{size}B/dl{tx_dl}", benchmark_transfer(size, tx_dl, **ecu_kwargs)
+
+
+def main(argv: list[str] | None = None) -> int:
+  parser = argparse.ArgumentParser(description="Benchmark ISO-TP throughput on a simulated bus", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--size", type=int, action="append", help=f"Bytes to transfer, defaults to {DEFAULT_SIZES}. Can be repeated")
+  parser.add_argument("--tx-dl", type=int, action="append", help=f"The ECU's frame length, defaults to {TX_DLS}. Can be repeated")
+  parser.add_argument("--latency", type=float, default=0.005, help="ECU response latency, in seconds")
+  parser.add_argument("--separation-time", type=float, default=0., help="ECU separation time between consecutive frames, in seconds")
+  args = parser.parse_args(argv)
+
+  print(f"{'transfer':<16} {'read s':>8} {'frames':>7} {'kB/s':>7}  {'write s':>8} {'frames':>7} {'kB/s':>7}")
+  for name, m in run(args.size or DEFAULT_SIZES, args.tx_dl or TX_DLS, response_latency=args.latency, separation_time=args.separation_time):
+    print(f"{name:<16} {m['read_s']:>8.3f} {m['read_frames']:>7.0f} {m['read_kbps']:>7.1f}  " +
+          f"{m['write_s']:>8.3f} {m['write_frames']:>7.0f} {m['write_kbps']:>7.1f}")
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
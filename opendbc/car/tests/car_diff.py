@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 import argparse
+import capnp
+import operator
 import os
 import pickle
 import re
@@ -7,6 +9,7 @@ import subprocess
 import sys
 import tempfile
 import traceback
+import numpy as np
 import zstandard as zstd
 from tqdm import tqdm
 from tqdm.contrib.concurrent import process_map
@@ -18,18 +21,21 @@ from typing import Any
 
 from opendbc.car import structs
 from opendbc.car.can_definitions import CanData
+from opendbc.car.can_frames import iter_can_data, read_can_frames
 from opendbc.car.car_helpers import can_fingerprint, interfaces
-from opendbc.car.logreader import LogReader, decompress_stream
+from opendbc.car.logreader import decompress_stream
 
 
 TOLERANCE = 1e-4
 DIFF_BUCKET = "car_diff"
 IGNORE_FIELDS = ["cumLagMs", "canErrorCounter"]
 PADDING = 5
+REF_VERSION = 2
+CHUNK_FRAMES = 1024  # replayed states are copied into the columns this many at a time
 
+Columns = dict[str, np.ndarray]  # flattened CarState field -> value per frame
 Diff = tuple[str, int, tuple[Any, Any], int]
-Ref = tuple[int, structs.CarState]
-Result = tuple[str, str, list[Diff], list[Ref] | None, list[structs.CarState] | None, str | None]
+Result = tuple[str, str, list[Diff], Columns | None, Columns | None, str | None]
 
 
 def dict_diff(d1: dict[str, Any], d2: dict[str, Any], path: str = "", ignore: list[str] | None = None, tolerance: float = 0) -> list[tuple]:
@@ -50,16 +56,123 @@ def dict_diff(d1: dict[str, Any], d2: dict[str, Any], path: str = "", ignore: li
   return diffs
 
 
-def load_can_messages(seg: str) -> list[Any]:
+def flatten(d: dict[str, Any], path: str = "", out: dict[str, Any] | None = None) -> dict[str, Any]:
+  out = {} if out is None else out
+  for key, v in d.items():
+    full_path = f"{path}.{key}" if path else key
+    if isinstance(v, dict):
+      flatten(v, full_path, out)
+    else:
+      out[full_path] = v
+  return out
+
+
+def to_columns(rows: list[dict[str, Any]]) -> Columns:
+  """Columns from flattened states. Bools stay bool, numbers become float64 and anything else (enums, lists) a string"""
+  columns = {}
+  for field in dict.fromkeys(k for row in rows for k in row):
+    vals = [row.get(field) for row in rows]
+    if all(isinstance(v, bool) for v in vals):
+      columns[field] = np.array(vals, dtype=bool)
+    elif all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in vals):
+      columns[field] = np.array(vals, dtype=np.float64)
+    else:
+      columns[field] = np.array([v if isinstance(v, str) else repr(v) for v in vals], dtype=str)
+  return columns
+
+
+def column_diffs(ref: Columns, new: Columns, ignore: list[str] | None = None, tolerance: float = 0) -> dict[str, np.ndarray]:
+  """Indices of the changed frames per field. Bools and numbers are compared within tolerance, other values exactly"""
+  ignore = ignore or []
+  changed = {}
+  for field in sorted(ref.keys() | new.keys()):
+    if any(k in ignore for k in field.split(".")):
+      continue
+    v1, v2 = ref.get(field), new.get(field)
+    if v1 is None or v2 is None:
+      # added or removed field
+      idxs = np.arange(len(v2 if v1 is None else v1))
+    elif v1.dtype.kind in "biuf" and v2.dtype.kind in "biuf":
+      v1, v2 = v1.astype(np.float64), v2.astype(np.float64)
+      idxs = np.flatnonzero(~(np.abs(v1 - v2) <= tolerance) & ~(np.isnan(v1) & np.isnan(v2)))
+    else:
+      idxs = np.flatnonzero(v1.astype(object) != v2.astype(object))
+    if len(idxs):
+      changed[field] = idxs
+  return changed
+
+
+def _value(column: np.ndarray | None, idx: int) -> Any:
+  return None if column is None else column[idx].item()
+
+
+def save_ref(ref_file: Path, cp: dict[str, Any], timestamps: np.ndarray, columns: Columns) -> None:
+  data = {"version": REF_VERSION, "cp": cp, "timestamps": timestamps, "columns": columns}
+  ref_file.write_bytes(zstd.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), 10))
+
+
+def load_ref(ref_file: Path) -> tuple[dict[str, Any], np.ndarray, Columns]:
+  data = pickle.loads(decompress_stream(ref_file.read_bytes()))
+  if "frames" in data:
+    # CarState lists, from before refs were columnar
+    timestamps = np.array([ts for ts, _ in data["frames"]], dtype=np.uint64)
+    return data["cp"], timestamps, to_columns([flatten(state.to_dict()) for _, state in data["frames"]])
+  return data["cp"], data["timestamps"], data["columns"]
+
+
+def load_can_frames(seg: str) -> tuple[np.ndarray, np.ndarray]:
   from comma_car_segments import get_url
   parts = seg.split("/")
   url = get_url(f"{parts[0]}/{parts[1]}", parts[2])
-  msgs = LogReader(url, only_union_types=True, sort_by_time=True)
-  return [m for m in msgs if m.which() == 'can']
-
-
-def replay_segment(platform: str, can_msgs: list[Any]) -> tuple[structs.CarParams, list[structs.CarState], list[int]]:
-  _can_msgs = ([CanData(can.address, can.dat, can.src) for can in m.can] for m in can_msgs)
+  # decoded once, then memory-mapped from the local cache
+  return read_can_frames(url)
+
+
+def _plain(v: Any) -> Any:
+  """A CarState value as to_dict() has it"""
+  if isinstance(v, capnp.lib.capnp._DynamicEnum):
+    return str(v)
+  if hasattr(v, "to_dict"):
+    return v.to_dict()
+  if isinstance(v, (capnp.lib.capnp._DynamicListBuilder, capnp.lib.capnp._DynamicListReader)):
+    return [_plain(x) for x in v]
+  return v
+
+
+class StateColumns:
+  """Columns of replayed CarStates, typed like to_columns. The fields come from the first state, later ones are read by attribute"""
+  def __init__(self, state: structs.CarState, n: int):
+    fields = flatten(state.to_dict())
+    self.fields = list(fields)
+    self.kinds = ["b" if isinstance(v, bool) else "f" if isinstance(v, (int, float)) else "U" for v in fields.values()]
+    self.buffers = [np.empty(n, dtype=bool if k == "b" else np.float64 if k == "f" else object) for k in self.kinds]
+    get = operator.attrgetter(*self.fields)
+    self._get = get if len(self.fields) > 1 else lambda state: (get(state),)
+    self._rows: list[tuple] = []
+    self._pos = 0
+
+  def add(self, state: structs.CarState) -> None:
+    self._rows.append(self._get(state))
+    if len(self._rows) == CHUNK_FRAMES:
+      self._flush()
+
+  def _flush(self) -> None:
+    end = self._pos + len(self._rows)
+    for buf, kind, vals in zip(self.buffers, self.kinds, zip(*self._rows, strict=True), strict=True):
+      if kind == "U":
+        vals = [v if isinstance(v, str) else repr(v) for v in map(_plain, vals)]
+      buf[self._pos:end] = vals
+    self._pos = end
+    self._rows.clear()
+
+  def columns(self) -> Columns:
+    self._flush()
+    return {field: buf[:self._pos].astype(str) if kind == "U" else buf[:self._pos]
+            for field, kind, buf in zip(self.fields, self.kinds, self.buffers, strict=True)}
+
+
+def replay_segment(platform: str, frames: np.ndarray, events: np.ndarray) -> tuple[structs.CarParams, Columns, np.ndarray]:
+  _can_msgs = (msgs for _, msgs in iter_can_data(frames, events))
 
   def can_recv(wait_for_one: bool = False) -> list[list[CanData]]:
     return [next(_can_msgs, [])]
@@ -71,40 +184,43 @@ def replay_segment(platform: str, can_msgs: list[Any]) -> tuple[structs.CarParam
   CI = CarInterface(CP)
   CC = structs.CarControl().as_reader()
 
-  states, timestamps = [], []
-  for msg in can_msgs:
-    frames = [CanData(c.address, c.dat, c.src) for c in msg.can]
-    states.append(CI.update([(msg.logMonoTime, frames)]))
-    CI.apply(CC, msg.logMonoTime)
-    timestamps.append(msg.logMonoTime)
-  return CP, states, timestamps
+  columns = None
+  for mono_time, msgs in iter_can_data(frames, events):
+    state = CI.update([(mono_time, msgs)])
+    if columns is None:
+      columns = StateColumns(state, len(events))
+    columns.add(state)
+    CI.apply(CC, mono_time)
+  return CP, columns.columns() if columns is not None else {}, events["mono_time"].copy()
 
 
 def process_segment(args: tuple) -> Result:
   platform, seg, ref_path, update = args
   try:
-    can_msgs = load_can_messages(seg)
-    CP, states, timestamps = replay_segment(platform, can_msgs)
+    CP, columns, timestamps = replay_segment(platform, *load_can_frames(seg))
     ref_file = Path(ref_path) / f"{platform}_{seg.replace('/', '_')}.zst"
 
     if update:
-      data = {"cp": CP.to_dict(), "frames": list(zip(timestamps, states, strict=True))}
-      ref_file.write_bytes(zstd.compress(pickle.dumps(data), 10))
+      save_ref(ref_file, CP.to_dict(), timestamps, columns)
       return (platform, seg, [], None, None, None)
 
     if not ref_file.exists():
       return (platform, seg, [], None, None, "no ref")
 
-    ref_data = pickle.loads(decompress_stream(ref_file.read_bytes()))
-    cp: dict[str, Any] = ref_data["cp"]
-    ref: list[Ref] = ref_data["frames"]
+    cp, ref_timestamps, ref = load_ref(ref_file)
+    if len(ref_timestamps) != len(timestamps):
+      raise ValueError(f"replayed {len(timestamps)} frames, ref has {len(ref_timestamps)}")
+
     diffs = []
     for diff in dict_diff(cp, CP.to_dict(), path="carParams", ignore=IGNORE_FIELDS, tolerance=TOLERANCE):
       diffs.append((diff[1], -1, diff[2], 0))
-    for i, ((ts, ref_state), state) in enumerate(zip(ref, states, strict=True)):
-      for diff in dict_diff(ref_state.to_dict(), state.to_dict(), ignore=IGNORE_FIELDS, tolerance=TOLERANCE):
-        diffs.append((diff[1], i, diff[2], ts))
-    return (platform, seg, diffs, ref, states, None)
+    for field, idxs in column_diffs(ref, columns, ignore=IGNORE_FIELDS, tolerance=TOLERANCE).items():
+      for i in idxs.tolist():
+        diffs.append((field, i, (_value(ref.get(field), i), _value(columns.get(field), i)), int(ref_timestamps[i])))
+
+    # only send the changed fields back to the main process
+    fields = {d[0] for d in diffs}
+    return (platform, seg, diffs, {f: ref[f] for f in fields if f in ref}, {f: columns[f] for f in fields if f in columns}, None)
   except Exception:
     return (platform, seg, [], None, None, traceback.format_exc())
 
@@ -131,10 +247,10 @@ def download_refs(ref_path: Path, platforms: list[str], segments: dict[str, list
         (Path(ref_path) / filename).write_bytes(resp.read())
 
 
-def run_replay(platforms: list[str], segments: dict[str, list[str]], ref_path: Path, update: bool, workers: int = 4) -> list[Result]:
+def run_replay(platforms: list[str], segments: dict[str, list[str]], ref_path: Path, update: bool, workers: int | None = None) -> list[Result]:
   work = [(platform, seg, ref_path, update)
           for platform in platforms for seg in segments.get(platform, [])]
-  return process_map(process_segment, work, max_workers=workers)
+  return process_map(process_segment, work, max_workers=workers or os.cpu_count())
 
 
 # ASCII waveforms helpers
@@ -189,21 +305,13 @@ def group_frames(diffs: list[Diff], max_gap: int = 15) -> list[list[Diff]]:
   return groups
 
 
-def build_signals(group: list[Diff], ref: list[Ref], states: list[structs.CarState], field: str) -> tuple[list[Any], list[Any], int, int]:
+def build_signals(group: list[Diff], ref: Columns, states: Columns, field: str) -> tuple[list[Any], list[Any], int, int]:
   _, first_frame, _, _ = group[0]
   _, last_frame, _, _ = group[-1]
   start = max(0, first_frame - PADDING)
-  end = min(last_frame + PADDING + 1, len(ref))
-  master_vals = []
-  pr_vals = []
-  for frame in range(start, end):
-    mval = ref[frame][1].to_dict()
-    pval = states[frame].to_dict()
-    for k in field.split("."):
-      mval = mval.get(k) if isinstance(mval, dict) else None
-      pval = pval.get(k) if isinstance(pval, dict) else None
-    master_vals.append(mval)
-    pr_vals.append(pval)
+  end = min(last_frame + PADDING + 1, max((len(c) for c in (ref.get(field), states.get(field)) if c is not None), default=0))
+  master_vals = ref[field][start:end].tolist() if field in ref else [None] * (end - start)
+  pr_vals = states[field][start:end].tolist() if field in states else [None] * (end - start)
   return master_vals, pr_vals, start, end
 
 
@@ -216,7 +324,7 @@ def format_numeric_diffs(diffs: list[Diff]) -> list[str]:
   return lines
 
 
-def format_boolean_diffs(diffs: list[Diff], ref: list[Ref], states: list[structs.CarState], field: str) -> list[str]:
+def format_boolean_diffs(diffs: list[Diff], ref: Columns, states: Columns, field: str) -> list[str]:
   _, first_frame, _, first_ts = diffs[0]
   _, last_frame, _, last_ts = diffs[-1]
   frame_time = last_frame - first_frame
@@ -237,7 +345,7 @@ def format_boolean_diffs(diffs: list[Diff], ref: list[Ref], states: list[structs
   return lines
 
 
-def format_diff(diffs: list[Diff], ref: list[Ref], states: list[structs.CarState], field: str) -> list[str]:
+def format_diff(diffs: list[Diff], ref: Columns, states: Columns, field: str) -> list[str]:
   if not diffs:
     return []
   _, _, (old, new), _ = diffs[0]
@@ -247,7 +355,8 @@ def format_diff(diffs: list[Diff], ref: list[Ref], states: list[structs.CarState
   return format_numeric_diffs(diffs)
 
 
-def main(platform: str | None = None, segments_per_platform: int = 10, update_refs: bool = False, all_platforms: bool = False) -> int:
+def main(platform: str | None = None, segments_per_platform: int = 10, update_refs: bool = False, all_platforms: bool = False,
+         workers: int | None = None) -> int:
   from comma_car_segments import get_comma_car_segments_database
   cwd = Path(__file__).resolve().parents[3]
   ref_path = cwd / DIFF_BUCKET
@@ -277,14 +386,14 @@ def main(platform: str | None = None, segments_per_platform: int = 10, update_re
   print(f"{'Generating' if update_refs else 'Testing'} {n_segments} segments for: {', '.join(platforms)}")
 
   if update_refs:
-    results = run_replay(platforms, segments, ref_path, update=True)
+    results = run_replay(platforms, segments, ref_path, update=True, workers=workers)
     errors = [e for _, _, _, _, _, e in results if e]
     assert len(errors) == 0, f"Segment failures: {errors}"
     print(f"Generated {n_segments} refs to {ref_path}")
     return 0
 
   download_refs(ref_path, platforms, segments)
-  results = run_replay(platforms, segments, ref_path, update=False)
+  results = run_replay(platforms, segments, ref_path, update=False, workers=workers)
   with_diffs = [(platform, seg, diffs, ref, states)
                 for platform, seg, diffs, ref, states, err in results if diffs]
   errors = [(platform, seg, err) for platform, seg, diffs, ref, states, err in results if err]
@@ -321,5 +430,6 @@ if __name__ == "__main__":
   parser.add_argument("--segments-per-platform", type=int, default=10, help="number of segments to diff per platform")
   parser.add_argument("--update-refs", action="store_true", help="update refs based on current commit")
   parser.add_argument("--all", action="store_true", help="run diff on all platforms")
+  parser.add_argument("--workers", type=int, help="number of processes, defaults to the CPU count")
   args = parser.parse_args()
-  sys.exit(main(args.platform, args.segments_per_platform, args.update_refs, args.all))
+  sys.exit(main(args.platform, args.segments_per_platform, args.update_refs, args.all, args.workers))
@@ -0,0 +1,310 @@
+"""Simulated CAN network of ISO-TP/UDS ECUs, for testing and benchmarking FW queries and UDS clients without a car.
+
+Time is virtual: inside SimulatedCanNetwork.patch_time(), time.monotonic() and time.sleep() use the network's clock,
+which only moves when a caller waits on can_recv or sleeps. Frames are delivered like pandad does, in a packet every
+10ms, and ECUs answer after their response latency.
+
+  network = SimulatedCanNetwork(ecus_for_platform("TOYOTA_RAV4_TSS2"))
+  with network.patch_time():
+    car_fw = get_fw_versions(network.can_recv, network.can_send, network.set_obd_multiplexing)
+"""
+import heapq
+import math
+import random
+from collections import defaultdict
+from collections.abc import Generator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from unittest import mock
+
+from opendbc.car import uds
+from opendbc.car.can_definitions import CanData
+from opendbc.car.fw_query_definitions import STANDARD_VIN_ADDRS, StdQueries
+from opendbc.car.fw_versions import FW_QUERY_CONFIGS, MODEL_TO_BRAND, VERSIONS
+
+PACKET_INTERVAL = 0.01  # pandad publishes received CAN at 100Hz
+PANDA_POLL_INTERVAL = 0.001
+OBD_MULTIPLEXING_DELAY = 0.05  # the blocking params loop in pandad, on average
+TESTER_PRESENT_RESPONSE = bytes([uds.SERVICE_TYPE.TESTER_PRESENT + 0x40, 0x0])
+CAN_BITRATE = 500e3
+CAN_FD_DATA_BITRATE = 2e6
+
+
+def frame_time(length: int) -> float:
+  """Time on the bus for a frame with a payload of length bytes, ignoring bit stuffing. Payloads over 8 bytes are CAN-FD"""
+  if length <= 8:
+    return (47 + 8 * length) / CAN_BITRATE
+  # arbitration at the nominal bitrate, data phase with its CRC at the data bitrate
+  return 30 / CAN_BITRATE + (8 * length + 50) / CAN_FD_DATA_BITRATE
+
+
+@dataclass
+class SimulatedEcu:
+  bus: int
+  tx_addr: int  # the address the ECU listens on
+  rx_addr: int  # the address the ECU responds on
+  # request -> positive response, both without ISO-TP framing
+  responses: dict[bytes, bytes] = field(default_factory=dict)
+  sub_addr: int | None = None
+  # on the OBD port (bus 1), which OBD multiplexing mode reaches this ECU. None if always reachable
+  obd_multiplexing: bool | None = None
+  # answers requests to the functional address (0x7DF, or 0x18DB33F1 for 29-bit addresses)
+  functional: bool = False
+  response_latency: float = 0.005
+  # minimum time between consecutive frames the ECU sends, and asks for in its flow control
+  separation_time: float = 0.
+  # fraction of requests that first get a response pending (0x78), and for how long
+  response_pending_rate: float = 0.
+  response_pending_time: float = 0.05
+  # fraction of frames the ECU sends that get lost
+  drop_rate: float = 0.
+  # answer unknown requests with serviceNotSupported, instead of not at all
+  reject_unknown: bool = False
+  # length of the frames the ECU sends (TX_DL), over 8 for CAN-FD
+  tx_dl: int = 8
+
+  def __post_init__(self):
+    self._sub_addr_len = 0 if self.sub_addr is None else 1
+    self._max_len = self.tx_dl - self._sub_addr_len
+    self._rx_dat = b""
+    self._rx_len = 0
+    self._rx_idx = 0
+    self._tx_dat = b""
+    self._tx_idx = 0  # consecutive frames sent
+    self._tx_pos = 0
+
+  def _stmin_byte(self) -> int:
+    if 1e-4 <= self.separation_time <= 9e-4:
+      return 0xF0 + round(self.separation_time * 1e4)
+    return min(round(self.separation_time * 1000), 0x7F)
+
+  def _pad(self, dat: bytes) -> bytes:
+    return dat.ljust(uds.get_padded_len(len(dat) + self._sub_addr_len) - self._sub_addr_len, b"\x00")
+
+  def rx(self, t: float, dat: bytes, rng: random.Random) -> list[tuple[float, bytes]]:
+    """Handles a frame received at t, without sub-address. Returns the frames to send as (time, frame)"""
+    frame_type = dat[0] >> 4
+    if frame_type == uds.ISOTP_FRAME_TYPE.SINGLE:
+      if dat[0] & 0xF == 0 and len(dat) > 8 - self._sub_addr_len:
+        return self._respond(t, dat[2:2 + dat[1]], rng)
+      return self._respond(t, dat[1:1 + (dat[0] & 0xF)], rng)
+
+    elif frame_type == uds.ISOTP_FRAME_TYPE.FIRST:
+      self._rx_len = ((dat[0] & 0xF) << 8) | dat[1]
+      self._rx_dat = dat[2:]
+      if self._rx_len == 0:
+        self._rx_len = int.from_bytes(dat[2:6])
+        self._rx_dat = dat[6:]
+      self._rx_idx = 0
+      return [(t + self.response_latency, self._pad(bytes([0x30, 0x00, self._stmin_byte()])))]
+
+    elif frame_type == uds.ISOTP_FRAME_TYPE.CONSECUTIVE:
+      self._rx_idx += 1
+      if self._rx_len == 0 or dat[0] & 0xF != self._rx_idx & 0xF:
+        self._rx_len = 0
+        return []
+      self._rx_dat += dat[1:1 + self._rx_len - len(self._rx_dat)]
+      if len(self._rx_dat) < self._rx_len:
+        return []
+      self._rx_len = 0
+      return self._respond(t, self._rx_dat, rng)
+
+    elif frame_type == uds.ISOTP_FRAME_TYPE.FLOW and dat[0] == 0x30 and len(self._tx_dat):
+      block_size, stmin = dat[1], dat[2]
+      tester_st = (stmin & 0x7F) / 1000. if stmin <= 0x7F else (stmin - 0xF0) / 1e4
+      st = max(tester_st, self.separation_time, frame_time(self.tx_dl))
+      frames = []
+      while self._tx_pos < len(self._tx_dat) and (block_size == 0 or len(frames) < block_size):
+        self._tx_idx += 1
+        frame = self._pad(bytes([0x20 | (self._tx_idx & 0xF)]) + self._tx_dat[self._tx_pos:self._tx_pos + self._max_len - 1])
+        frames.append((t + (len(frames) + 1) * st, frame))
+        self._tx_pos += self._max_len - 1
+      if self._tx_pos >= len(self._tx_dat):
+        self._tx_dat = b""
+      return frames
+    return []
+
+  def _respond(self, t: float, request: bytes, rng: random.Random) -> list[tuple[float, bytes]]:
+    response = self.responses.get(request)
+    if response is None:
+      if not self.reject_unknown or not len(request):
+        return []
+      response = bytes([0x7F, request[0], 0x11])
+
+    t += self.response_latency
+    frames = []
+    if self.response_pending_rate and rng.random() < self.response_pending_rate:
+      frames.append((t, self._pad(bytes([3, 0x7F, request[0], 0x78]))))
+      t += self.response_pending_time
+
+    if len(response) < 8 - self._sub_addr_len:
+      frames.append((t, self._pad(bytes([len(response)]) + response)))
+    elif len(response) <= self._max_len - 2:
+      # CAN-FD single frame
+      frames.append((t, self._pad(bytes([0, len(response)]) + response)))
+    else:
+      # the rest goes out on the tester's flow control
+      header = bytes([0x10 | (len(response) >> 8), len(response) & 0xFF]) if len(response) <= 0xFFF else bytes([0x10, 0]) + len(response).to_bytes(4)
+      self._tx_dat = response
+      self._tx_idx = 0
+      self._tx_pos = self._max_len - len(header)
+      frames.append((t, header + response[:self._tx_pos]))
+    return frames
+
+
+class SimulatedCanNetwork:
+  def __init__(self, ecus: list[SimulatedEcu], seed: int = 0, obd_multiplexing: bool = True, record: bool = False):
+    self.ecus = ecus
+    self.rng = random.Random(seed)
+    self.now = 0.
+    self.obd_multiplexing = obd_multiplexing
+    self.obd_multiplexing_changes = 0
+    self.frames_sent = 0
+    self.frames_received = 0
+    # with record, every frame the host sends and receives
+    self.record = record
+    self.sent: list[CanData] = []
+    self.received: list[CanData] = []
+
+    self._listeners: dict[tuple[int, int], list[SimulatedEcu]] = defaultdict(list)
+    for ecu in ecus:
+      self._listeners[(ecu.bus, ecu.tx_addr)].append(ecu)
+      if ecu.functional:
+        self._listeners[(ecu.bus, 0x7DF if ecu.tx_addr <= 0x7FF else 0x18DB33F1)].append(ecu)
+    self._frames: list[tuple[float, int, CanData]] = []
+    self._bus_free: dict[int, float] = defaultdict(float)
+    self._seq = 0
+
+  # *** clock ***
+
+  def monotonic(self) -> float:
+    return self.now
+
+  def sleep(self, seconds: float) -> None:
+    self.now += max(seconds, 0.)
+
+  @contextmanager
+  def patch_time(self) -> Generator[None, None, None]:
+    with mock.patch("time.monotonic", self.monotonic), mock.patch("time.sleep", self.sleep):
+      yield
+
+  # *** host side ***
+
+  def set_obd_multiplexing(self, obd_multiplexing: bool) -> None:
+    if obd_multiplexing != self.obd_multiplexing:
+      self.obd_multiplexing = obd_multiplexing
+      self.obd_multiplexing_changes += 1
+      self.now += OBD_MULTIPLEXING_DELAY
+
+  def can_send(self, msgs: list[CanData]) -> None:
+    if self.record:
+      self.sent.extend(msgs)
+    for msg in msgs:
+      self.frames_sent += 1
+      # frames the host sends at once go out one after another
+      t = max(self.now, self._bus_free[msg.src]) + frame_time(len(msg.dat))
+      self._bus_free[msg.src] = t
+      for ecu in self._listeners.get((msg.src, msg.address), ()):
+        if ecu.obd_multiplexing is not None and ecu.obd_multiplexing != self.obd_multiplexing:
+          continue
+        dat = msg.dat
+        if ecu.sub_addr is not None:
+          if not len(dat) or dat[0] != ecu.sub_addr:
+            continue
+          dat = dat[1:]
+        if not len(dat):
+          continue
+        # functional requests are single frames, ECUs answer and continue on their physical addresses
+        if msg.address in uds.FUNCTIONAL_ADDRS and dat[0] >> 4 != uds.ISOTP_FRAME_TYPE.SINGLE:
+          continue
+
+        for tx_t, frame in ecu.rx(t, dat, self.rng):
+          if ecu.drop_rate and self.rng.random() < ecu.drop_rate:
+            continue
+          if ecu.sub_addr is not None:
+            frame = bytes([ecu.sub_addr]) + frame
+          heapq.heappush(self._frames, (tx_t + frame_time(len(frame)), self._seq, CanData(ecu.rx_addr, frame, ecu.bus)))
+          self._seq += 1
+
+  def _pop_frames(self, until: float) -> list[CanData]:
+    ret = []
+    while len(self._frames) and self._frames[0][0] <= until:
+      ret.append(heapq.heappop(self._frames)[2])
+    self.frames_received += len(ret)
+    if self.record:
+      self.received.extend(ret)
+    return ret
+
+  def can_recv(self, wait_for_one: bool = False) -> list[list[CanData]]:
+    """A CanRecvCallable. Frames arrive in one packet per PACKET_INTERVAL, waiting moves the clock to the next one"""
+    last_packet = math.floor(self.now / PACKET_INTERVAL + 1e-9) * PACKET_INTERVAL
+    if wait_for_one and not (len(self._frames) and self._frames[0][0] <= last_packet):
+      last_packet += PACKET_INTERVAL
+      self.now = max(self.now, last_packet)
+
+    frames = self._pop_frames(last_packet)
+    return [frames] if len(frames) or wait_for_one else []
+
+  def panda(self) -> "SimulatedPanda":
+    return SimulatedPanda(self)
+
+
+class SimulatedPanda:
+  """The can_send/can_recv interface of a panda, for UdsClient"""
+  def __init__(self, network: SimulatedCanNetwork):
+    self.network = network
+
+  def can_send(self, addr: int, dat: bytes, bus: int, timeout: int = 0) -> None:
+    self.network.can_send([CanData(addr, dat, bus)])
+
+  def can_recv(self) -> list[tuple[int, bytes, int]]:
+    network = self.network
+    if not (len(network._frames) and network._frames[0][0] <= network.now):
+      network.now += PANDA_POLL_INTERVAL
+    return [(msg.address, msg.dat, msg.src) for msg in network._pop_frames(network.now)]
+
+
+def _is_obd_addr(addr: int) -> bool:
+  # physical addresses that respond to functional OBD requests
+  return 0x7E0 <= addr <= 0x7E7 or (addr & 0xFFFF00FF) == 0x18DA00F1
+
+
+def ecus_for_platform(platform: str, vin: str | None = None, rng: random.Random | None = None, **ecu_kwargs) -> list[SimulatedEcu]:
+  """The ECUs of a platform in FW_VERSIONS, answering its brand's FW queries (and tester present) with one of their versions.
+     If vin is set, ECUs at the standard VIN addresses answer OBD and UDS VIN requests. ecu_kwargs are passed to SimulatedEcu.
+  """
+  brand = MODEL_TO_BRAND[platform]
+  config = FW_QUERY_CONFIGS[brand]
+
+  ecus: dict[tuple, SimulatedEcu] = {}
+  for (ecu_type, addr, sub_addr), versions in VERSIONS[brand][platform].items():
+    version = rng.choice(versions) if rng is not None else versions[0]
+    for r in config.requests:
+      if len(r.whitelist_ecus) and ecu_type not in r.whitelist_ecus:
+        continue
+
+      obd_multiplexing = r.obd_multiplexing if r.bus % 4 == 1 else None
+      rx_addr = uds.get_rx_addr_for_tx_addr(addr, r.rx_offset)
+      key = (r.bus, addr, rx_addr, sub_addr, obd_multiplexing)
+      if key not in ecus:
+        ecus[key] = SimulatedEcu(r.bus, addr, rx_addr, {StdQueries.TESTER_PRESENT_REQUEST: TESTER_PRESENT_RESPONSE}, sub_addr=sub_addr,
+                                 obd_multiplexing=obd_multiplexing, functional=_is_obd_addr(addr) and sub_addr is None, **ecu_kwargs)
+      ecu = ecus[key]
+      for request, response in zip(r.request[:-1], r.response[:-1], strict=True):
+        ecu.responses[request] = response
+      ecu.responses[r.request[-1]] = r.response[-1] + version
+
+  if vin is not None:
+    vin_ecus = [ecu for ecu in ecus.values() if ecu.tx_addr in STANDARD_VIN_ADDRS and ecu.sub_addr is None]
+    if not len(vin_ecus):
+      # the engine ECU on the OBD port, which isn't always queried for FW
+      engine = SimulatedEcu(1, 0x7E0, 0x7E8, {StdQueries.TESTER_PRESENT_REQUEST: TESTER_PRESENT_RESPONSE}, obd_multiplexing=True,
+                            functional=True, **ecu_kwargs)
+      ecus[(engine.bus, engine.tx_addr, engine.rx_addr, None, True)] = engine
+      vin_ecus.append(engine)
+
+    for ecu in vin_ecus:
+      ecu.functional = True
+      ecu.responses[StdQueries.UDS_VIN_REQUEST] = StdQueries.UDS_VIN_RESPONSE + vin.encode()
+      ecu.responses[StdQueries.OBD_VIN_REQUEST] = StdQueries.OBD_VIN_RESPONSE + vin.encode()
+  return list(ecus.values())
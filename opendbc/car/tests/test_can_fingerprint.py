@@ -1,7 +1,9 @@
+import random
 import unittest
 from opendbc.car.can_definitions import CanData
 from opendbc.car.car_helpers import FRAME_FINGERPRINT, can_fingerprint
-from opendbc.car.fingerprints import _FINGERPRINTS as FINGERPRINTS
+from opendbc.car.fingerprints import _DEBUG_ADDRESS, _FINGERPRINTS as FINGERPRINTS, all_fingerprint_cars_mask, all_legacy_fingerprint_cars, \
+                                     cars_from_mask, compatible_cars_mask, eliminate_incompatible_cars, is_valid_for_fingerprint
 from opendbc.testing import parameterized
 
 
@@ -22,6 +24,26 @@ class TestCanFingerprint(unittest.TestCase):
       assert finger[1] == fingerprint
       assert finger[2] == {}
 
+  def test_elimination(self):
+    # the index must match checking every fingerprint of every candidate
+    def eliminate_reference(msg, candidate_cars):
+      return [car for car in candidate_cars if any(is_valid_for_fingerprint(msg, fp | _DEBUG_ADDRESS) for fp in FINGERPRINTS[car])]
+
+    addresses = sorted({(address, length) for fps in FINGERPRINTS.values() for fp in fps for address, length in fp.items()})
+    rng = random.Random(0)
+    for _ in range(200):
+      candidates = all_legacy_fingerprint_cars()
+      mask = all_fingerprint_cars_mask()
+      for _ in range(rng.randint(1, 30)):
+        address, length = rng.choice(addresses)
+        msg = CanData(address=rng.choice((address, 1880, 0x800 + address)), dat=b'\x00' * rng.choice((length, length, 8, 1)), src=0)
+
+        expected = eliminate_reference(msg, candidates)
+        self.assertEqual(eliminate_incompatible_cars(msg, candidates), expected)
+        mask &= compatible_cars_mask(msg.address, len(msg.dat))
+        self.assertEqual(cars_from_mask(mask), expected)
+        candidates = expected
+
   def test_timing(self):
     # just pick any CAN fingerprinting car
     car_model = "CHEVROLET_BOLT_EUV"
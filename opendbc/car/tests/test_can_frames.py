@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import zstandard as zstd
+
+from opendbc.car import can_frames
+from opendbc.car.can_frames import iter_can_data, read_can_frames
+from opendbc.car.logreader import LogReader, capnp_log
+
+
+def _log(n: int) -> bytes:
+  dat = []
+  for i in range(n):
+    msg = capnp_log.Event.new_message(logMonoTime=1_000_000 * i)
+    if i % 10 == 9:
+      msg.frame = None
+      dat.append(msg.to_bytes())
+      continue
+    # variable frame counts, with some CAN-FD frames
+    for j, frame in enumerate(msg.init("can" if i % 3 else "sendcan", i % 5)):
+      frame.address, frame.src = 0x100 + j, j % 3 + (128 if i % 3 == 0 else 0)
+      frame.dat = bytes([i & 0xFF] * (64 if (i + j) % 7 == 0 else j + 1))
+    dat.append(msg.to_bytes())
+  return b"".join(dat)
+
+
+class TestCanFrames(unittest.TestCase):
+  def setUp(self):
+    cache_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(cache_dir.cleanup)
+    patcher = mock.patch.dict(os.environ, {"OPENDBC_CACHE_DIR": cache_dir.name})
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    fd, self.fn = tempfile.mkstemp(suffix=".zst")
+    with os.fdopen(fd, "wb") as f:
+      f.write(zstd.compress(_log(500)))
+    self.addCleanup(os.remove, self.fn)
+
+  def test_columns(self):
+    for msg_type in ("can", "sendcan"):
+      frames, events = read_can_frames(self.fn, msg_type)
+      expected = [(e.logMonoTime, [(c.address, c.dat, c.src) for c in getattr(e, msg_type)])
+                  for e in LogReader(self.fn, only_union_types=True) if e.which() == msg_type]
+      self.assertEqual([(t, [tuple(c) for c in msgs]) for t, msgs in iter_can_data(frames, events)], expected)
+      # including events without frames
+      self.assertTrue(any(not msgs for _, msgs in expected))
+
+      self.assertEqual(frames.dtype["dat"].shape, (64,))
+      self.assertEqual(len(frames), sum(len(msgs) for _, msgs in expected))
+      self.assertEqual(frames["dlc"].tolist(), [len(c[1]) for _, msgs in expected for c in msgs])
+      self.assertTrue(all(frames["bus"] >= 128) if msg_type == "sendcan" else all(frames["bus"] < 128))
+
+  def test_cache(self):
+    frames, events = read_can_frames(self.fn)
+    with mock.patch.object(can_frames, "extract_can_frames", wraps=can_frames.extract_can_frames) as extract:
+      cached = read_can_frames(self.fn)
+      self.assertEqual(extract.call_count, 0)
+      self.assertTrue(np.array_equal(cached[0], frames))
+      self.assertTrue(np.array_equal(cached[1], events))
+      self.assertIsNotNone(getattr(cached[0], "filename", None))
+
+      # keyed by content and message type
+      read_can_frames(self.fn, "sendcan")
+      with open(self.fn, "wb") as f:
+        f.write(zstd.compress(_log(100)))
+      self.assertLess(len(read_can_frames(self.fn)[0]), len(frames))
+      self.assertEqual(extract.call_count, 2)
+
+      # corrupt entries are replaced
+      for fn in os.listdir(can_frames.get_cache_dir()):
+        with open(os.path.join(can_frames.get_cache_dir(), fn), "wb") as f:
+          f.write(b"\x00")
+      for cached, extracted in zip(read_can_frames(self.fn), can_frames.extract_can_frames(self.fn), strict=True):
+        self.assertTrue(np.array_equal(cached, extracted))
+      self.assertEqual(extract.call_count, 4)
+
+  def test_chunks(self):
+    # small chunks, some of them widened by CAN-FD frames partway through, give the same columns
+    frames, events = can_frames.extract_can_frames(self.fn)
+    with mock.patch.object(can_frames, "CHUNK_FRAMES", 7):
+      chunked_frames, chunked_events = can_frames.extract_can_frames(self.fn)
+    self.assertTrue(np.array_equal(chunked_frames, frames))
+    self.assertTrue(np.array_equal(chunked_events, events))
+
+    # classic CAN logs are padded to 8 bytes
+    with open(self.fn, "wb") as f:
+      f.write(zstd.compress(b"".join(capnp_log.Event.new_message(logMonoTime=i, can=[{"address": i, "dat": bytes(i % 8), "src": 0}]).to_bytes()
+                                     for i in range(20))))
+    frames, _ = can_frames.extract_can_frames(self.fn)
+    self.assertEqual(frames.dtype["dat"].shape, (8,))
+    self.assertEqual(frames["dlc"].tolist(), [i % 8 for i in range(20)])
+
+  def test_empty(self):
+    with open(self.fn, "wb") as f:
+      f.write(b"")
+    frames, events = read_can_frames(self.fn, cache=False)
+    self.assertEqual((len(frames), len(events)), (0, 0))
+    self.assertEqual(list(iter_can_data(frames, events)), [])
+
+
+if __name__ == "__main__":
+  unittest.main()
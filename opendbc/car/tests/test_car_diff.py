@@ -0,0 +1,98 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+import numpy as np
+
+from opendbc.can import CANPacker
+from opendbc.car import Bus, structs
+from opendbc.car.can_frames import EVENT_DTYPE, frame_dtype
+from opendbc.car.tests import car_diff
+from opendbc.car.toyota.values import CAR, DBC
+
+PLATFORM = CAR.TOYOTA_COROLLA_TSS2
+SEG = "0000000000000000/2000-01-01--00-00-00/0"
+WHEEL_SPEEDS = ("WHEEL_SPEED_FL", "WHEEL_SPEED_FR", "WHEEL_SPEED_RL", "WHEEL_SPEED_RR")
+
+
+def _segment(speeds: list[float]) -> tuple[np.ndarray, np.ndarray]:
+  """A WHEEL_SPEEDS frame per event, with every tenth event empty"""
+  packer = CANPacker(DBC[PLATFORM][Bus.pt])
+  with_frame = [i % 10 != 9 for i in range(len(speeds))]
+  msgs = [packer.make_can_msg("WHEEL_SPEEDS", 0, dict.fromkeys(WHEEL_SPEEDS, s)) for s, f in zip(speeds, with_frame, strict=True) if f]
+
+  events: np.ndarray = np.zeros(len(speeds), dtype=EVENT_DTYPE)
+  events["mono_time"] = np.arange(len(speeds)) * 10_000_000
+  events["start"] = np.cumsum([0] + with_frame[:-1])
+  frames: np.ndarray = np.zeros(len(msgs), dtype=frame_dtype(8))
+  frames["mono_time"] = events["mono_time"][with_frame]
+  frames["address"] = [m[0] for m in msgs]
+  frames["dlc"] = 8
+  frames["dat"] = np.frombuffer(b"".join(m[1] for m in msgs), dtype=np.uint8).reshape(-1, 8)
+  return frames, events
+
+
+class TestCarDiff(unittest.TestCase):
+  def test_column_diffs(self):
+    ref = car_diff.to_columns([{"a": 1.0, "b": True, "c": "park", "d": [], "cumLagMs": 1.0, "e": float("nan")},
+                               {"a": 2.0, "b": False, "c": "drive", "d": [1], "cumLagMs": 2.0, "e": float("nan")}])
+    self.assertEqual({k: v.dtype.kind for k, v in ref.items()}, {"a": "f", "b": "b", "c": "U", "d": "U", "cumLagMs": "f", "e": "f"})
+
+    new = {**ref, "a": ref["a"] + [1e-5, 1.], "b": ~ref["b"], "c": np.array(["park", "park"]), "cumLagMs": ref["cumLagMs"] + 1, "f": ref["a"]}
+    del new["d"]
+    changed = car_diff.column_diffs(ref, new, ignore=car_diff.IGNORE_FIELDS, tolerance=car_diff.TOLERANCE)
+    self.assertEqual({k: v.tolist() for k, v in changed.items()}, {"a": [1], "b": [0, 1], "c": [1], "d": [0, 1], "f": [0, 1]})
+
+  def test_replay(self):
+    speeds = [0.] * 50 + [36.] * 50
+    with tempfile.TemporaryDirectory() as ref_path, mock.patch.object(car_diff, "load_can_frames", return_value=_segment(speeds)):
+      self.assertEqual(car_diff.process_segment((PLATFORM, SEG, ref_path, True))[-1], None)
+      ref_file = next(Path(ref_path).iterdir())
+      cp, timestamps, ref = car_diff.load_ref(ref_file)
+      self.assertEqual(len(timestamps), len(speeds))
+      self.assertEqual(cp["carFingerprint"], PLATFORM)
+
+      platform, seg, diffs, ref_cols, cols, err = car_diff.process_segment((PLATFORM, SEG, ref_path, False))
+      self.assertEqual((diffs, err), ([], None))
+
+      # the car is faster, starting from the empty event at frame 59
+      with mock.patch.object(car_diff, "load_can_frames", return_value=_segment(speeds[:59] + [72.] * 41)):
+        platform, seg, diffs, ref_cols, cols, err = car_diff.process_segment((PLATFORM, SEG, ref_path, False))
+      self.assertIsNone(err)
+      self.assertTrue("vEgo" in ref_cols)
+      self.assertEqual(min(frame for field, frame, _, _ in diffs if field == "vEgo"), 60)
+      self.assertTrue(all(ts == frame * 10_000_000 for _, frame, _, ts in diffs))
+      self.assertTrue(any(line.startswith("    frame 60:") for line in car_diff.format_diff([d for d in diffs if d[0] == "vEgo"], ref_cols, cols, "vEgo")))
+
+  def test_state_columns(self):
+    states = [structs.CarState(vEgo=float(i), gearShifter="drive" if i % 3 else "park", canErrorCounter=i) for i in range(5)]
+    for i, state in enumerate(states):
+      # like CarInterface.update, every state has the same fields set
+      state.cruiseState.speed = 10. * i
+      state.buttonEvents = [structs.CarState.ButtonEvent(pressed=True, type="accelCruise")] if i == 1 else []
+    # across a chunk boundary
+    with mock.patch.object(car_diff, "CHUNK_FRAMES", 2):
+      columns = car_diff.StateColumns(states[0], len(states))
+      for state in states:
+        columns.add(state)
+      new = columns.columns()
+    ref = car_diff.to_columns([car_diff.flatten(state.to_dict()) for state in states])
+    self.assertEqual(new.keys(), ref.keys())
+    for field, column in ref.items():
+      self.assertEqual(new[field].dtype, column.dtype, field)
+      self.assertEqual(new[field].tolist(), column.tolist(), field)
+
+  def test_legacy_ref(self):
+    states = [structs.CarState(vEgo=float(i), gearShifter="drive", standstill=i == 0) for i in range(3)]
+    with tempfile.TemporaryDirectory() as ref_path:
+      ref_file = Path(ref_path) / "ref.zst"
+      ref_file.write_bytes(car_diff.zstd.compress(car_diff.pickle.dumps({"cp": {}, "frames": list(zip(range(3), states, strict=True))})))
+      _, timestamps, ref = car_diff.load_ref(ref_file)
+    self.assertEqual(timestamps.tolist(), [0, 1, 2])
+    self.assertEqual(ref["vEgo"].tolist(), [0., 1., 2.])
+    self.assertEqual(ref["standstill"].tolist(), [True, False, False])
+    self.assertEqual(ref["gearShifter"].tolist(), ["drive"] * 3)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,55 @@
+import random
+import unittest
+
+from opendbc.car import uds
+from opendbc.car.fw_versions import get_fw_versions, match_fw_to_car
+from opendbc.car.tests.benchmark_fw_query import TEST_VIN, benchmark_platform, default_platforms
+from opendbc.car.tests.ecu_sim import SimulatedCanNetwork, SimulatedEcu, ecus_for_platform
+from opendbc.testing import parameterized
+
+VERSION = b"\xf1\x00version 1234567890"
+
+
+class TestEcuSim(unittest.TestCase):
+  @parameterized("platform", default_platforms())
+  def test_fingerprint(self, platform):
+    metrics = benchmark_platform(platform)
+    self.assertEqual(metrics["vin_ok"], 1.)
+    self.assertEqual(metrics["exact_match"], 1.)
+    self.assertGreater(metrics["ecus_present"], 0)
+    # a well-behaved car fingerprints in well under the timeouts of a missing one
+    self.assertLess(metrics["total_s"], 5.)
+
+  def test_random_versions(self):
+    network = SimulatedCanNetwork(ecus_for_platform("TOYOTA_RAV4_TSS2", rng=random.Random(1), response_pending_rate=0.5, separation_time=0.005))
+    with network.patch_time():
+      car_fw = get_fw_versions(network.can_recv, network.can_send, network.set_obd_multiplexing, "toyota")
+    self.assertEqual(match_fw_to_car(car_fw, TEST_VIN, log=False), (True, {"TOYOTA_RAV4_TSS2"}))
+
+  def test_dropped_frames(self):
+    network = SimulatedCanNetwork(ecus_for_platform("HONDA_CIVIC", drop_rate=1.))
+    with network.patch_time():
+      car_fw = get_fw_versions(network.can_recv, network.can_send, network.set_obd_multiplexing, "honda")
+    self.assertEqual(car_fw, [])
+    self.assertEqual(network.frames_received, 0)
+
+  @parameterized("pending_rate, separation_time, sub_addr", [(0., 0., None), (1., 0.01, None), (0., 0.002, 0xF)])
+  def test_uds_client(self, pending_rate, separation_time, sub_addr):
+    request = bytes([uds.SERVICE_TYPE.READ_DATA_BY_IDENTIFIER]) + uds.DATA_IDENTIFIER_TYPE.APPLICATION_SOFTWARE_IDENTIFICATION.to_bytes(2)
+    ecu = SimulatedEcu(0, 0x750, 0x758, {request: bytes([request[0] + 0x40]) + request[1:] + VERSION}, sub_addr=sub_addr,
+                       response_pending_rate=pending_rate, separation_time=separation_time)
+    network = SimulatedCanNetwork([ecu])
+    client = uds.UdsClient(network.panda(), 0x750, 0x758, sub_addr=sub_addr, rx_sub_addr=sub_addr)
+    with network.patch_time():
+      self.assertEqual(client.read_data_by_identifier(uds.DATA_IDENTIFIER_TYPE.APPLICATION_SOFTWARE_IDENTIFICATION), VERSION)
+      ecu.reject_unknown = True
+      with self.assertRaises(uds.NegativeResponseError):
+        client.read_data_by_identifier(uds.DATA_IDENTIFIER_TYPE.VIN)
+
+    # consecutive frames are paced by the separation time, and a pending response delays the response
+    frames = -(-(len(VERSION) + 3 - (6 if sub_addr is None else 5)) // (7 if sub_addr is None else 6))
+    self.assertGreaterEqual(network.now, frames * separation_time + pending_rate * ecu.response_pending_time)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,3 +1,4 @@
+import contextlib
 import unittest
 from unittest.mock import patch
 import random
@@ -8,8 +9,11 @@ from opendbc.car.can_definitions import CanData
 from opendbc.car.car_helpers import interfaces
 from opendbc.car.structs import CarParams
 from opendbc.car.fingerprints import FW_VERSIONS
-from opendbc.car.fw_versions import FW_QUERY_CONFIGS, FUZZY_EXCLUDE_ECUS, VERSIONS, build_fw_dict, \
-                                    match_fw_to_car, get_brand_ecu_matches, get_fw_versions, get_present_ecus
+from opendbc.car.fw_query_definitions import ESSENTIAL_ECUS
+from opendbc.car.fw_versions import FW_QUERY_CONFIGS, FUZZY_EXCLUDE_ECUS, VERSIONS, build_fw_dict, match_fw_to_car, match_fw_to_car_exact, \
+                                    match_fw_to_car_fuzzy, get_brand_ecu_matches, get_fw_versions, get_fw_versions_ordered, get_present_ecus, \
+                                    _get_fw_queries, _run_fw_queries
+from opendbc.car import uds
 from opendbc.car.vin import get_vin
 from opendbc.testing import parameterized
 
@@ -97,6 +101,55 @@ class TestFwFingerprint(unittest.TestCase):
       elif len(matches):
         self.assertFingerprints(matches, car_model)
 
+  def test_match_index(self):
+    # the precomputed match tables must agree with matching straight against the database
+    def exact_reference(live_fw_versions, brand, extra_fw_versions):
+      matches = set()
+      for candidate, fws in VERSIONS[brand].items():
+        for ecu, expected_versions in fws.items():
+          expected_versions = expected_versions + extra_fw_versions.get(candidate, {}).get(ecu, [])
+          found_versions = live_fw_versions.get(ecu[1:], set())
+          if not len(found_versions) and (candidate in FW_QUERY_CONFIGS[brand].non_essential_ecus.get(ecu[0], []) or ecu[0] not in ESSENTIAL_ECUS):
+            continue
+          if ecu[0] != Ecu.debug and not any(v in expected_versions for v in found_versions):
+            break
+        else:
+          matches.add(candidate)
+      return matches
+
+    def fuzzy_reference(live_fw_versions, brand, exclude):
+      candidates = defaultdict(set)
+      for candidate, fws in VERSIONS[brand].items():
+        for ecu, versions in fws.items():
+          if candidate != exclude and ecu[0] not in FUZZY_EXCLUDE_ECUS:
+            for version in versions:
+              candidates[(ecu[1], ecu[2], version)].add(candidate)
+      unique = {(addr, next(iter(candidates[(*addr, v)]))) for addr, versions in live_fw_versions.items() for v in versions
+                if len(candidates[(*addr, v)]) == 1}
+      matched_cars = {car for _, car in unique}
+      return matched_cars if len(matched_cars) == 1 and len(unique) >= 2 else set()
+
+    rng = random.Random(0)
+    for brand, cars in VERSIONS.items():
+      if not len(cars):
+        continue
+      for _ in range(50):
+        # mix the ECUs of a few cars, dropping some and adding unknown versions
+        live_fw_versions = defaultdict(set)
+        for car in rng.sample(list(cars), min(len(cars), rng.randint(1, 3))):
+          for ecu, versions in cars[car].items():
+            if rng.random() < 0.8:
+              live_fw_versions[ecu[1:]].add(rng.choice(versions) if rng.random() < 0.9 else b'unknown')
+        live_fw_versions = dict(live_fw_versions)
+        exclude = rng.choice(list(cars))
+        extra = {exclude: {ecu: [next(iter(live_fw_versions.get(ecu[1:], {b'unknown'})))] for ecu in cars[exclude]}}
+
+        with self.subTest(brand=brand):
+          self.assertEqual(match_fw_to_car_exact(live_fw_versions, brand), exact_reference(live_fw_versions, brand, {}))
+          self.assertEqual(match_fw_to_car_exact(live_fw_versions, brand, extra_fw_versions=extra), exact_reference(live_fw_versions, brand, extra))
+          self.assertEqual(match_fw_to_car_fuzzy(live_fw_versions, brand, log=False), fuzzy_reference(live_fw_versions, brand, None))
+          self.assertEqual(match_fw_to_car_fuzzy(live_fw_versions, brand, log=False, exclude=exclude), fuzzy_reference(live_fw_versions, brand, exclude))
+
   def test_fw_version_lists(self):
     for car_model, ecus in FW_VERSIONS.items():
       with self.subTest(car_model=car_model.value):
@@ -214,13 +267,14 @@ class TestFwFingerprintTiming(unittest.TestCase):
       self.current_obd_multiplexing = obd_multiplexing
       self.total_time += 0.1 / 2
 
-  def fake_get_data(self, timeout):
+  def fake_get_data_concurrent(self, queries, timeout, total_timeout=60., stop=None):
+    # concurrent queries share the timeout
     self.total_time += timeout
-    return {}
+    return [{} for _ in queries]
 
   def _benchmark_brand(self, brand):
     self.total_time = 0
-    with patch("opendbc.car.isotp_parallel_query.IsoTpParallelQuery.get_data", self.fake_get_data):
+    with patch("opendbc.car.fw_versions.get_data_concurrent", self.fake_get_data_concurrent):
       for _ in range(self.N):
         # Treat each brand as the most likely (aka, the first) brand with OBD multiplexing initially on
         self.current_obd_multiplexing = True
@@ -237,7 +291,7 @@ class TestFwFingerprintTiming(unittest.TestCase):
 
   def test_startup_timing(self):
     # Tests worse-case VIN query time and typical present ECU query time
-    vin_ref_times = {'worst': 1.6, 'best': 0.8}  # best assumes we go through all queries to get a match
+    vin_ref_times = {'worst': 0.6, 'best': 0.3}  # best assumes we go through all queries to get a match
     present_ecu_ref_time = 0.45
 
     def fake_get_ecu_addrs(*_, timeout):
@@ -255,27 +309,27 @@ class TestFwFingerprintTiming(unittest.TestCase):
     for name, args in (('worst', {}), ('best', {'retry': 1})):
       with self.subTest(name=name):
         self.total_time = 0.0
-        with patch("opendbc.car.isotp_parallel_query.IsoTpParallelQuery.get_data", self.fake_get_data):
+        with patch("opendbc.car.vin.get_data_concurrent", self.fake_get_data_concurrent):
           for _ in range(self.N):
             get_vin(self.fake_can_recv, self.fake_can_send, (0, 1), **args)
         self._assert_timing(self.total_time / self.N, vin_ref_times[name])
         print(f'get_vin {name} case, query time={self.total_time / self.N} seconds')
 
   def test_fw_query_timing(self):
-    total_ref_time = 8.2
+    total_ref_time = 6.4
     brand_ref_times = {
       'gm': 1.0,
       'body': 0.1,
       'chrysler': 0.3,
-      'ford': 1.5,
-      'honda': 0.45,
-      'hyundai': 0.65,
+      'ford': 1.4,
+      'honda': 0.35,
+      'hyundai': 0.35,
       'mazda': 0.1,
-      'nissan': 1.6,
-      'subaru': 0.65,
+      'nissan': 1.1,
+      'subaru': 0.45,
       'tesla': 0.1,
-      'toyota': 0.7,
-      'volkswagen': 0.65,
+      'toyota': 0.4,
+      'volkswagen': 0.25,
       'rivian': 0.3,
       'psa': 0.1,
       'perodua': 0.1,
@@ -297,6 +351,49 @@ class TestFwFingerprintTiming(unittest.TestCase):
       self._assert_timing(total_time, total_ref_time)
       print(f'all brands, total FW query time={total_time} seconds')
 
+  def test_concurrent_fw_queries(self):
+    # simulated ECUs of one car answer every query sent to their addresses, querying concurrently
+    # must find the same FW as querying one request at a time, in less time
+    def schedule_serially(queries):
+      return [[i] for i in range(len(queries))]
+
+    for brand, cars in VERSIONS.items():
+      if not len(cars):
+        continue
+      car_model, ecus = next(iter(cars.items()))
+      fw_by_addr = {(addr, sub_addr): versions[0] for (_, addr, sub_addr), versions in ecus.items()}
+      ecu_rx_addrs = {(uds.get_rx_addr_for_tx_addr(addr), sub_addr, 1) for addr, sub_addr in fw_by_addr}
+
+      def fake_get_data_concurrent(queries, timeout):
+        self.total_time += timeout
+        return [{addr: fw_by_addr[addr] for addr in q.msg_addrs if addr in fw_by_addr} for q in queries]  # noqa: B023
+
+      with self.subTest(brand=brand), patch("opendbc.car.fw_versions.get_data_concurrent", fake_get_data_concurrent):
+        car_fw = {}
+        query_times = {}
+        for name, schedule in (("concurrent", None), ("serial", schedule_serially)):
+          self.total_time = 0.0
+          with patch("opendbc.car.fw_versions.schedule_fw_queries", schedule) if schedule is not None else contextlib.nullcontext():
+            car_fw[name] = get_fw_versions_ordered(self.fake_can_recv, self.fake_can_send, lambda obd: None, "", ecu_rx_addrs)
+          query_times[name] = self.total_time
+
+        self.assertEqual([(f.brand, f.address, f.subAddress, f.fwVersion, list(f.request)) for f in car_fw["concurrent"]],
+                         [(f.brand, f.address, f.subAddress, f.fwVersion, list(f.request)) for f in car_fw["serial"]])
+        self.assertLessEqual(query_times["concurrent"], query_times["serial"])
+
+  def test_fw_query_exception(self):
+    # an exception cutting a round short keeps the responses of the queries that already finished
+    def fake_get_data_concurrent(queries, timeout):
+      queries[0].results = {addr: b"fw" for addr in queries[0].msg_addrs}
+      raise RuntimeError("can_recv failed")
+
+    queries, _ = _get_fw_queries(VERSIONS, "toyota")
+    with patch("opendbc.car.fw_versions.get_data_concurrent", fake_get_data_concurrent):
+      responses = next(_run_fw_queries(self.fake_can_recv, self.fake_can_send, lambda obd: None, queries, 0.1, False))
+    finished, *cut_short = responses.values()
+    self.assertEqual(set(finished.values()), {b"fw"})
+    self.assertTrue(len(cut_short) and not any(cut_short))
+
   def test_get_fw_versions(self):
     # some coverage on IsoTpParallelQuery and panda UDS library
     # TODO: replace this with full fingerprint simulation testing
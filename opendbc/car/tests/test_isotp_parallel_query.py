@@ -0,0 +1,56 @@
+import unittest
+from unittest import mock
+
+from opendbc.car import uds
+from opendbc.car.fw_query_definitions import StdQueries
+from opendbc.car.isotp_parallel_query import RECV_POLL_INTERVAL, IsoTpParallelQuery, get_data_concurrent
+from opendbc.car.tests.ecu_sim import SimulatedCanNetwork, SimulatedEcu
+
+VIN = b"1GBHK26L5EF123456"
+
+
+class TestIsoTpParallelQuery(unittest.TestCase):
+  def test_sweep(self):
+    # like the VIN query, a functional request with the whole 11 and 29-bit physical ranges set up for responses
+    ecus = [SimulatedEcu(0, 0x7E0, 0x7E8, {StdQueries.UDS_VIN_REQUEST: StdQueries.UDS_VIN_RESPONSE + VIN}, functional=True),
+            SimulatedEcu(0, 0x750, 0x758, {StdQueries.UDS_VIN_REQUEST: StdQueries.UDS_VIN_RESPONSE + VIN}, sub_addr=0xF),
+            SimulatedEcu(0, 0x750, 0x758, {StdQueries.UDS_VIN_REQUEST: StdQueries.UDS_VIN_RESPONSE + VIN}, sub_addr=0x6D)]
+    network = SimulatedCanNetwork(ecus)
+    addrs = [a for a in range(0x700, 0x800) if a != 0x7DF] + list(range(0x18DA00F1, 0x18DB00F1, 0x100)) + [(0x750, 0xF), (0x750, 0x6D)]
+    query = IsoTpParallelQuery(network.can_send, network.can_recv, 0, addrs, [StdQueries.UDS_VIN_REQUEST], [StdQueries.UDS_VIN_RESPONSE],
+                               functional_addrs=uds.FUNCTIONAL_ADDRS)
+
+    recv = uds.IsoTpMessage.recv
+    with network.patch_time(), mock.patch.object(uds.IsoTpMessage, "recv", autospec=True, side_effect=recv) as recv_mock:
+      results = query.get_data(0.1)
+    self.assertEqual(results, {(0x7E0, None): VIN})
+    # the sub-addressed ECUs weren't asked, only the functional one responded
+    self.assertLessEqual(recv_mock.call_count, 10)
+    self.assertAlmostEqual(network.now, 0.1, delta=2 * 0.01)
+
+  def test_stop(self):
+    # stopping on the first VIN still finishes the one that's being received, without waiting for new responders
+    ecus = [SimulatedEcu(0, 0x7E0, 0x7E8, {StdQueries.UDS_VIN_REQUEST: StdQueries.UDS_VIN_RESPONSE + VIN}, functional=True),
+            SimulatedEcu(0, 0x7E1, 0x7E9, {StdQueries.UDS_VIN_REQUEST: StdQueries.UDS_VIN_RESPONSE + VIN}, functional=True, separation_time=0.02)]
+    network = SimulatedCanNetwork(ecus)
+    query = IsoTpParallelQuery(network.can_send, network.can_recv, 0, [0x7E0, 0x7E1, 0x7E2], [StdQueries.UDS_VIN_REQUEST],
+                               [StdQueries.UDS_VIN_RESPONSE], functional_addrs=uds.FUNCTIONAL_ADDRS)
+    with network.patch_time():
+      results = get_data_concurrent([query], 0.1, stop=lambda: len(query.results) > 0)
+    self.assertEqual(results, [{(0x7E0, None): VIN, (0x7E1, None): VIN}])
+    self.assertLess(network.now, 0.1)
+
+  def test_non_blocking_can_recv(self):
+    network = SimulatedCanNetwork([])
+    can_recv = mock.Mock(return_value=[])
+    query = IsoTpParallelQuery(network.can_send, can_recv, 0, [0x750], [StdQueries.TESTER_PRESENT_REQUEST], [StdQueries.TESTER_PRESENT_RESPONSE])
+    with network.patch_time():
+      self.assertEqual(query.get_data(0.1), {})
+
+    # sleeps between polls, until the deadline
+    self.assertAlmostEqual(network.now, 0.1, delta=2 * RECV_POLL_INTERVAL)
+    self.assertAlmostEqual(can_recv.call_count, 0.1 / RECV_POLL_INTERVAL, delta=5)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,91 @@
+import os
+import random
+import tempfile
+import tracemalloc
+import unittest
+import zstandard as zstd
+
+from opendbc.car import logreader
+from opendbc.car.logreader import LogReader, capnp_log
+from opendbc.testing import parameterized
+
+
+def _log(n: int, shuffle: int = 0, seed: int = 0) -> bytes:
+  """n events, alternating can and frame, with logMonoTime shuffled within windows of `shuffle` events"""
+  rng = random.Random(seed)
+  times = list(range(n))
+  if shuffle:
+    for i in range(0, n, shuffle):
+      window = times[i:i + shuffle]
+      rng.shuffle(window)
+      times[i:i + shuffle] = window
+
+  dat = []
+  for i, t in enumerate(times):
+    msg = capnp_log.Event.new_message(logMonoTime=t * 10_000_000)
+    if i % 2:
+      msg.frame = None
+    else:
+      for j, frame in enumerate(msg.init("can", 8)):
+        frame.address, frame.dat, frame.src = 0x100 + j, bytes([i & 0xFF] * 8), j % 3
+    dat.append(msg.to_bytes())
+  return b"".join(dat)
+
+
+class TestLogReader(unittest.TestCase):
+  def _write(self, dat: bytes, ext: str = ".zst") -> str:
+    fd, fn = tempfile.mkstemp(suffix=ext)
+    with os.fdopen(fd, "wb") as f:
+      f.write(dat)
+    self.addCleanup(os.remove, fn)
+    return fn
+
+  @parameterized("compressed, sort_by_time", [(c, s) for c in (True, False) for s in (True, False)])
+  def test_streaming(self, compressed, sort_by_time):
+    dat = _log(2000, shuffle=50)
+    fn = self._write(zstd.compress(dat) if compressed else dat, "" if not compressed else ".zst")
+
+    eager = LogReader(fn, sort_by_time=sort_by_time)
+    streamed = LogReader(fn, sort_by_time=sort_by_time, streaming=True)
+    times = [e.logMonoTime for e in streamed]
+    self.assertEqual(times, [e.logMonoTime for e in eager])
+    self.assertEqual(len(times), 2000)
+    self.assertEqual(times == sorted(times), sort_by_time)
+    # can be iterated again
+    self.assertEqual([e.logMonoTime for e in streamed], times)
+
+    self.assertEqual([[c.address for c in m] for m in streamed.filter("can")], [[c.address for c in m] for m in eager.filter("can")])
+    self.assertEqual(len(list(streamed.filter("frame"))), 1000)
+    self.assertEqual(list(streamed.first("can")[0].dat), list(eager.first("can")[0].dat))
+    self.assertIsNone(streamed.first("initData"))
+
+  def test_sort_window(self):
+    fn = self._write(zstd.compress(_log(1000, shuffle=100)))
+    times = [e.logMonoTime for e in LogReader(fn, sort_by_time=True, streaming=True, sort_window=100)]
+    self.assertEqual(times, sorted(times))
+    times = [e.logMonoTime for e in LogReader(fn, sort_by_time=True, streaming=True, sort_window=10)]
+    self.assertNotEqual(times, sorted(times))
+
+  def test_corrupted(self):
+    dat = _log(100)
+    fn = self._write(zstd.compress(dat[:-10]))
+    for streaming in (True, False):
+      with self.assertWarns(RuntimeWarning):
+        self.assertEqual(len(list(LogReader(fn, streaming=streaming))), 99)
+
+  def test_memory(self):
+    # peak memory doesn't grow with the log
+    peaks = []
+    for n in (10_000, 40_000):
+      fn = self._write(zstd.compress(_log(n)))
+      tracemalloc.start()
+      count = sum(len(m) for m in LogReader(fn, sort_by_time=True, streaming=True).filter("can"))
+      peaks.append(tracemalloc.get_traced_memory()[1])
+      tracemalloc.stop()
+      self.assertEqual(count, n // 2 * 8)
+    self.assertLess(peaks[1], 1.5 * peaks[0])
+    self.assertLess(peaks[1], 8 * logreader.CHUNK_SIZE)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+from opendbc.car import uds
+from opendbc.car.tests.benchmark_isotp import benchmark_transfer
+from opendbc.car.tests.ecu_sim import SimulatedCanNetwork, SimulatedEcu
+from opendbc.safety import DLC_TO_LEN
+from opendbc.testing import parameterized
+
+DID = uds.DATA_IDENTIFIER_TYPE.APPLICATION_SOFTWARE_IDENTIFICATION
+READ_DID = bytes([uds.SERVICE_TYPE.READ_DATA_BY_IDENTIFIER]) + DID.to_bytes(2)
+
+
+class TestIsoTpCanFd(unittest.TestCase):
+  @parameterized("size, tx_dl, sub_addr", [(s, dl, sub) for s in (1, 5, 6, 10, 61, 62, 63, 200, 4095, 5000) for dl in (8, 12, 64) for sub in (None, 0xF)])
+  def test_transfer(self, size, tx_dl, sub_addr):
+    data = bytes(i & 0xFF for i in range(size))
+    transfer_request = bytes([uds.SERVICE_TYPE.TRANSFER_DATA, 1]) + data
+    ecu = SimulatedEcu(0, 0x750, 0x758, {
+      READ_DID: bytes([READ_DID[0] + 0x40]) + READ_DID[1:] + data,
+      transfer_request: bytes([transfer_request[0] + 0x40, 1]) + data,
+    }, sub_addr=sub_addr, tx_dl=tx_dl)
+    network = SimulatedCanNetwork([ecu], record=True)
+
+    client = uds.UdsClient(network.panda(), 0x750, sub_addr=sub_addr)
+    with network.patch_time():
+      self.assertEqual(client.read_data_by_identifier(DID), data)
+      self.assertEqual(client.transfer_data(1, data), data)
+
+    # the client switches to CAN-FD frames once the ECU uses them, and all frames are padded to valid lengths
+    self.assertLessEqual(client.tx_dl, tx_dl)
+    if size >= 200:
+      self.assertEqual(client.tx_dl, tx_dl)
+    self.assertTrue(all(len(msg.dat) in DLC_TO_LEN[8:] for msg in network.sent + network.received))
+    self.assertLessEqual(max(len(msg.dat) for msg in network.sent + network.received), tx_dl)
+
+  def test_fixed_tx_dl(self):
+    ecu = SimulatedEcu(0, 0x750, 0x758, {READ_DID: bytes([READ_DID[0] + 0x40]) + READ_DID[1:] + bytes(100)}, tx_dl=64)
+    network = SimulatedCanNetwork([ecu])
+    client = uds.UdsClient(network.panda(), 0x750, tx_dl=8)
+    with network.patch_time():
+      client.read_data_by_identifier(DID)
+    self.assertEqual(client.tx_dl, 8)
+
+  def test_throughput(self):
+    classic, fd = benchmark_transfer(4095, 8), benchmark_transfer(4095, 64)
+    self.assertEqual(fd["tx_dl"], 64)
+    for direction in ("read", "write"):
+      self.assertLess(fd[f"{direction}_frames"] * 8, classic[f"{direction}_frames"])
+      self.assertLess(fd[f"{direction}_s"] * 3, classic[f"{direction}_s"])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,99 @@
+import asyncio
+import unittest
+
+from opendbc.car import uds
+from opendbc.car.tests.ecu_sim import SimulatedCanNetwork, SimulatedEcu
+from opendbc.car.uds_async import AsyncCanTransport, AsyncUdsClient
+
+DID = uds.DATA_IDENTIFIER_TYPE.APPLICATION_SOFTWARE_IDENTIFICATION
+READ_DID = bytes([uds.SERVICE_TYPE.READ_DATA_BY_IDENTIFIER]) + DID.to_bytes(2)
+BLOCK = bytes(range(40))
+TRANSFER_DATA = bytes([uds.SERVICE_TYPE.TRANSFER_DATA, 1]) + BLOCK
+
+# (tx_addr, sub_addr)
+ECUS = [(0x7E0, None), (0x7E2, None), (0x750, 0xF), (0x750, 0x6D), (0x18DA10F1, None)]
+
+
+def _version(tx_addr: int, sub_addr: int | None) -> bytes:
+  return f"version {tx_addr:x} {sub_addr}".encode()
+
+
+def _ecus(**kwargs) -> list[SimulatedEcu]:
+  return [SimulatedEcu(0, tx_addr, uds.get_rx_addr_for_tx_addr(tx_addr), {
+    READ_DID: bytes([READ_DID[0] + 0x40]) + READ_DID[1:] + _version(tx_addr, sub_addr),
+    TRANSFER_DATA: bytes([TRANSFER_DATA[0] + 0x40, 1]),
+  }, sub_addr=sub_addr, reject_unknown=True, **kwargs) for tx_addr, sub_addr in ECUS]
+
+
+class TestAsyncUdsClient(unittest.TestCase):
+  def _run(self, network: SimulatedCanNetwork, main):
+    async def run():
+      panda = network.panda()
+      async with AsyncCanTransport(panda.can_send, panda.can_recv) as transport:
+        clients = [AsyncUdsClient(transport, tx_addr, sub_addr=sub_addr, timeout=0.2) for tx_addr, sub_addr in ECUS]
+        try:
+          return await main(clients)
+        finally:
+          for client in clients:
+            client.close()
+    return asyncio.run(run())
+
+  def test_concurrent_sessions(self):
+    async def main(clients):
+      return await asyncio.gather(*(c.read_data_by_identifier(DID) for c in clients))
+
+    network = SimulatedCanNetwork(_ecus(response_pending_rate=0.5, separation_time=0.002))
+    self.assertEqual(self._run(network, main), [_version(*ecu) for ecu in ECUS])
+
+    # same as the sync client
+    network = SimulatedCanNetwork(_ecus())
+    for tx_addr, sub_addr in ECUS:
+      client = uds.UdsClient(network.panda(), tx_addr, sub_addr=sub_addr)
+      self.assertEqual(client.read_data_by_identifier(DID), _version(tx_addr, sub_addr))
+
+  def test_services(self):
+    async def main(clients):
+      client = clients[2]
+      # multi-frame request, then the next request on the same session
+      self.assertEqual(await client.transfer_data(1, BLOCK), b"")
+      self.assertEqual(await client.read_data_by_identifier(DID), _version(*ECUS[2]))
+      with self.assertRaises(uds.NegativeResponseError):
+        await client.read_data_by_identifier(uds.DATA_IDENTIFIER_TYPE.VIN)
+      # the others answer while one session waits
+      results = await asyncio.gather(clients[0].tester_present(), clients[1].read_data_by_identifier(DID), return_exceptions=True)
+      self.assertIsInstance(results[0], uds.NegativeResponseError)
+      self.assertEqual(results[1], _version(*ECUS[1]))
+
+    self._run(SimulatedCanNetwork(_ecus(separation_time=0.001)), main)
+
+  def test_same_as_sync(self):
+    # both clients build requests and parse responses with the same helpers
+    routine = uds.ROUTINE_IDENTIFIER_TYPE.ERASE_MEMORY
+    responses = {
+      bytes([uds.SERVICE_TYPE.SECURITY_ACCESS, uds.ACCESS_TYPE.REQUEST_SEED]): bytes([0x67, uds.ACCESS_TYPE.REQUEST_SEED]) + b"seed",
+      bytes([uds.SERVICE_TYPE.ROUTINE_CONTROL, uds.ROUTINE_CONTROL_TYPE.START]) + routine.to_bytes(2): bytes([0x71, 1]) + routine.to_bytes(2) + b"ok",
+      bytes([uds.SERVICE_TYPE.REQUEST_DOWNLOAD, 0, 0x44]) + bytes(8): bytes([0x74, 0x20, 0x01, 0x02]),
+    }
+
+    def services(client):
+      return (client.security_access(uds.ACCESS_TYPE.REQUEST_SEED), client.routine_control(uds.ROUTINE_CONTROL_TYPE.START, routine),
+              client.request_download(0, 0))
+
+    async def main(clients):
+      return [await r for r in services(clients[0])]
+
+    expected = [b"seed", b"ok", 0x102]
+    network = SimulatedCanNetwork([SimulatedEcu(0, 0x7E0, 0x7E8, responses)])
+    self.assertEqual(list(services(uds.UdsClient(network.panda(), 0x7E0))), expected)
+    self.assertEqual(self._run(SimulatedCanNetwork([SimulatedEcu(0, 0x7E0, 0x7E8, responses)]), main), expected)
+
+  def test_timeout(self):
+    async def main(clients):
+      return await asyncio.gather(*(c.read_data_by_identifier(DID) for c in clients), return_exceptions=True)
+
+    results = self._run(SimulatedCanNetwork(_ecus(drop_rate=1.)), main)
+    self.assertTrue(all(isinstance(r, uds.MessageTimeoutError) for r in results))
+
+
+if __name__ == "__main__":
+  unittest.main()
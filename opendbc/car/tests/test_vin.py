@@ -0,0 +1,63 @@
+import unittest
+from unittest import mock
+
+from opendbc.car import uds
+from opendbc.car.fw_query_definitions import StdQueries
+from opendbc.car.tests.ecu_sim import SimulatedCanNetwork, SimulatedEcu
+from opendbc.car.vin import VIN_QUERIES, VIN_UNKNOWN, get_vin, get_vin_rounds
+
+VIN = b"1GBHK26L5EF123456"
+
+
+class TestGetVin(unittest.TestCase):
+  def _get_vin(self, ecus: list[SimulatedEcu]):
+    network = SimulatedCanNetwork(ecus)
+    init = uds.IsoTpMessage.__init__
+    with network.patch_time(), mock.patch.object(uds.IsoTpMessage, "__init__", autospec=True, side_effect=init) as init_mock:
+      result = get_vin(network.can_recv, network.can_send, (0, 1))
+    return result, network.now, init_mock.call_count
+
+  def test_rounds(self):
+    rounds = get_vin_rounds((0, 1))
+    self.assertEqual(len(rounds), 3)
+    self.assertEqual(sorted((VIN_QUERIES.index(q), bus) for r in rounds for q, bus in r),
+                     sorted((i, bus) for i, q in enumerate(VIN_QUERIES) for bus in q.buses))
+    for vin_round in rounds:
+      rx_addrs = [(bus, rx_addr) for query, bus in vin_round for rx_addr in query.rx_addrs()]
+      self.assertEqual(len(rx_addrs), len(set(rx_addrs)))
+
+  def test_functional(self):
+    for bus in (0, 1):
+      with self.subTest(bus=bus):
+        ecu = SimulatedEcu(bus, 0x7E0, 0x7E8, {StdQueries.UDS_VIN_REQUEST: StdQueries.UDS_VIN_RESPONSE + VIN}, functional=True)
+        result, elapsed, isotp_msgs = self._get_vin([ecu])
+        self.assertEqual(result, (0x7E8, bus, VIN.decode()))
+        # returns without waiting for the timeout, and only the responding ECU got an IsoTpMessage
+        self.assertLess(elapsed, 0.05)
+        self.assertLess(isotp_msgs, 10)
+
+  def test_physical(self):
+    # padded, and only answers the third round
+    ecu = SimulatedEcu(0, 0x797, 0x79A, {StdQueries.KWP_VIN_REQUEST: StdQueries.KWP_VIN_RESPONSE + VIN + b"\x00\x00"})
+    result, elapsed, _ = self._get_vin([ecu])
+    self.assertEqual(result, (0x79A, 0, VIN.decode()))
+    # two rounds timed out, then a multi-frame response
+    self.assertGreater(elapsed, 0.2)
+    self.assertLess(elapsed, 0.3)
+
+  def test_invalid_vin(self):
+    # an invalid VIN is returned once its round is done, a valid one from another query is preferred
+    invalid = SimulatedEcu(0, 0x7E0, 0x7E8, {StdQueries.UDS_VIN_REQUEST: StdQueries.UDS_VIN_RESPONSE + b"0" * 16}, functional=True)
+    gm = SimulatedEcu(0, 0x24B, 0x64B, {StdQueries.GM_VIN_REQUEST: StdQueries.GM_VIN_RESPONSE + VIN})
+    self.assertEqual(self._get_vin([invalid])[0], (0x7E8, 0, "0" * 16))
+    self.assertEqual(self._get_vin([invalid, gm])[0], (0x64B, 0, VIN.decode()))
+
+  def test_no_response(self):
+    result, elapsed, isotp_msgs = self._get_vin([])
+    self.assertEqual(result, (-1, -1, VIN_UNKNOWN))
+    self.assertAlmostEqual(elapsed, 0.6, delta=0.05)
+    self.assertLess(isotp_msgs, 50)
+
+
+if __name__ == "__main__":
+  unittest.main()
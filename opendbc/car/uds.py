@@ -7,6 +7,7 @@ from enum import IntEnum
 from functools import partial
 
 from opendbc.car.carlog import carlog
+from opendbc.safety import DLC_TO_LEN
 
 
 class SERVICE_TYPE(IntEnum):
@@ -407,7 +408,7 @@ class CanClient:
         msg = bytes([self.sub_addr]) + msg
 
       carlog.debug(f"CAN-TX: {hex(self.tx_addr)} - 0x{bytes.hex(msg)}")
-      assert len(msg) <= 8
+      assert len(msg) <= 64
 
       self.tx(self.tx_addr, msg, self.bus)
       # prevent rx buffer from overflowing on large tx
@@ -415,12 +416,22 @@ class CanClient:
         self._recv_buffer()
 
 
+def get_padded_len(length: int) -> int:
+  """Frame length to pad an ISO-TP frame of length bytes to: 8 for classic CAN, or the next CAN-FD data length"""
+  return next(l for l in DLC_TO_LEN if l >= max(length, 8))
+
+
 class IsoTpMessage:
-  def __init__(self, can_client: CanClient, timeout: float = 1, single_frame_mode: bool = False, separation_time: float = 0):
+  def __init__(self, can_client: CanClient, timeout: float = 1, single_frame_mode: bool = False, separation_time: float = 0, tx_dl: int = 8):
     self._can_client = can_client
     self.timeout = timeout
     self.single_frame_mode = single_frame_mode
-    self.max_len = 8 if self._can_client.sub_addr is None else 7
+    # frame lengths (TX_DL and RX_DL), the ECU's is set by the length of its first frame
+    assert tx_dl in DLC_TO_LEN and tx_dl >= 8, f"invalid tx_dl: {tx_dl}"
+    self._sub_addr_len = 0 if self._can_client.sub_addr is None else 1
+    self.tx_dl = tx_dl
+    self.rx_dl = 8
+    self.max_len = tx_dl - self._sub_addr_len
 
     # <= 127, separation time in milliseconds
     # 0xF1 to 0xF9 UF, 100 to 900 microseconds
@@ -432,11 +443,15 @@ class IsoTpMessage:
     else:
       raise Exception("Separation time not in range")
 
+    # flow control is always a classic frame
     self.flow_control_msg = bytes([
       0x30,  # flow control
       0x01 if self.single_frame_mode else 0x00,  # block size
       separation_time,
-    ]).ljust(self.max_len, b"\x00")
+    ]).ljust(8 - self._sub_addr_len, b"\x00")
+
+  def _pad(self, msg: bytes) -> bytes:
+    return msg.ljust(get_padded_len(len(msg) + self._sub_addr_len) - self._sub_addr_len, b"\x00")
 
   def send(self, dat: bytes, setup_only: bool = False) -> None:
     # throw away any stale data
@@ -445,6 +460,7 @@ class IsoTpMessage:
     self.tx_dat = dat
     self.tx_len = len(dat)
     self.tx_idx = 0
+    self.tx_pos = 0
     self.tx_done = False
 
     self.rx_dat = b""
@@ -457,17 +473,29 @@ class IsoTpMessage:
     self._tx_first_frame(setup_only=setup_only)
 
   def _tx_first_frame(self, setup_only: bool = False) -> None:
-    if self.tx_len < self.max_len:
+    if self.tx_len < 8 - self._sub_addr_len:
       # single frame (send all bytes)
       if not setup_only:
         carlog.debug(f"ISO-TP: TX - single frame - {hex(self._can_client.tx_addr)}")
-      msg = (bytes([self.tx_len]) + self.tx_dat).ljust(self.max_len, b"\x00")
+      msg = (bytes([self.tx_len]) + self.tx_dat).ljust(8 - self._sub_addr_len, b"\x00")
+      self.tx_done = True
+    elif self.tx_len <= self.max_len - 2:
+      # CAN-FD single frame, escaped with a zero length
+      if not setup_only:
+        carlog.debug(f"ISO-TP: TX - CAN-FD single frame - {hex(self._can_client.tx_addr)}")
+      msg = self._pad(bytes([0, self.tx_len]) + self.tx_dat)
       self.tx_done = True
     else:
-      # first frame (send first 6 bytes)
+      # first frame (send first 6 bytes, or as many as fit in a CAN-FD frame)
       if not setup_only:
         carlog.debug(f"ISO-TP: TX - first frame - {hex(self._can_client.tx_addr)}")
-      msg = (struct.pack("!H", 0x1000 | self.tx_len) + self.tx_dat[:self.max_len - 2]).ljust(self.max_len - 2, b"\x00")
+      if self.tx_len <= 0xFFF:
+        header = struct.pack("!H", 0x1000 | self.tx_len)
+      else:
+        # escape sequence for lengths over 4095
+        header = struct.pack("!HI", 0x1000, self.tx_len)
+      self.tx_pos = self.max_len - len(header)
+      msg = header + self.tx_dat[:self.tx_pos]
     if not setup_only:
       self._can_client.send([msg])
 
@@ -505,16 +533,16 @@ class IsoTpMessage:
 
       # "if the first byte is 0x00, then it's a CAN-FD SF, and the second byte specifies the size of the data."
       # - https://en.wikipedia.org/wiki/CAN_FD
-      if rx_data[0] & 0x0F == 0 and len(rx_data) > 8:
+      if rx_data[0] & 0x0F == 0 and len(rx_data) > 8 - self._sub_addr_len:
         self.rx_len = rx_data[1]
         offset = 2
-        # TODO: update self.max_len for CAN FD
-        max_len = 62 if self._can_client.sub_addr is None else 61
-        assert self.rx_len <= max_len, f"isotp - rx: invalid single frame length: {self.rx_len}"
+        assert self.rx_len <= len(rx_data) - 2, f"isotp - rx: invalid single frame length: {self.rx_len}"
+        # the ECU's frame length is at least this
+        self.rx_dl = max(self.rx_dl, len(rx_data) + self._sub_addr_len)
       else:
         self.rx_len = rx_data[0] & 0x0F
         offset = 1
-        assert self.rx_len < self.max_len, f"isotp - rx: invalid single frame length: {self.rx_len}"
+        assert self.rx_len < 8 - self._sub_addr_len, f"isotp - rx: invalid single frame length: {self.rx_len}"
 
       self.rx_dat = rx_data[offset:offset + self.rx_len]
       self.rx_idx = 0
@@ -523,13 +551,22 @@ class IsoTpMessage:
       return ISOTP_FRAME_TYPE.SINGLE
 
     elif rx_data[0] >> 4 == ISOTP_FRAME_TYPE.FIRST:
-      # TODO: support CAN FD first frames
       # Once a first frame is received, further frames must be consecutive
       assert self.rx_dat == b"" or self.rx_done, "isotp - rx: first frame with active frame"
+      # the first frame sets the ECU's frame length for the consecutive frames
+      rx_max_len = len(rx_data)
+      assert rx_max_len + self._sub_addr_len in DLC_TO_LEN[8:], f"isotp - rx: invalid CAN frame length: {len(rx_data)}"
+      self.rx_dl = rx_max_len + self._sub_addr_len
       self.rx_len = ((rx_data[0] & 0x0F) << 8) + rx_data[1]
-      assert self.rx_len >= self.max_len, f"isotp - rx: invalid first frame length: {self.rx_len}"
-      assert len(rx_data) == self.max_len, f"isotp - rx: invalid CAN frame length: {len(rx_data)}"
-      self.rx_dat = rx_data[2:]
+      offset = 2
+      if self.rx_len == 0:
+        # escape sequence for lengths over 4095
+        self.rx_len = struct.unpack("!I", rx_data[2:6])[0]
+        offset = 6
+      # must not fit in a single frame
+      min_len = rx_max_len if rx_max_len <= 8 else rx_max_len - 1
+      assert self.rx_len >= min_len, f"isotp - rx: invalid first frame length: {self.rx_len}"
+      self.rx_dat = rx_data[offset:]
       self.rx_idx = 0
       self.rx_done = False
       carlog.debug(f"ISO-TP: RX - first frame - {hex(self._can_client.rx_addr)} idx={self.rx_idx} done={self.rx_done}")
@@ -563,17 +600,18 @@ class IsoTpMessage:
         delay_div = 1000. if rx_data[2] & 0x80 == 0 else 10000.
         delay_sec = delay_ts / delay_div
 
-        # first frame = 6 bytes, each consecutive frame = 7 bytes
+        # each consecutive frame = 7 bytes, or 63 on CAN-FD
         num_bytes = self.max_len - 1
-        start = self.max_len - 2 + self.tx_idx * num_bytes
+        start = self.tx_pos
         count = rx_data[1]
-        end = start + count * num_bytes if count > 0 else self.tx_len
+        end = min(start + count * num_bytes, self.tx_len) if count > 0 else self.tx_len
         tx_msgs = []
         for i in range(start, end, num_bytes):
           self.tx_idx += 1
-          # consecutive tx messages
-          msg = (bytes([0x20 | (self.tx_idx & 0xF)]) + self.tx_dat[i:i + num_bytes]).ljust(self.max_len, b"\x00")
+          # consecutive tx messages, the last one padded to a valid frame length
+          msg = self._pad(bytes([0x20 | (self.tx_idx & 0xF)]) + self.tx_dat[i:i + num_bytes])
           tx_msgs.append(msg)
+        self.tx_pos = end
         # send consecutive tx messages
         self._can_client.send(tx_msgs, delay=delay_sec)
         if end >= self.tx_len:
@@ -608,9 +646,236 @@ def get_rx_addr_for_tx_addr(tx_addr, rx_offset=0x8):
   raise ValueError(f"invalid tx_addr: {tx_addr}")
 
 
-class UdsClient:
+class UdsRequest(NamedTuple):
+  service_type: SERVICE_TYPE
+  subfunction: int | None = None
+  data: bytes | None = None
+
+
+def _build_request(service_type: SERVICE_TYPE, subfunction: int | None, data: bytes | None) -> bytes:
+  req = bytes([service_type])
+  if subfunction is not None:
+    req += bytes([subfunction])
+  if data is not None:
+    req += data
+  return req
+
+
+def _parse_response(service_type: SERVICE_TYPE, subfunction: int | None, resp: bytes) -> bool:
+  """Checks a response to a request, raising on errors. Returns True if the response is pending"""
+  resp_sid = resp[0] if len(resp) > 0 else None
+
+  # negative response
+  if resp_sid == 0x7F:
+    service_id = resp[1] if len(resp) > 1 else -1
+    try:
+      service_desc = SERVICE_TYPE(service_id).name
+    except BaseException:
+      service_desc = 'NON_STANDARD_SERVICE'
+    error_code = resp[2] if len(resp) > 2 else -1
+    try:
+      error_desc = _negative_response_codes[error_code]
+    except BaseException:
+      error_desc = resp[3:].hex()
+    # wait for another message if response pending
+    if error_code == 0x78:
+      carlog.debug("UDS-RX: response pending")
+      return True
+    raise NegativeResponseError(f'{service_desc} - {error_desc}', service_id, error_code)
+
+  # positive response
+  if service_type + 0x40 != resp_sid:
+    resp_sid_hex = hex(resp_sid) if resp_sid is not None else None
+    raise InvalidServiceIdError(f'invalid response service id: {resp_sid_hex}')
+
+  if subfunction is not None:
+    resp_sfn = resp[1] if len(resp) > 1 else None
+    if subfunction != resp_sfn:
+      resp_sfn_hex = hex(resp_sfn) if resp_sfn is not None else None
+      raise InvalidSubFunctionError(f'invalid response subfunction: {resp_sfn_hex}')
+  return False
+
+
+# ***** service requests and responses, shared by UdsClient and AsyncUdsClient *****
+def _memory_record(memory_address: int, memory_size: int, memory_address_bytes: int, memory_size_bytes: int) -> bytes:
+  if memory_address_bytes < 1 or memory_address_bytes > 4:
+    raise ValueError(f'invalid memory_address_bytes: {memory_address_bytes}')
+  if memory_size_bytes < 1 or memory_size_bytes > 4:
+    raise ValueError(f'invalid memory_size_bytes: {memory_size_bytes}')
+  data = bytes([memory_size_bytes << 4 | memory_address_bytes])
+
+  if memory_address >= 1 << (memory_address_bytes * 8):
+    raise ValueError(f'invalid memory_address: {memory_address}')
+  data += struct.pack('!I', memory_address)[4 - memory_address_bytes:]
+  if memory_size >= 1 << (memory_size_bytes * 8):
+    raise ValueError(f'invalid memory_size: {memory_size}')
+  data += struct.pack('!I', memory_size)[4 - memory_size_bytes:]
+  return data
+
+
+def _identifier_response(resp: bytes, identifier: int, name: str = 'data identifier') -> bytes:
+  resp_id = struct.unpack('!H', resp[0:2])[0] if len(resp) >= 2 else None
+  if resp_id != identifier:
+    raise ValueError(f'invalid response {name}: {hex(resp_id)} expected: {hex(identifier)}')
+  return resp[2:]
+
+
+def _security_access_request(access_type: ACCESS_TYPE, security_key: bytes, data_record: bytes) -> UdsRequest:
+  request_seed = access_type % 2 != 0
+  if request_seed and len(security_key) != 0:
+    raise ValueError('security_key not allowed')
+  if not request_seed and len(security_key) == 0:
+    raise ValueError('security_key is missing')
+  if not request_seed and len(data_record) != 0:
+    raise ValueError('data_record not allowed')
+  data = security_key + data_record
+  return UdsRequest(SERVICE_TYPE.SECURITY_ACCESS, subfunction=access_type, data=data)
+
+
+def _access_timing_parameter_request(timing_parameter_type: TIMING_PARAMETER_TYPE, parameter_values: bytes | None) -> UdsRequest:
+  write_custom_values = timing_parameter_type == TIMING_PARAMETER_TYPE.SET_TO_GIVEN_VALUES
+  if not write_custom_values and parameter_values is not None:
+    raise ValueError('parameter_values not allowed')
+  if write_custom_values and parameter_values is None:
+    raise ValueError('parameter_values is missing')
+  return UdsRequest(SERVICE_TYPE.ACCESS_TIMING_PARAMETER, subfunction=timing_parameter_type, data=parameter_values)
+
+
+def _response_on_event_request(response_event_type: RESPONSE_EVENT_TYPE, store_event: bool, window_time: int,
+                               event_type_record: int, service_response_record: int) -> UdsRequest:
+  if store_event:
+    response_event_type |= 0x20  # type: ignore
+  # TODO: split record parameters into arrays
+  data = bytes([window_time, event_type_record, service_response_record])
+  return UdsRequest(SERVICE_TYPE.RESPONSE_ON_EVENT, subfunction=response_event_type, data=data)
+
+
+def _response_on_event_response(response_event_type: RESPONSE_EVENT_TYPE, resp: bytes) -> dict:
+  if response_event_type == RESPONSE_EVENT_TYPE.REPORT_ACTIVATED_EVENTS:
+    return {
+      "num_of_activated_events": resp[0],
+      "data": resp[1:],  # TODO: parse the reset of response
+    }
+
+  return {
+    "num_of_identified_events": resp[0],
+    "event_window_time": resp[1],
+    "data": resp[2:],  # TODO: parse the reset of response
+  }
+
+
+def _link_control_request(link_control_type: LINK_CONTROL_TYPE, baud_rate_type: BAUD_RATE_TYPE | None) -> UdsRequest:
+  data: bytes | None
+
+  if link_control_type == LINK_CONTROL_TYPE.VERIFY_BAUDRATE_TRANSITION_WITH_FIXED_BAUDRATE:
+    # baud_rate_type = BAUD_RATE_TYPE
+    data = bytes([cast(int, baud_rate_type)])
+  elif link_control_type == LINK_CONTROL_TYPE.VERIFY_BAUDRATE_TRANSITION_WITH_SPECIFIC_BAUDRATE:
+    # baud_rate_type = custom value (3 bytes big-endian)
+    data = struct.pack('!I', baud_rate_type)[1:]
+  else:
+    data = None
+  return UdsRequest(SERVICE_TYPE.LINK_CONTROL, subfunction=link_control_type, data=data)
+
+
+def _dynamically_define_data_identifier_request(dynamic_definition_type: DYNAMIC_DEFINITION_TYPE, dynamic_data_identifier: int,
+                                                source_definitions: list[DynamicSourceDefinition], memory_address_bytes: int,
+                                                memory_size_bytes: int) -> UdsRequest:
+  if memory_address_bytes < 1 or memory_address_bytes > 4:
+    raise ValueError(f'invalid memory_address_bytes: {memory_address_bytes}')
+  if memory_size_bytes < 1 or memory_size_bytes > 4:
+    raise ValueError(f'invalid memory_size_bytes: {memory_size_bytes}')
+
+  data = struct.pack('!H', dynamic_data_identifier)
+  if dynamic_definition_type == DYNAMIC_DEFINITION_TYPE.DEFINE_BY_IDENTIFIER:
+    for s in source_definitions:
+      data += struct.pack('!H', s.data_identifier) + bytes([s.position, s.memory_size])
+  elif dynamic_definition_type == DYNAMIC_DEFINITION_TYPE.DEFINE_BY_MEMORY_ADDRESS:
+    data += bytes([memory_size_bytes << 4 | memory_address_bytes])
+    for s in source_definitions:
+      if s.memory_address >= 1 << (memory_address_bytes * 8):
+        raise ValueError(f'invalid memory_address: {s.memory_address}')
+      data += struct.pack('!I', s.memory_address)[4 - memory_address_bytes:]
+      if s.memory_size >= 1 << (memory_size_bytes * 8):
+        raise ValueError(f'invalid memory_size: {s.memory_size}')
+      data += struct.pack('!I', s.memory_size)[4 - memory_size_bytes:]
+  elif dynamic_definition_type == DYNAMIC_DEFINITION_TYPE.CLEAR_DYNAMICALLY_DEFINED_DATA_IDENTIFIER:
+    pass
+  else:
+    raise ValueError(f'invalid dynamic identifier type: {hex(dynamic_definition_type)}')
+  return UdsRequest(SERVICE_TYPE.DYNAMICALLY_DEFINE_DATA_IDENTIFIER, subfunction=dynamic_definition_type, data=data)
+
+
+def _read_dtc_information_request(dtc_report_type: DTC_REPORT_TYPE, dtc_status_mask_type: DTC_STATUS_MASK_TYPE,
+                                  dtc_severity_mask_type: DTC_SEVERITY_MASK_TYPE, dtc_mask_record: int,
+                                  dtc_snapshot_record_num: int, dtc_extended_record_num: int) -> UdsRequest:
+  data = b''
+  # dtc_status_mask_type
+  if dtc_report_type == DTC_REPORT_TYPE.NUMBER_OF_DTC_BY_STATUS_MASK or \
+     dtc_report_type == DTC_REPORT_TYPE.DTC_BY_STATUS_MASK or \
+     dtc_report_type == DTC_REPORT_TYPE.MIRROR_MEMORY_DTC_BY_STATUS_MASK or \
+     dtc_report_type == DTC_REPORT_TYPE.NUMBER_OF_MIRROR_MEMORY_DTC_BY_STATUS_MASK or \
+     dtc_report_type == DTC_REPORT_TYPE.NUMBER_OF_EMISSIONS_RELATED_OBD_DTC_BY_STATUS_MASK or \
+     dtc_report_type == DTC_REPORT_TYPE.EMISSIONS_RELATED_OBD_DTC_BY_STATUS_MASK:
+     data += bytes([dtc_status_mask_type])
+  # dtc_mask_record
+  if dtc_report_type == DTC_REPORT_TYPE.DTC_SNAPSHOT_IDENTIFICATION or \
+     dtc_report_type == DTC_REPORT_TYPE.DTC_SNAPSHOT_RECORD_BY_DTC_NUMBER or \
+     dtc_report_type == DTC_REPORT_TYPE.DTC_EXTENDED_DATA_RECORD_BY_DTC_NUMBER or \
+     dtc_report_type == DTC_REPORT_TYPE.MIRROR_MEMORY_DTC_EXTENDED_DATA_RECORD_BY_DTC_NUMBER or \
+     dtc_report_type == DTC_REPORT_TYPE.SEVERITY_INFORMATION_OF_DTC:
+     data += struct.pack('!I', dtc_mask_record)[1:]  # 3 bytes
+  # dtc_snapshot_record_num
+  if dtc_report_type == DTC_REPORT_TYPE.DTC_SNAPSHOT_IDENTIFICATION or \
+     dtc_report_type == DTC_REPORT_TYPE.DTC_SNAPSHOT_RECORD_BY_DTC_NUMBER or \
+     dtc_report_type == DTC_REPORT_TYPE.DTC_SNAPSHOT_RECORD_BY_RECORD_NUMBER:
+     data += bytes([dtc_snapshot_record_num])
+  # dtc_extended_record_num
+  if dtc_report_type == DTC_REPORT_TYPE.DTC_EXTENDED_DATA_RECORD_BY_DTC_NUMBER or \
+     dtc_report_type == DTC_REPORT_TYPE.MIRROR_MEMORY_DTC_EXTENDED_DATA_RECORD_BY_DTC_NUMBER:
+     data += bytes([dtc_extended_record_num])
+  # dtc_severity_mask_type
+  if dtc_report_type == DTC_REPORT_TYPE.NUMBER_OF_DTC_BY_SEVERITY_MASK_RECORD or \
+     dtc_report_type == DTC_REPORT_TYPE.DTC_BY_SEVERITY_MASK_RECORD:
+     data += bytes([dtc_severity_mask_type, dtc_status_mask_type])
+  return UdsRequest(SERVICE_TYPE.READ_DTC_INFORMATION, subfunction=dtc_report_type, data=data)
+
+
+def _max_num_bytes_response(resp: bytes) -> int:
+  max_num_bytes_len = resp[0] >> 4 if len(resp) > 0 else 0
+  if max_num_bytes_len >= 1 and max_num_bytes_len <= 4:
+    max_num_bytes = struct.unpack('!I', (b"\x00" * (4 - max_num_bytes_len)) + resp[1:max_num_bytes_len + 1])[0]
+  else:
+    raise ValueError(f'invalid max_num_bytes_len: {max_num_bytes_len}')
+
+  return max_num_bytes  # max number of bytes per transfer data request
+
+
+def _transfer_data_response(block_sequence_count: int, resp: bytes) -> bytes:
+  resp_id = resp[0] if len(resp) > 0 else None
+  if resp_id != block_sequence_count:
+    raise ValueError(f'invalid block_sequence_count: {resp_id}')
+  return resp[1:]
+
+
+class UdsClientBase:
+  tx_dl: int
+  _negotiate: bool
+
+  def _init_tx_dl(self, tx_dl: int | None) -> None:
+    # without a fixed tx_dl, start with classic CAN frames and use CAN-FD frames once the ECU does
+    self.tx_dl = tx_dl if tx_dl is not None else 8
+    self._negotiate = tx_dl is None
+
+  def _negotiate_tx_dl(self, isotp_msg: IsoTpMessage) -> None:
+    if self._negotiate and isotp_msg.rx_dl > self.tx_dl:
+      carlog.debug(f"ISO-TP: using CAN-FD frames of {isotp_msg.rx_dl} bytes")
+      self.tx_dl = isotp_msg.rx_dl
+
+
+class UdsClient(UdsClientBase):
   def __init__(self, panda, tx_addr: int, rx_addr: int | None = None, bus: int = 0, sub_addr: int | None = None, rx_sub_addr: int | None = None,
-               timeout: float = 1, tx_timeout: float = 1, response_pending_timeout: float = 10):
+               timeout: float = 1, tx_timeout: float = 1, response_pending_timeout: float = 10, tx_dl: int | None = None):
     self.bus = bus
     self.tx_addr = tx_addr
     self.rx_addr = rx_addr if rx_addr is not None else get_rx_addr_for_tx_addr(tx_addr)
@@ -619,17 +884,14 @@ class UdsClient:
     can_send_with_timeout = partial(panda.can_send, timeout=int(tx_timeout*1000))
     self._can_client = CanClient(can_send_with_timeout, panda.can_recv, self.tx_addr, self.rx_addr, self.bus, self.sub_addr, rx_sub_addr)
     self.response_pending_timeout = response_pending_timeout
+    self._init_tx_dl(tx_dl)
 
   # generic uds request
   def _uds_request(self, service_type: SERVICE_TYPE, subfunction: int | None = None, data: bytes | None = None) -> bytes:
-    req = bytes([service_type])
-    if subfunction is not None:
-      req += bytes([subfunction])
-    if data is not None:
-      req += data
+    req = _build_request(service_type, subfunction, data)
 
     # send request, wait for response
-    isotp_msg = IsoTpMessage(self._can_client, timeout=self.timeout)
+    isotp_msg = IsoTpMessage(self._can_client, timeout=self.timeout, tx_dl=self.tx_dl)
     isotp_msg.send(req)
     response_pending = False
     while True:
@@ -639,41 +901,12 @@ class UdsClient:
       if resp is None:
         continue
 
-      response_pending = False
-      resp_sid = resp[0] if len(resp) > 0 else None
-
-      # negative response
-      if resp_sid == 0x7F:
-        service_id = resp[1] if len(resp) > 1 else -1
-        try:
-          service_desc = SERVICE_TYPE(service_id).name
-        except BaseException:
-          service_desc = 'NON_STANDARD_SERVICE'
-        error_code = resp[2] if len(resp) > 2 else -1
-        try:
-          error_desc = _negative_response_codes[error_code]
-        except BaseException:
-          error_desc = resp[3:].hex()
-        # wait for another message if response pending
-        if error_code == 0x78:
-          response_pending = True
-          carlog.debug("UDS-RX: response pending")
-          continue
-        raise NegativeResponseError(f'{service_desc} - {error_desc}', service_id, error_code)
-
-      # positive response
-      if service_type + 0x40 != resp_sid:
-        resp_sid_hex = hex(resp_sid) if resp_sid is not None else None
-        raise InvalidServiceIdError(f'invalid response service id: {resp_sid_hex}')
-
-      if subfunction is not None:
-        resp_sfn = resp[1] if len(resp) > 1 else None
-        if subfunction != resp_sfn:
-          resp_sfn_hex = hex(resp_sfn) if resp_sfn is not None else None
-          raise InvalidSubFunctionError(f'invalid response subfunction: {resp_sfn_hex}')
-
-      # return data (exclude service id and sub-function id)
-      return resp[(1 if subfunction is None else 2):]
+      self._negotiate_tx_dl(isotp_msg)
+
+      response_pending = _parse_response(service_type, subfunction, resp)
+      if not response_pending:
+        # return data (exclude service id and sub-function id)
+        return resp[(1 if subfunction is None else 2):]
 
   # services
   def diagnostic_session_control(self, session_type: SESSION_TYPE):
@@ -687,16 +920,8 @@ class UdsClient:
       return power_down_time
 
   def security_access(self, access_type: ACCESS_TYPE, security_key: bytes = b'', data_record: bytes = b''):
-    request_seed = access_type % 2 != 0
-    if request_seed and len(security_key) != 0:
-      raise ValueError('security_key not allowed')
-    if not request_seed and len(security_key) == 0:
-      raise ValueError('security_key is missing')
-    if not request_seed and len(data_record) != 0:
-      raise ValueError('data_record not allowed')
-    data = security_key + data_record
-    resp = self._uds_request(SERVICE_TYPE.SECURITY_ACCESS, subfunction=access_type, data=data)
-    if request_seed:
+    resp = self._uds_request(*_security_access_request(access_type, security_key, data_record))
+    if access_type % 2 != 0:
       security_seed = resp
       return security_seed
 
@@ -708,15 +933,8 @@ class UdsClient:
     self._uds_request(SERVICE_TYPE.TESTER_PRESENT, subfunction=0x00)
 
   def access_timing_parameter(self, timing_parameter_type: TIMING_PARAMETER_TYPE, parameter_values: bytes | None = None):
-    write_custom_values = timing_parameter_type == TIMING_PARAMETER_TYPE.SET_TO_GIVEN_VALUES
-    read_values = (timing_parameter_type == TIMING_PARAMETER_TYPE.READ_CURRENTLY_ACTIVE or
-                   timing_parameter_type == TIMING_PARAMETER_TYPE.READ_EXTENDED_SET)
-    if not write_custom_values and parameter_values is not None:
-      raise ValueError('parameter_values not allowed')
-    if write_custom_values and parameter_values is None:
-      raise ValueError('parameter_values is missing')
-    resp = self._uds_request(SERVICE_TYPE.ACCESS_TIMING_PARAMETER, subfunction=timing_parameter_type, data=parameter_values)
-    if read_values:
+    resp = self._uds_request(*_access_timing_parameter_request(timing_parameter_type, parameter_values))
+    if timing_parameter_type in (TIMING_PARAMETER_TYPE.READ_CURRENTLY_ACTIVE, TIMING_PARAMETER_TYPE.READ_EXTENDED_SET):
       # TODO: parse response into values?
       parameter_values = resp
       return parameter_values
@@ -732,70 +950,27 @@ class UdsClient:
 
   def response_on_event(self, response_event_type: RESPONSE_EVENT_TYPE, store_event: bool, window_time: int,
                         event_type_record: int, service_response_record: int):
-    if store_event:
-      response_event_type |= 0x20  # type: ignore
-    # TODO: split record parameters into arrays
-    data = bytes([window_time, event_type_record, service_response_record])
-    resp = self._uds_request(SERVICE_TYPE.RESPONSE_ON_EVENT, subfunction=response_event_type, data=data)
-
-    if response_event_type == RESPONSE_EVENT_TYPE.REPORT_ACTIVATED_EVENTS:
-      return {
-        "num_of_activated_events": resp[0],
-        "data": resp[1:],  # TODO: parse the reset of response
-      }
-
-    return {
-      "num_of_identified_events": resp[0],
-      "event_window_time": resp[1],
-      "data": resp[2:],  # TODO: parse the reset of response
-    }
+    resp = self._uds_request(*_response_on_event_request(response_event_type, store_event, window_time, event_type_record, service_response_record))
+    return _response_on_event_response(response_event_type, resp)
 
   def link_control(self, link_control_type: LINK_CONTROL_TYPE, baud_rate_type: BAUD_RATE_TYPE | None = None):
-    data: bytes | None
-
-    if link_control_type == LINK_CONTROL_TYPE.VERIFY_BAUDRATE_TRANSITION_WITH_FIXED_BAUDRATE:
-      # baud_rate_type = BAUD_RATE_TYPE
-      data = bytes([cast(int, baud_rate_type)])
-    elif link_control_type == LINK_CONTROL_TYPE.VERIFY_BAUDRATE_TRANSITION_WITH_SPECIFIC_BAUDRATE:
-      # baud_rate_type = custom value (3 bytes big-endian)
-      data = struct.pack('!I', baud_rate_type)[1:]
-    else:
-      data = None
-    self._uds_request(SERVICE_TYPE.LINK_CONTROL, subfunction=link_control_type, data=data)
+    self._uds_request(*_link_control_request(link_control_type, baud_rate_type))
 
   def read_data_by_identifier(self, data_identifier_type: DATA_IDENTIFIER_TYPE):
     # TODO: support list of identifiers
     data = struct.pack('!H', data_identifier_type)
     resp = self._uds_request(SERVICE_TYPE.READ_DATA_BY_IDENTIFIER, subfunction=None, data=data)
-    resp_id = struct.unpack('!H', resp[0:2])[0] if len(resp) >= 2 else None
-    if resp_id != data_identifier_type:
-      raise ValueError(f'invalid response data identifier: {hex(resp_id)} expected: {hex(data_identifier_type)}')
-    return resp[2:]
+    return _identifier_response(resp, data_identifier_type)
 
   def read_memory_by_address(self, memory_address: int, memory_size: int, memory_address_bytes: int = 4, memory_size_bytes: int = 1):
-    if memory_address_bytes < 1 or memory_address_bytes > 4:
-      raise ValueError(f'invalid memory_address_bytes: {memory_address_bytes}')
-    if memory_size_bytes < 1 or memory_size_bytes > 4:
-      raise ValueError(f'invalid memory_size_bytes: {memory_size_bytes}')
-    data = bytes([memory_size_bytes << 4 | memory_address_bytes])
-
-    if memory_address >= 1 << (memory_address_bytes * 8):
-      raise ValueError(f'invalid memory_address: {memory_address}')
-    data += struct.pack('!I', memory_address)[4 - memory_address_bytes:]
-    if memory_size >= 1 << (memory_size_bytes * 8):
-      raise ValueError(f'invalid memory_size: {memory_size}')
-    data += struct.pack('!I', memory_size)[4 - memory_size_bytes:]
-
+    data = _memory_record(memory_address, memory_size, memory_address_bytes, memory_size_bytes)
     resp = self._uds_request(SERVICE_TYPE.READ_MEMORY_BY_ADDRESS, subfunction=None, data=data)
     return resp
 
   def read_scaling_data_by_identifier(self, data_identifier_type: DATA_IDENTIFIER_TYPE):
     data = struct.pack('!H', data_identifier_type)
     resp = self._uds_request(SERVICE_TYPE.READ_SCALING_DATA_BY_IDENTIFIER, subfunction=None, data=data)
-    resp_id = struct.unpack('!H', resp[0:2])[0] if len(resp) >= 2 else None
-    if resp_id != data_identifier_type:
-      raise ValueError(f'invalid response data identifier: {hex(resp_id)}')
-    return resp[2:]  # TODO: parse the response
+    return _identifier_response(resp, data_identifier_type)  # TODO: parse the response
 
   def read_data_by_periodic_identifier(self, transmission_mode_type: TRANSMISSION_MODE_TYPE, periodic_data_identifier: int):
     # TODO: support list of identifiers
@@ -804,52 +979,16 @@ class UdsClient:
 
   def dynamically_define_data_identifier(self, dynamic_definition_type: DYNAMIC_DEFINITION_TYPE, dynamic_data_identifier: int,
                                          source_definitions: list[DynamicSourceDefinition], memory_address_bytes: int = 4, memory_size_bytes: int = 1):
-    if memory_address_bytes < 1 or memory_address_bytes > 4:
-      raise ValueError(f'invalid memory_address_bytes: {memory_address_bytes}')
-    if memory_size_bytes < 1 or memory_size_bytes > 4:
-      raise ValueError(f'invalid memory_size_bytes: {memory_size_bytes}')
-
-    data = struct.pack('!H', dynamic_data_identifier)
-    if dynamic_definition_type == DYNAMIC_DEFINITION_TYPE.DEFINE_BY_IDENTIFIER:
-      for s in source_definitions:
-        data += struct.pack('!H', s.data_identifier) + bytes([s.position, s.memory_size])
-    elif dynamic_definition_type == DYNAMIC_DEFINITION_TYPE.DEFINE_BY_MEMORY_ADDRESS:
-      data += bytes([memory_size_bytes << 4 | memory_address_bytes])
-      for s in source_definitions:
-        if s.memory_address >= 1 << (memory_address_bytes * 8):
-          raise ValueError(f'invalid memory_address: {s.memory_address}')
-        data += struct.pack('!I', s.memory_address)[4 - memory_address_bytes:]
-        if s.memory_size >= 1 << (memory_size_bytes * 8):
-          raise ValueError(f'invalid memory_size: {s.memory_size}')
-        data += struct.pack('!I', s.memory_size)[4 - memory_size_bytes:]
-    elif dynamic_definition_type == DYNAMIC_DEFINITION_TYPE.CLEAR_DYNAMICALLY_DEFINED_DATA_IDENTIFIER:
-      pass
-    else:
-      raise ValueError(f'invalid dynamic identifier type: {hex(dynamic_definition_type)}')
-    self._uds_request(SERVICE_TYPE.DYNAMICALLY_DEFINE_DATA_IDENTIFIER, subfunction=dynamic_definition_type, data=data)
+    self._uds_request(*_dynamically_define_data_identifier_request(dynamic_definition_type, dynamic_data_identifier, source_definitions,
+                                                                   memory_address_bytes, memory_size_bytes))
 
   def write_data_by_identifier(self, data_identifier_type: DATA_IDENTIFIER_TYPE, data_record: bytes):
     data = struct.pack('!H', data_identifier_type) + data_record
     resp = self._uds_request(SERVICE_TYPE.WRITE_DATA_BY_IDENTIFIER, subfunction=None, data=data)
-    resp_id = struct.unpack('!H', resp[0:2])[0] if len(resp) >= 2 else None
-    if resp_id != data_identifier_type:
-      raise ValueError(f'invalid response data identifier: {hex(resp_id)}')
+    _identifier_response(resp, data_identifier_type)
 
   def write_memory_by_address(self, memory_address: int, memory_size: int, data_record: bytes, memory_address_bytes: int = 4, memory_size_bytes: int = 1):
-    if memory_address_bytes < 1 or memory_address_bytes > 4:
-      raise ValueError(f'invalid memory_address_bytes: {memory_address_bytes}')
-    if memory_size_bytes < 1 or memory_size_bytes > 4:
-      raise ValueError(f'invalid memory_size_bytes: {memory_size_bytes}')
-    data = bytes([memory_size_bytes << 4 | memory_address_bytes])
-
-    if memory_address >= 1 << (memory_address_bytes * 8):
-      raise ValueError(f'invalid memory_address: {memory_address}')
-    data += struct.pack('!I', memory_address)[4 - memory_address_bytes:]
-    if memory_size >= 1 << (memory_size_bytes * 8):
-      raise ValueError(f'invalid memory_size: {memory_size}')
-    data += struct.pack('!I', memory_size)[4 - memory_size_bytes:]
-
-    data += data_record
+    data = _memory_record(memory_address, memory_size, memory_address_bytes, memory_size_bytes) + data_record
     self._uds_request(SERVICE_TYPE.WRITE_MEMORY_BY_ADDRESS, subfunction=None, data=data)
 
   def clear_diagnostic_information(self, dtc_group_type: DTC_GROUP_TYPE):
@@ -859,37 +998,8 @@ class UdsClient:
   def read_dtc_information(self, dtc_report_type: DTC_REPORT_TYPE, dtc_status_mask_type: DTC_STATUS_MASK_TYPE = DTC_STATUS_MASK_TYPE.ALL,
                            dtc_severity_mask_type: DTC_SEVERITY_MASK_TYPE = DTC_SEVERITY_MASK_TYPE.ALL, dtc_mask_record: int = 0xFFFFFF,
                            dtc_snapshot_record_num: int = 0xFF, dtc_extended_record_num: int = 0xFF):
-    data = b''
-    # dtc_status_mask_type
-    if dtc_report_type == DTC_REPORT_TYPE.NUMBER_OF_DTC_BY_STATUS_MASK or \
-       dtc_report_type == DTC_REPORT_TYPE.DTC_BY_STATUS_MASK or \
-       dtc_report_type == DTC_REPORT_TYPE.MIRROR_MEMORY_DTC_BY_STATUS_MASK or \
-       dtc_report_type == DTC_REPORT_TYPE.NUMBER_OF_MIRROR_MEMORY_DTC_BY_STATUS_MASK or \
-       dtc_report_type == DTC_REPORT_TYPE.NUMBER_OF_EMISSIONS_RELATED_OBD_DTC_BY_STATUS_MASK or \
-       dtc_report_type == DTC_REPORT_TYPE.EMISSIONS_RELATED_OBD_DTC_BY_STATUS_MASK:
-       data += bytes([dtc_status_mask_type])
-    # dtc_mask_record
-    if dtc_report_type == DTC_REPORT_TYPE.DTC_SNAPSHOT_IDENTIFICATION or \
-       dtc_report_type == DTC_REPORT_TYPE.DTC_SNAPSHOT_RECORD_BY_DTC_NUMBER or \
-       dtc_report_type == DTC_REPORT_TYPE.DTC_EXTENDED_DATA_RECORD_BY_DTC_NUMBER or \
-       dtc_report_type == DTC_REPORT_TYPE.MIRROR_MEMORY_DTC_EXTENDED_DATA_RECORD_BY_DTC_NUMBER or \
-       dtc_report_type == DTC_REPORT_TYPE.SEVERITY_INFORMATION_OF_DTC:
-       data += struct.pack('!I', dtc_mask_record)[1:]  # 3 bytes
-    # dtc_snapshot_record_num
-    if dtc_report_type == DTC_REPORT_TYPE.DTC_SNAPSHOT_IDENTIFICATION or \
-       dtc_report_type == DTC_REPORT_TYPE.DTC_SNAPSHOT_RECORD_BY_DTC_NUMBER or \
-       dtc_report_type == DTC_REPORT_TYPE.DTC_SNAPSHOT_RECORD_BY_RECORD_NUMBER:
-       data += bytes([dtc_snapshot_record_num])
-    # dtc_extended_record_num
-    if dtc_report_type == DTC_REPORT_TYPE.DTC_EXTENDED_DATA_RECORD_BY_DTC_NUMBER or \
-       dtc_report_type == DTC_REPORT_TYPE.MIRROR_MEMORY_DTC_EXTENDED_DATA_RECORD_BY_DTC_NUMBER:
-       data += bytes([dtc_extended_record_num])
-    # dtc_severity_mask_type
-    if dtc_report_type == DTC_REPORT_TYPE.NUMBER_OF_DTC_BY_SEVERITY_MASK_RECORD or \
-       dtc_report_type == DTC_REPORT_TYPE.DTC_BY_SEVERITY_MASK_RECORD:
-       data += bytes([dtc_severity_mask_type, dtc_status_mask_type])
-
-    resp = self._uds_request(SERVICE_TYPE.READ_DTC_INFORMATION, subfunction=dtc_report_type, data=data)
+    resp = self._uds_request(*_read_dtc_information_request(dtc_report_type, dtc_status_mask_type, dtc_severity_mask_type, dtc_mask_record,
+                                                            dtc_snapshot_record_num, dtc_extended_record_num))
 
     # TODO: parse response
     return resp
@@ -898,76 +1008,27 @@ class UdsClient:
                                          control_option_record: bytes = b'', control_enable_mask_record: bytes = b''):
     data = struct.pack('!H', data_identifier_type) + bytes([control_parameter_type]) + control_option_record + control_enable_mask_record
     resp = self._uds_request(SERVICE_TYPE.INPUT_OUTPUT_CONTROL_BY_IDENTIFIER, subfunction=None, data=data)
-    resp_id = struct.unpack('!H', resp[0:2])[0] if len(resp) >= 2 else None
-    if resp_id != data_identifier_type:
-      raise ValueError(f'invalid response data identifier: {hex(resp_id)}')
-    return resp[2:]
+    return _identifier_response(resp, data_identifier_type)
 
   def routine_control(self, routine_control_type: ROUTINE_CONTROL_TYPE, routine_identifier_type: ROUTINE_IDENTIFIER_TYPE, routine_option_record: bytes = b''):
     data = struct.pack('!H', routine_identifier_type) + routine_option_record
     resp = self._uds_request(SERVICE_TYPE.ROUTINE_CONTROL, subfunction=routine_control_type, data=data)
-    resp_id = struct.unpack('!H', resp[0:2])[0] if len(resp) >= 2 else None
-    if resp_id != routine_identifier_type:
-      raise ValueError(f'invalid response routine identifier: {hex(resp_id)}')
-    return resp[2:]
+    return _identifier_response(resp, routine_identifier_type, 'routine identifier')
 
   def request_download(self, memory_address: int, memory_size: int, memory_address_bytes: int = 4, memory_size_bytes: int = 4, data_format: int = 0x00):
-    data = bytes([data_format])
-
-    if memory_address_bytes < 1 or memory_address_bytes > 4:
-      raise ValueError(f'invalid memory_address_bytes: {memory_address_bytes}')
-    if memory_size_bytes < 1 or memory_size_bytes > 4:
-      raise ValueError(f'invalid memory_size_bytes: {memory_size_bytes}')
-    data += bytes([memory_size_bytes << 4 | memory_address_bytes])
-
-    if memory_address >= 1 << (memory_address_bytes * 8):
-      raise ValueError(f'invalid memory_address: {memory_address}')
-    data += struct.pack('!I', memory_address)[4 - memory_address_bytes:]
-    if memory_size >= 1 << (memory_size_bytes * 8):
-      raise ValueError(f'invalid memory_size: {memory_size}')
-    data += struct.pack('!I', memory_size)[4 - memory_size_bytes:]
-
+    data = bytes([data_format]) + _memory_record(memory_address, memory_size, memory_address_bytes, memory_size_bytes)
     resp = self._uds_request(SERVICE_TYPE.REQUEST_DOWNLOAD, subfunction=None, data=data)
-    max_num_bytes_len = resp[0] >> 4 if len(resp) > 0 else 0
-    if max_num_bytes_len >= 1 and max_num_bytes_len <= 4:
-      max_num_bytes = struct.unpack('!I', (b"\x00" * (4 - max_num_bytes_len)) + resp[1:max_num_bytes_len + 1])[0]
-    else:
-      raise ValueError(f'invalid max_num_bytes_len: {max_num_bytes_len}')
-
-    return max_num_bytes  # max number of bytes per transfer data request
+    return _max_num_bytes_response(resp)
 
   def request_upload(self, memory_address: int, memory_size: int, memory_address_bytes: int = 4, memory_size_bytes: int = 4, data_format: int = 0x00):
-    data = bytes([data_format])
-
-    if memory_address_bytes < 1 or memory_address_bytes > 4:
-      raise ValueError(f'invalid memory_address_bytes: {memory_address_bytes}')
-    if memory_size_bytes < 1 or memory_size_bytes > 4:
-      raise ValueError(f'invalid memory_size_bytes: {memory_size_bytes}')
-    data += bytes([memory_size_bytes << 4 | memory_address_bytes])
-
-    if memory_address >= 1 << (memory_address_bytes * 8):
-      raise ValueError(f'invalid memory_address: {memory_address}')
-    data += struct.pack('!I', memory_address)[4 - memory_address_bytes:]
-    if memory_size >= 1 << (memory_size_bytes * 8):
-      raise ValueError(f'invalid memory_size: {memory_size}')
-    data += struct.pack('!I', memory_size)[4 - memory_size_bytes:]
-
+    data = bytes([data_format]) + _memory_record(memory_address, memory_size, memory_address_bytes, memory_size_bytes)
     resp = self._uds_request(SERVICE_TYPE.REQUEST_UPLOAD, subfunction=None, data=data)
-    max_num_bytes_len = resp[0] >> 4 if len(resp) > 0 else 0
-    if max_num_bytes_len >= 1 and max_num_bytes_len <= 4:
-      max_num_bytes = struct.unpack('!I', (b"\x00" * (4 - max_num_bytes_len)) + resp[1:max_num_bytes_len + 1])[0]
-    else:
-      raise ValueError(f'invalid max_num_bytes_len: {max_num_bytes_len}')
-
-    return max_num_bytes  # max number of bytes per transfer data request
+    return _max_num_bytes_response(resp)
 
   def transfer_data(self, block_sequence_count: int, data: bytes = b''):
     data = bytes([block_sequence_count]) + data
     resp = self._uds_request(SERVICE_TYPE.TRANSFER_DATA, subfunction=None, data=data)
-    resp_id = resp[0] if len(resp) > 0 else None
-    if resp_id != block_sequence_count:
-      raise ValueError(f'invalid block_sequence_count: {resp_id}')
-    return resp[1:]
+    return _transfer_data_response(block_sequence_count, resp)
 
   def request_transfer_exit(self):
     self._uds_request(SERVICE_TYPE.REQUEST_TRANSFER_EXIT, subfunction=None)
@@ -0,0 +1,347 @@
+"""asyncio versions of CanClient, IsoTpMessage and UdsClient, for talking to many ECUs at once from one event loop.
+
+One AsyncCanTransport polls the panda and fans frames out to the sessions waiting on (bus, rx_addr, sub_addr):
+
+  async with AsyncCanTransport(panda.can_send, panda.can_recv) as transport:
+    clients = [AsyncUdsClient(transport, addr, bus=bus) for addr, _, bus in ecu_addrs]
+    dtcs = await asyncio.gather(*(c.read_dtc_information(DTC_REPORT_TYPE.DTC_BY_STATUS_MASK) for c in clients), return_exceptions=True)
+"""
+import asyncio
+import struct
+from collections import deque
+from collections.abc import Callable, Generator
+
+from opendbc.car.carlog import carlog
+from opendbc.car.uds import ACCESS_TYPE, BAUD_RATE_TYPE, CONTROL_PARAMETER_TYPE, CONTROL_TYPE, DATA_IDENTIFIER_TYPE, DTC_GROUP_TYPE, DTC_REPORT_TYPE, \
+                            DTC_SETTING_TYPE, DTC_SEVERITY_MASK_TYPE, DTC_STATUS_MASK_TYPE, DYNAMIC_DEFINITION_TYPE, FUNCTIONAL_ADDRS, ISOTP_FRAME_TYPE, \
+                            LINK_CONTROL_TYPE, MESSAGE_TYPE, RESET_TYPE, RESPONSE_EVENT_TYPE, ROUTINE_CONTROL_TYPE, ROUTINE_IDENTIFIER_TYPE, SERVICE_TYPE, \
+                            SESSION_TYPE, TIMING_PARAMETER_TYPE, TRANSMISSION_MODE_TYPE, DynamicSourceDefinition, InvalidSubAddressError, IsoTpMessage, \
+                            MessageTimeoutError, UdsClientBase, _access_timing_parameter_request, _build_request, \
+                            _dynamically_define_data_identifier_request, _identifier_response, _link_control_request, _max_num_bytes_response, \
+                            _memory_record, _parse_response, _read_dtc_information_request, _response_on_event_request, _response_on_event_response, \
+                            _security_access_request, _transfer_data_response, get_rx_addr_for_tx_addr
+
+RxKey = tuple[int, int, int | None]  # bus, rx_addr, rx_sub_addr
+
+
+class AsyncCanTransport:
+  """Shares a panda's can_send and non-blocking can_recv between async sessions"""
+  def __init__(self, can_send: Callable[..., None], can_recv: Callable[[], list[tuple[int, bytes, int]]], poll_interval: float = 0.001):
+    self.can_send = can_send
+    self.can_recv = can_recv
+    self.poll_interval = poll_interval
+    self._sessions: dict[RxKey, AsyncCanClient] = {}
+    self._sub_addressed: set[tuple[int, int]] = set()  # (bus, rx_addr) of sessions using sub-addresses
+    self._task: asyncio.Task | None = None
+
+  async def __aenter__(self) -> "AsyncCanTransport":
+    self.start()
+    return self
+
+  async def __aexit__(self, *args) -> None:
+    await self.close()
+
+  def start(self) -> None:
+    if self._task is None:
+      self._task = asyncio.get_running_loop().create_task(self._run())
+
+  async def close(self) -> None:
+    if self._task is not None:
+      self._task.cancel()
+      try:
+        await self._task
+      except asyncio.CancelledError:
+        pass
+      self._task = None
+
+  def register(self, session: "AsyncCanClient") -> None:
+    key = (session.bus, session.rx_addr, session.rx_sub_addr)
+    assert key not in self._sessions, f"Another session is receiving on {key}"
+    self._sessions[key] = session
+    if session.rx_sub_addr is not None:
+      self._sub_addressed.add((session.bus, session.rx_addr))
+
+  def unregister(self, session: "AsyncCanClient") -> None:
+    self._sessions.pop((session.bus, session.rx_addr, session.rx_sub_addr), None)
+
+  def _route(self, msgs: list[tuple[int, bytes, int]]) -> None:
+    sessions = self._sessions
+    for addr, dat, bus in msgs:
+      if not len(dat):
+        continue
+      session = sessions.get((bus, addr, None))
+      if session is None and (bus, addr) in self._sub_addressed:
+        session = sessions.get((bus, addr, dat[0]))
+      if session is not None:
+        session.put(bytes(dat))
+
+  async def _run(self) -> None:
+    while True:
+      try:
+        msgs = self.can_recv()
+      except Exception:
+        carlog.exception("CAN-RX: transport exception")
+        msgs = []
+      self._route(msgs)
+      # a full buffer means more frames are waiting
+      await asyncio.sleep(0 if len(msgs) >= 254 else self.poll_interval)
+
+
+class AsyncCanClient:
+  """CanClient for one session on an AsyncCanTransport. Physical addressing only.
+
+     Frames to send are queued by the synchronous ISO-TP state machine and sent with flush(), which awaits
+     separation times instead of sleeping."""
+  def __init__(self, transport: AsyncCanTransport, tx_addr: int, rx_addr: int, bus: int, sub_addr: int | None = None,
+               rx_sub_addr: int | None = None):
+    assert tx_addr not in FUNCTIONAL_ADDRS, f"Functional addresses are not supported: {hex(tx_addr)}"
+    self.transport = transport
+    self.tx_addr = tx_addr
+    self.rx_addr = rx_addr
+    self.bus = bus
+    self.sub_addr = sub_addr
+    self.rx_sub_addr = rx_sub_addr if rx_sub_addr is not None else sub_addr
+    self.rx_buff: deque[bytes] = deque()
+    self._rx_event = asyncio.Event()
+    self._tx_buff: list[tuple[bytes, float]] = []
+    transport.register(self)
+
+  def close(self) -> None:
+    self.transport.unregister(self)
+
+  def put(self, dat: bytes) -> None:
+    carlog.debug(f"CAN-RX: {hex(self.rx_addr)} - 0x{bytes.hex(dat)}")
+    self.rx_buff.append(dat)
+    self._rx_event.set()
+
+  def drain(self) -> None:
+    carlog.debug(f"CAN-RX: drain - {len(self.rx_buff)}")
+    self.rx_buff.clear()
+
+  def recv(self, drain: bool = False) -> Generator[bytes, None, None]:
+    if drain:
+      self.drain()
+    while len(self.rx_buff):
+      dat = self.rx_buff.popleft()
+      # Cut off sub addr in first byte
+      if self.rx_sub_addr is not None:
+        if dat[0] != self.rx_sub_addr:
+          raise InvalidSubAddressError(f"isotp - rx: invalid sub-address: {dat[0]}, expected: {self.rx_sub_addr}")
+        dat = dat[1:]
+      yield dat
+
+  async def wait(self, timeout: float) -> bool:
+    """Waits for a frame, returns False on timeout"""
+    if len(self.rx_buff):
+      return True
+    self._rx_event.clear()
+    try:
+      await asyncio.wait_for(self._rx_event.wait(), timeout)
+    except TimeoutError:
+      return False
+    return True
+
+  def send(self, msgs: list[bytes], delay: float = 0) -> None:
+    for i, msg in enumerate(msgs):
+      self._tx_buff.append((msg, delay if i != 0 else 0))
+
+  async def flush(self) -> None:
+    tx_buff, self._tx_buff = self._tx_buff, []
+    for msg, delay in tx_buff:
+      if delay:
+        carlog.debug(f"CAN-TX: delay - {delay}")
+        await asyncio.sleep(delay)
+
+      if self.sub_addr is not None:
+        msg = bytes([self.sub_addr]) + msg
+
+      carlog.debug(f"CAN-TX: {hex(self.tx_addr)} - 0x{bytes.hex(msg)}")
+      assert len(msg) <= 64
+      self.transport.can_send(self.tx_addr, msg, self.bus)
+
+
+class AsyncIsoTpMessage(IsoTpMessage):
+  _can_client: AsyncCanClient
+
+  async def send(self, dat: bytes, setup_only: bool = False) -> None:  # type: ignore[override]
+    # throw away any stale data
+    self._can_client.drain()
+    super().send(dat, setup_only)
+    await self._can_client.flush()
+
+  async def recv(self, timeout=None) -> tuple[bytes | None, bool]:  # type: ignore[override]
+    if timeout is None:
+      timeout = self.timeout
+
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    rx_in_progress = False
+    try:
+      while True:
+        for msg in self._can_client.recv():
+          frame_type = self._isotp_rx_next(msg)
+          await self._can_client.flush()
+          start_time = loop.time()
+          # Anything that signifies we're building a response
+          rx_in_progress = frame_type in (ISOTP_FRAME_TYPE.FIRST, ISOTP_FRAME_TYPE.CONSECUTIVE)
+          if self.tx_done and self.rx_done:
+            return self.rx_dat, False
+        # no timeout indicates non-blocking
+        if timeout == 0:
+          return None, rx_in_progress
+        if not await self._can_client.wait(start_time + timeout - loop.time()):
+          raise MessageTimeoutError("timeout waiting for response")
+    finally:
+      if self.rx_dat:
+        carlog.debug(f"ISO-TP: RESPONSE - {hex(self._can_client.rx_addr)} 0x{bytes.hex(self.rx_dat)}")
+
+
+class AsyncUdsClient(UdsClientBase):
+  """UdsClient whose service methods are coroutines. Requests to one ECU are serialized, use a client per ECU to query them concurrently"""
+  def __init__(self, transport: AsyncCanTransport, tx_addr: int, rx_addr: int | None = None, bus: int = 0, sub_addr: int | None = None,
+               rx_sub_addr: int | None = None, timeout: float = 1, response_pending_timeout: float = 10, tx_dl: int | None = None):
+    self.bus = bus
+    self.tx_addr = tx_addr
+    self.rx_addr = rx_addr if rx_addr is not None else get_rx_addr_for_tx_addr(tx_addr)
+    self.sub_addr = sub_addr
+    self.timeout = timeout
+    self._can_client = AsyncCanClient(transport, self.tx_addr, self.rx_addr, self.bus, self.sub_addr, rx_sub_addr)
+    self.response_pending_timeout = response_pending_timeout
+    self._init_tx_dl(tx_dl)
+    self._lock = asyncio.Lock()
+
+  def close(self) -> None:
+    self._can_client.close()
+
+  # generic uds request
+  async def _uds_request(self, service_type: SERVICE_TYPE, subfunction: int | None = None, data: bytes | None = None) -> bytes:
+    req = _build_request(service_type, subfunction, data)
+
+    async with self._lock:
+      # send request, wait for response
+      isotp_msg = AsyncIsoTpMessage(self._can_client, timeout=self.timeout, tx_dl=self.tx_dl)
+      await isotp_msg.send(req)
+      response_pending = False
+      while True:
+        timeout = self.response_pending_timeout if response_pending else self.timeout
+        resp, _ = await isotp_msg.recv(timeout)
+
+        if resp is None:
+          continue
+
+        self._negotiate_tx_dl(isotp_msg)
+        response_pending = _parse_response(service_type, subfunction, resp)
+        if not response_pending:
+          # return data (exclude service id and sub-function id)
+          return resp[(1 if subfunction is None else 2):]
+
+  # services
+  async def diagnostic_session_control(self, session_type: SESSION_TYPE):
+    await self._uds_request(SERVICE_TYPE.DIAGNOSTIC_SESSION_CONTROL, subfunction=session_type)
+
+  async def ecu_reset(self, reset_type: RESET_TYPE):
+    resp = await self._uds_request(SERVICE_TYPE.ECU_RESET, subfunction=reset_type)
+    if reset_type == RESET_TYPE.ENABLE_RAPID_POWER_SHUTDOWN:
+      return resp[0]
+
+  async def security_access(self, access_type: ACCESS_TYPE, security_key: bytes = b'', data_record: bytes = b''):
+    resp = await self._uds_request(*_security_access_request(access_type, security_key, data_record))
+    if access_type % 2 != 0:
+      return resp
+
+  async def communication_control(self, control_type: CONTROL_TYPE, message_type: MESSAGE_TYPE):
+    await self._uds_request(SERVICE_TYPE.COMMUNICATION_CONTROL, subfunction=control_type, data=bytes([message_type]))
+
+  async def tester_present(self):
+    await self._uds_request(SERVICE_TYPE.TESTER_PRESENT, subfunction=0x00)
+
+  async def access_timing_parameter(self, timing_parameter_type: TIMING_PARAMETER_TYPE, parameter_values: bytes | None = None):
+    resp = await self._uds_request(*_access_timing_parameter_request(timing_parameter_type, parameter_values))
+    if timing_parameter_type in (TIMING_PARAMETER_TYPE.READ_CURRENTLY_ACTIVE, TIMING_PARAMETER_TYPE.READ_EXTENDED_SET):
+      return resp
+
+  async def secured_data_transmission(self, data: bytes):
+    return await self._uds_request(SERVICE_TYPE.SECURED_DATA_TRANSMISSION, subfunction=None, data=data)
+
+  async def control_dtc_setting(self, dtc_setting_type: DTC_SETTING_TYPE):
+    await self._uds_request(SERVICE_TYPE.CONTROL_DTC_SETTING, subfunction=dtc_setting_type)
+
+  async def response_on_event(self, response_event_type: RESPONSE_EVENT_TYPE, store_event: bool, window_time: int,
+                              event_type_record: int, service_response_record: int):
+    resp = await self._uds_request(*_response_on_event_request(response_event_type, store_event, window_time, event_type_record,
+                                                               service_response_record))
+    return _response_on_event_response(response_event_type, resp)
+
+  async def link_control(self, link_control_type: LINK_CONTROL_TYPE, baud_rate_type: BAUD_RATE_TYPE | None = None):
+    await self._uds_request(*_link_control_request(link_control_type, baud_rate_type))
+
+  async def read_data_by_identifier(self, data_identifier_type: DATA_IDENTIFIER_TYPE):
+    resp = await self._uds_request(SERVICE_TYPE.READ_DATA_BY_IDENTIFIER, subfunction=None, data=struct.pack('!H', data_identifier_type))
+    return _identifier_response(resp, data_identifier_type)
+
+  async def read_memory_by_address(self, memory_address: int, memory_size: int, memory_address_bytes: int = 4, memory_size_bytes: int = 1):
+    data = _memory_record(memory_address, memory_size, memory_address_bytes, memory_size_bytes)
+    return await self._uds_request(SERVICE_TYPE.READ_MEMORY_BY_ADDRESS, subfunction=None, data=data)
+
+  async def read_scaling_data_by_identifier(self, data_identifier_type: DATA_IDENTIFIER_TYPE):
+    resp = await self._uds_request(SERVICE_TYPE.READ_SCALING_DATA_BY_IDENTIFIER, subfunction=None, data=struct.pack('!H', data_identifier_type))
+    return _identifier_response(resp, data_identifier_type)
+
+  async def read_data_by_periodic_identifier(self, transmission_mode_type: TRANSMISSION_MODE_TYPE, periodic_data_identifier: int):
+    data = bytes([transmission_mode_type, periodic_data_identifier])
+    await self._uds_request(SERVICE_TYPE.READ_DATA_BY_PERIODIC_IDENTIFIER, subfunction=None, data=data)
+
+  async def dynamically_define_data_identifier(self, dynamic_definition_type: DYNAMIC_DEFINITION_TYPE, dynamic_data_identifier: int,
+                                               source_definitions: list[DynamicSourceDefinition], memory_address_bytes: int = 4,
+                                               memory_size_bytes: int = 1):
+    await self._uds_request(*_dynamically_define_data_identifier_request(dynamic_definition_type, dynamic_data_identifier, source_definitions,
+                                                                         memory_address_bytes, memory_size_bytes))
+
+  async def write_data_by_identifier(self, data_identifier_type: DATA_IDENTIFIER_TYPE, data_record: bytes):
+    data = struct.pack('!H', data_identifier_type) + data_record
+    resp = await self._uds_request(SERVICE_TYPE.WRITE_DATA_BY_IDENTIFIER, subfunction=None, data=data)
+    _identifier_response(resp, data_identifier_type)
+
+  async def write_memory_by_address(self, memory_address: int, memory_size: int, data_record: bytes, memory_address_bytes: int = 4,
+                                    memory_size_bytes: int = 1):
+    data = _memory_record(memory_address, memory_size, memory_address_bytes, memory_size_bytes) + data_record
+    await self._uds_request(SERVICE_TYPE.WRITE_MEMORY_BY_ADDRESS, subfunction=None, data=data)
+
+  async def clear_diagnostic_information(self, dtc_group_type: DTC_GROUP_TYPE):
+    data = struct.pack('!I', dtc_group_type)[1:]  # 3 bytes
+    await self._uds_request(SERVICE_TYPE.CLEAR_DIAGNOSTIC_INFORMATION, subfunction=None, data=data)
+
+  async def read_dtc_information(self, dtc_report_type: DTC_REPORT_TYPE, dtc_status_mask_type: DTC_STATUS_MASK_TYPE = DTC_STATUS_MASK_TYPE.ALL,
+                                 dtc_severity_mask_type: DTC_SEVERITY_MASK_TYPE = DTC_SEVERITY_MASK_TYPE.ALL, dtc_mask_record: int = 0xFFFFFF,
+                                 dtc_snapshot_record_num: int = 0xFF, dtc_extended_record_num: int = 0xFF):
+    return await self._uds_request(*_read_dtc_information_request(dtc_report_type, dtc_status_mask_type, dtc_severity_mask_type, dtc_mask_record,
+                                                                  dtc_snapshot_record_num, dtc_extended_record_num))
+
+  async def input_output_control_by_identifier(self, data_identifier_type: DATA_IDENTIFIER_TYPE, control_parameter_type: CONTROL_PARAMETER_TYPE,
+                                               control_option_record: bytes = b'', control_enable_mask_record: bytes = b''):
+    data = struct.pack('!H', data_identifier_type) + bytes([control_parameter_type]) + control_option_record + control_enable_mask_record
+    resp = await self._uds_request(SERVICE_TYPE.INPUT_OUTPUT_CONTROL_BY_IDENTIFIER, subfunction=None, data=data)
+    return _identifier_response(resp, data_identifier_type)
+
+  async def routine_control(self, routine_control_type: ROUTINE_CONTROL_TYPE, routine_identifier_type: ROUTINE_IDENTIFIER_TYPE,
+                            routine_option_record: bytes = b''):
+    data = struct.pack('!H', routine_identifier_type) + routine_option_record
+    resp = await self._uds_request(SERVICE_TYPE.ROUTINE_CONTROL, subfunction=routine_control_type, data=data)
+    return _identifier_response(resp, routine_identifier_type, 'routine identifier')
+
+  async def request_download(self, memory_address: int, memory_size: int, memory_address_bytes: int = 4, memory_size_bytes: int = 4,
+                             data_format: int = 0x00):
+    data = bytes([data_format]) + _memory_record(memory_address, memory_size, memory_address_bytes, memory_size_bytes)
+    return _max_num_bytes_response(await self._uds_request(SERVICE_TYPE.REQUEST_DOWNLOAD, subfunction=None, data=data))
+
+  async def request_upload(self, memory_address: int, memory_size: int, memory_address_bytes: int = 4, memory_size_bytes: int = 4,
+                           data_format: int = 0x00):
+    data = bytes([data_format]) + _memory_record(memory_address, memory_size, memory_address_bytes, memory_size_bytes)
+    return _max_num_bytes_response(await self._uds_request(SERVICE_TYPE.REQUEST_UPLOAD, subfunction=None, data=data))
+
+  async def transfer_data(self, block_sequence_count: int, data: bytes = b''):
+    resp = await self._uds_request(SERVICE_TYPE.TRANSFER_DATA, subfunction=None, data=bytes([block_sequence_count]) + data)
+    return _transfer_data_response(block_sequence_count, resp)
+
+  async def request_transfer_exit(self):
+    await self._uds_request(SERVICE_TYPE.REQUEST_TRANSFER_EXIT, subfunction=None)
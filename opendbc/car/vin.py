@@ -1,9 +1,10 @@
 import re
 from dataclasses import dataclass, field
+from functools import cache
 
 from opendbc.car import uds
 from opendbc.car.carlog import carlog
-from opendbc.car.isotp_parallel_query import IsoTpParallelQuery
+from opendbc.car.isotp_parallel_query import IsoTpParallelQuery, get_data_concurrent
 from opendbc.car.fw_query_definitions import STANDARD_VIN_ADDRS, StdQueries
 
 VIN_UNKNOWN = "0" * 17
@@ -29,46 +30,104 @@ def is_valid_vin(vin: str):
   return re.fullmatch(VIN_RE, vin) is not None
 
 
+FUNCTIONAL_RESPONSE_ADDRS = [a for a in range(0x700, 0x800) if a != 0x7DF] + list(range(0x18DA00F1, 0x18DB00F1, 0x100))
+
+
+@dataclass(frozen=True)
+class VinQuery:
+  request: bytes
+  response: bytes
+  buses: tuple[int, ...]
+  addrs: tuple[int, ...]
+  functional: bool
+  rx_offset: int
+
+  def tx_addrs(self) -> list[int]:
+    # When querying functional addresses, ideally we respond to everything that sends a first frame to avoid leaving the
+    # ECU in a temporary bad state. Note that we may not cover all ECUs and response offsets. TODO: query physical addrs
+    if self.functional:
+      return FUNCTIONAL_RESPONSE_ADDRS
+    return list(self.addrs)
+
+  def rx_addrs(self) -> set[int]:
+    return {uds.get_rx_addr_for_tx_addr(addr, rx_offset=self.rx_offset) for addr in self.tx_addrs()}
+
+# in order of preference
+VIN_QUERIES = (
+  VinQuery(StdQueries.UDS_VIN_REQUEST, StdQueries.UDS_VIN_RESPONSE, (0, 1), tuple(STANDARD_VIN_ADDRS), True, 0x8),
+  VinQuery(StdQueries.OBD_VIN_REQUEST, StdQueries.OBD_VIN_RESPONSE, (0, 1), tuple(STANDARD_VIN_ADDRS), True, 0x8),
+  VinQuery(StdQueries.GM_VIN_REQUEST, StdQueries.GM_VIN_RESPONSE, (0,), (0x24b,), False, 0x400),  # Bolt fwdCamera
+  VinQuery(StdQueries.KWP_VIN_REQUEST, StdQueries.KWP_VIN_RESPONSE, (0,), (0x797,), False, 0x3),  # Nissan Leaf VCM
+  VinQuery(StdQueries.UDS_VIN_REQUEST, StdQueries.UDS_VIN_RESPONSE, (0,), (0x74f,), False, 0x6a),  # Volkswagen fwdCamera
+  VinQuery(StdQueries.UDS_VIN_REQUEST, StdQueries.UDS_VIN_RESPONSE, (0,), (0x733,), False, 0x40),  # Rivian EPAS
+)
+
+
+@cache
+def get_vin_rounds(buses: tuple[int, ...]) -> list[list[tuple[VinQuery, int]]]:
+  """Groups the queries on each bus into rounds that can run concurrently, without expecting responses on the same address"""
+  rounds: list[list[tuple[VinQuery, int]]] = []
+  round_rx_addrs: list[set[tuple[int, int]]] = []
+  for bus in buses:
+    for query in VIN_QUERIES:
+      if bus not in query.buses:
+        continue
+      rx_addrs = {(bus, addr) for addr in query.rx_addrs()}
+      i = next((i for i, used in enumerate(round_rx_addrs) if not (used & rx_addrs)), len(rounds))
+      if i == len(rounds):
+        rounds.append([])
+        round_rx_addrs.append(set())
+      rounds[i].append((query, bus))
+      round_rx_addrs[i] |= rx_addrs
+  return rounds
+
+
+def decode_vin(vin: bytes) -> str:
+  # Ford and Nissan pads with null bytes
+  if len(vin) in (19, 24):
+    vin = re.sub(b'\x00*$', b'', vin)
+
+  # Honda Bosch response starts with a length, trim to correct length
+  if vin.startswith(b'\x11'):
+    vin = vin[1:18]
+
+  return vin.decode(errors="replace")
+
+
+def _find_vin(vin_round: list[tuple[VinQuery, int]], results: list[dict], valid_only: bool) -> tuple[VinQuery, int, int, str] | None:
+  for (query, bus), query_results in zip(vin_round, results, strict=True):
+    for addr in query.addrs:
+      vin = query_results.get((addr, None))
+      if vin is not None and (not valid_only or is_valid_vin(decode_vin(vin))):
+        return query, bus, addr, decode_vin(vin)
+  return None
+
+
+def _query_vin_round(can_recv, can_send, vin_round: list[tuple[VinQuery, int]], timeout: float) -> tuple[int, int, str] | None:
+  queries = [IsoTpParallelQuery(can_send, can_recv, bus, query.tx_addrs(), [query.request, ], [query.response, ], response_offset=query.rx_offset,
+                                functional_addrs=uds.FUNCTIONAL_ADDRS if query.functional else None) for query, bus in vin_round]
+  results = get_data_concurrent(queries, timeout, stop=lambda: _find_vin(vin_round, [q.results for q in queries], valid_only=True) is not None)
+  found = _find_vin(vin_round, results, valid_only=True) or _find_vin(vin_round, results, valid_only=False)
+  if found is None:
+    return None
+
+  query, bus, addr, vin = found
+  carlog.error(f"got vin with request={query.request}, {bus=}")
+  return uds.get_rx_addr_for_tx_addr(addr, rx_offset=query.rx_offset), bus, vin
+
+
 def get_vin(can_recv, can_send, buses, timeout=0.1, retry=2):
+  """Sends the VIN queries on all buses, a round of non-conflicting queries at a time. Returns as soon as a valid VIN is
+     received, otherwise the most preferred response of the first round with any"""
+  vin_rounds = get_vin_rounds(tuple(buses))
   for i in range(retry):
-    for bus in buses:
-      for request, response, valid_buses, vin_addrs, functional_addrs, rx_offset in (
-        (StdQueries.UDS_VIN_REQUEST, StdQueries.UDS_VIN_RESPONSE, (0, 1), STANDARD_VIN_ADDRS, uds.FUNCTIONAL_ADDRS, 0x8),
-        (StdQueries.OBD_VIN_REQUEST, StdQueries.OBD_VIN_RESPONSE, (0, 1), STANDARD_VIN_ADDRS, uds.FUNCTIONAL_ADDRS, 0x8),
-        (StdQueries.GM_VIN_REQUEST, StdQueries.GM_VIN_RESPONSE, (0,), [0x24b], None, 0x400),  # Bolt fwdCamera
-        (StdQueries.KWP_VIN_REQUEST, StdQueries.KWP_VIN_RESPONSE, (0,), [0x797], None, 0x3),  # Nissan Leaf VCM
-        (StdQueries.UDS_VIN_REQUEST, StdQueries.UDS_VIN_RESPONSE, (0,), [0x74f], None, 0x6a),  # Volkswagen fwdCamera
-        (StdQueries.UDS_VIN_REQUEST, StdQueries.UDS_VIN_RESPONSE, (0,), [0x733], None, 0x40),  # Rivian EPAS
-      ):
-        if bus not in valid_buses:
-          continue
-
-        # When querying functional addresses, ideally we respond to everything that sends a first frame to avoid leaving the
-        # ECU in a temporary bad state. Note that we may not cover all ECUs and response offsets. TODO: query physical addrs
-        tx_addrs = vin_addrs
-        if functional_addrs is not None:
-          tx_addrs = [a for a in range(0x700, 0x800) if a != 0x7DF] + list(range(0x18DA00F1, 0x18DB00F1, 0x100))
-
-        try:
-          query = IsoTpParallelQuery(can_send, can_recv, bus, tx_addrs, [request, ], [response, ], response_offset=rx_offset,
-                                     functional_addrs=functional_addrs)
-          results = query.get_data(timeout)
-
-          for addr in vin_addrs:
-            vin = results.get((addr, None))
-            if vin is not None:
-              # Ford and Nissan pads with null bytes
-              if len(vin) in (19, 24):
-                vin = re.sub(b'\x00*$', b'', vin)
-
-              # Honda Bosch response starts with a length, trim to correct length
-              if vin.startswith(b'\x11'):
-                vin = vin[1:18]
-
-              carlog.error(f"got vin with {request=}, {bus=}")
-              return uds.get_rx_addr_for_tx_addr(addr, rx_offset=rx_offset), bus, vin.decode()
-        except Exception:
-          carlog.exception("VIN query exception")
+    for vin_round in vin_rounds:
+      try:
+        vin = _query_vin_round(can_recv, can_send, vin_round, timeout)
+        if vin is not None:
+          return vin
+      except Exception:
+        carlog.exception("VIN query exception")
 
     carlog.error(f"vin query retry ({i+1}) ...")
 
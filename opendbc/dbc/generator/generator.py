@@ -1,18 +1,26 @@
 #!/usr/bin/env python3
+import hashlib
 import importlib
 import os
 import re
+from functools import cache
 from pathlib import Path
 
 generator_path = os.path.dirname(os.path.realpath(__file__))
 include_pattern = re.compile(r'CM_ "IMPORT (.*?)";\n')
 
 
+@cache
+def _read_file(src_dir: str, filename: str) -> str:
+  # shared between all DBCs including the same file
+  with open(os.path.join(src_dir, filename), encoding='utf-8') as file_in:
+    return file_in.read()
+
+
 def _read_dbc(src_dir: str, filename: str, extra_files: dict[str, str] | None = None) -> str:
   if extra_files and filename in extra_files:
     return extra_files[filename]
-  with open(os.path.join(src_dir, filename), encoding='utf-8') as file_in:
-    return file_in.read()
+  return _read_file(src_dir, filename)
 
 
 def _create_dbc_content(src_dir: str, filename: str, extra_files: dict[str, str] | None = None) -> str:
@@ -31,24 +39,87 @@ def _create_dbc_content(src_dir: str, filename: str, extra_files: dict[str, str]
   return ''.join(parts)
 
 
-def _collect_script_outputs() -> dict[str, dict[str, str]]:
-  """Import and call generate() from each sub-generator script.
-  Returns {dir_name: {filename: content}}."""
-  outputs: dict[str, dict[str, str]] = {}
+def _generator_scripts(src_dir: str) -> list[Path]:
+  return [py_file for py_file in sorted(Path(src_dir).glob("*.py"))
+          if not py_file.name.startswith("test_") and py_file.name != "generator.py"]
 
-  for py_file in sorted(Path(generator_path).rglob("*.py")):
-    if py_file.name.startswith("test_") or py_file.name == "generator.py":
-      continue
 
-    dir_name = py_file.parent.name
-    module_name = f"opendbc.dbc.generator.{dir_name}.{py_file.stem}"
+@cache
+def _script_outputs(src_dir: str) -> dict[str, str]:
+  """Import and call generate() from each sub-generator script in src_dir.
+  Returns {filename: content}."""
+  outputs: dict[str, str] = {}
+  for py_file in _generator_scripts(src_dir):
+    module_name = f"opendbc.dbc.generator.{py_file.parent.name}.{py_file.stem}"
     mod = importlib.import_module(module_name)
     if hasattr(mod, 'generate'):
-      outputs.setdefault(dir_name, {}).update(mod.generate())
+      outputs.update(mod.generate())
+  return outputs
 
+
+def _collect_script_outputs() -> dict[str, dict[str, str]]:
+  """Returns {dir_name: {filename: content}} for all sub-generator scripts."""
+  outputs: dict[str, dict[str, str]] = {}
+  for py_file in sorted(Path(generator_path).rglob("*.py")):
+    src_dir = str(py_file.parent)
+    if src_dir != generator_path:
+      outputs.setdefault(py_file.parent.name, {}).update(_script_outputs(src_dir))
   return outputs
 
 
+@cache
+def _dbc_index() -> dict[str, tuple[str, str]]:
+  """Index of {output_name: (src_dir, filename)} for every generated DBC, without running any generator scripts.
+  Scripts named <name>.py generate <name>.dbc, underscored scripts only generate includes."""
+  index = {}
+  for src_dir, _, filenames in os.walk(generator_path):
+    if src_dir == generator_path:
+      continue
+    all_dbc_files = {f for f in filenames if f.endswith('.dbc') and not f.startswith('_')}
+    all_dbc_files |= {f"{py_file.stem}.dbc" for py_file in _generator_scripts(src_dir) if not py_file.name.startswith('_')}
+    for filename in all_dbc_files:
+      index[filename.replace('.dbc', '_generated')] = (src_dir, filename)
+  return index
+
+
+@cache
+def _sources_hash(src_dir: str) -> str:
+  """Hash of this generator and every template, include and script in src_dir"""
+  h = hashlib.sha256()
+  paths = [os.path.realpath(__file__)] + [os.path.join(src_dir, f) for f in sorted(os.listdir(src_dir))]
+  for path in paths:
+    if os.path.isfile(path):
+      with open(path, "rb") as f:
+        h.update(os.path.basename(path).encode() + b"\0" + f.read() + b"\0")
+  return h.hexdigest()
+
+
+def sources_hash(name: str) -> str | None:
+  """Hash of the sources of a generated DBC, without generating it. Returns None if name is not a generated DBC."""
+  entry = _dbc_index().get(name)
+  return None if entry is None else _sources_hash(entry[0])
+
+
+def _is_script_output(src_dir: str, filename: str) -> bool:
+  scripts = _generator_scripts(src_dir)
+  return len(scripts) > 0 and (filename.endswith('_generated.dbc') or any(filename == f"{p.stem}.dbc" for p in scripts))
+
+
+def generate_dbc(name: str) -> str | None:
+  """Generate a single DBC by output name, running only the generator scripts its sources need.
+  Returns None if name is not a generated DBC."""
+  entry = _dbc_index().get(name)
+  if entry is None:
+    return None
+  src_dir, filename = entry
+
+  dbc_files = [filename]
+  if not _is_script_output(src_dir, filename):
+    dbc_files += include_pattern.findall(_read_file(src_dir, filename))
+  extra = _script_outputs(src_dir) if any(_is_script_output(src_dir, f) for f in dbc_files) else None
+  return _create_dbc_content(src_dir, filename, extra)
+
+
 def generate_all() -> dict[str, str]:
   """Generate all DBC content in memory. Returns {name: content} where name has no .dbc extension."""
   script_outputs = _collect_script_outputs()
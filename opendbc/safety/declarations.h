@@ -63,6 +63,9 @@ uint32_t GET_BYTES(const CANPacket_t *msg, int start, int len);
 
 extern const int MAX_WRONG_COUNTERS;
 #define MAX_ADDR_CHECK_MSGS 3U
+// capacity of the rx check and tx msg lookup tables built by set_safety_hooks
+#define MAX_RX_CHECKS 16
+#define MAX_TX_MSGS 64
 #define MAX_SAMPLE_VALS 6
 // used to represent floating point vehicle speed in a sample_t
 #define VEHICLE_SPEED_FACTOR 1000.0
@@ -202,6 +205,15 @@ typedef struct {
   RxStatus status;
 } RxCheck;
 
+// a message of an rx check, in the lookup table sorted by address, bus and length
+typedef struct {
+  int addr;
+  unsigned int bus;
+  int len;
+  int check;                         // index in rx_checks
+  int msg;                           // index in the rx check's msg
+} RxCheckLookup;
+
 typedef struct {
   RxCheck *rx_checks;
   int rx_checks_len;
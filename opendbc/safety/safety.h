@@ -109,32 +109,126 @@ static bool is_msg_valid(RxCheck addr_list[], int index) {
   return valid;
 }
 
-static int get_addr_check_index(const CANPacket_t *msg, RxCheck addr_list[], const int len) {
-  int addr = msg->addr;
-  int length = GET_LEN(msg);
+// sorted copies of the current safety config's rx check msgs and tx msgs, built by set_safety_hooks.
+// every message is looked up in these by a binary search instead of scanning the config
+static RxCheckLookup rx_check_lookup[MAX_RX_CHECKS * MAX_ADDR_CHECK_MSGS];
+static int rx_check_lookup_len = 0;
+static CanMsg tx_msg_lookup[MAX_TX_MSGS];
+static int tx_msg_lookup_len = 0;
+
+// orders messages by address, then bus, then length
+static bool msg_less(int addr_a, unsigned int bus_a, int len_a, int addr_b, unsigned int bus_b, int len_b) {
+  bool less;
+  if (addr_a != addr_b) {
+    less = addr_a < addr_b;
+  } else if (bus_a != bus_b) {
+    less = bus_a < bus_b;
+  } else {
+    less = len_a < len_b;
+  }
+  return less;
+}
 
-  int index = -1;
-  for (int i = 0; i < len; i++) {
-    // if multiple msgs are allowed, determine which one is present on the bus
-    if (!addr_list[i].status.msg_seen) {
-      for (uint8_t j = 0U; (j < MAX_ADDR_CHECK_MSGS) && (addr_list[i].msg[j].addr != 0); j++) {
-        if ((addr == addr_list[i].msg[j].addr) && (msg->bus == addr_list[i].msg[j].bus) &&
-              (length == addr_list[i].msg[j].len)) {
-          addr_list[i].status.index = j;
-          addr_list[i].status.msg_seen = true;
-          break;
+// index of the first rx check lookup entry not before the message
+static int rx_check_lookup_search(int addr, unsigned int bus, int len) {
+  int lo = 0;
+  int hi = rx_check_lookup_len;
+  while (lo < hi) {
+    int mid = lo + ((hi - lo) / 2);
+    const RxCheckLookup *m = &rx_check_lookup[mid];
+    if (msg_less(m->addr, m->bus, m->len, addr, bus, len)) {
+      lo = mid + 1;
+    } else {
+      hi = mid;
+    }
+  }
+  return lo;
+}
+
+// index of the first tx msg lookup entry not before the message
+static int tx_msg_lookup_search(int addr, unsigned int bus, int len) {
+  int lo = 0;
+  int hi = tx_msg_lookup_len;
+  while (lo < hi) {
+    int mid = lo + ((hi - lo) / 2);
+    const CanMsg *m = &tx_msg_lookup[mid];
+    if (msg_less(m->addr, m->bus, m->len, addr, bus, len)) {
+      lo = mid + 1;
+    } else {
+      hi = mid;
+    }
+  }
+  return lo;
+}
+
+// fills the lookup tables from a safety config, returns false if they are too small for it
+static bool build_msg_lookups(const safety_config *cfg) {
+  bool valid = (cfg->rx_checks_len <= MAX_RX_CHECKS) && (cfg->tx_msgs_len <= MAX_TX_MSGS);
+  rx_check_lookup_len = 0;
+  tx_msg_lookup_len = 0;
+
+  if (valid) {
+    // insertion sorts, keeping messages with the same address, bus and length in config order
+    for (int i = 0; i < cfg->rx_checks_len; i++) {
+      for (int j = 0; (j < (int)MAX_ADDR_CHECK_MSGS) && (cfg->rx_checks[i].msg[j].addr != 0); j++) {
+        const CanMsgCheck *m = &cfg->rx_checks[i].msg[j];
+        int k = rx_check_lookup_len;
+        while ((k > 0) && msg_less(m->addr, m->bus, m->len, rx_check_lookup[k - 1].addr, rx_check_lookup[k - 1].bus, rx_check_lookup[k - 1].len)) {
+          rx_check_lookup[k] = rx_check_lookup[k - 1];
+          k--;
         }
+        rx_check_lookup[k] = (RxCheckLookup){m->addr, m->bus, m->len, i, j};
+        rx_check_lookup_len++;
       }
     }
 
-    if (addr_list[i].status.msg_seen) {
-      int idx = addr_list[i].status.index;
-      if ((addr == addr_list[i].msg[idx].addr) && (msg->bus == addr_list[i].msg[idx].bus) &&
-          (length == addr_list[i].msg[idx].len)) {
-        index = i;
-        break;
+    for (int i = 0; i < cfg->tx_msgs_len; i++) {
+      const CanMsg *m = &cfg->tx_msgs[i];
+      int k = tx_msg_lookup_len;
+      while ((k > 0) && msg_less(m->addr, m->bus, m->len, tx_msg_lookup[k - 1].addr, tx_msg_lookup[k - 1].bus, tx_msg_lookup[k - 1].len)) {
+        tx_msg_lookup[k] = tx_msg_lookup[k - 1];
+        k--;
       }
+      tx_msg_lookup[k] = *m;
+      tx_msg_lookup_len++;
+    }
+  }
+  return valid;
+}
+
+// true if a tx msg with this address on this bus is checked for relay malfunctions.
+// with static_blocking, only those that aren't left to the safety mode to block
+static bool is_relay_checked(int addr, unsigned int bus, bool static_blocking) {
+  bool checked = false;
+  int k = tx_msg_lookup_search(addr, bus, -1);
+  while (!checked && (k < tx_msg_lookup_len) && (tx_msg_lookup[k].addr == addr) && (tx_msg_lookup[k].bus == bus)) {
+    checked = tx_msg_lookup[k].check_relay && !(static_blocking && tx_msg_lookup[k].disable_static_blocking);
+    k++;
+  }
+  return checked;
+}
+
+static int get_addr_check_index(const CANPacket_t *msg, RxCheck addr_list[]) {
+  const int addr = msg->addr;
+  const unsigned int bus = msg->bus;
+  const int length = GET_LEN(msg);
+
+  // the entries of this message are in rx check order, so the first rx check it matches wins
+  int index = -1;
+  int k = rx_check_lookup_search(addr, bus, length);
+  while ((index == -1) && (k < rx_check_lookup_len) && (rx_check_lookup[k].addr == addr) && (rx_check_lookup[k].bus == bus) &&
+         (rx_check_lookup[k].len == length)) {
+    RxStatus *status = &addr_list[rx_check_lookup[k].check].status;
+    // if multiple msgs are allowed, determine which one is present on the bus
+    if (!status->msg_seen) {
+      status->index = rx_check_lookup[k].msg;
+      status->msg_seen = true;
     }
+
+    if (status->index == rx_check_lookup[k].msg) {
+      index = rx_check_lookup[k].check;
+    }
+    k++;
   }
   return index;
 }
@@ -156,10 +250,10 @@ static void update_counter(RxCheck addr_list[], int index, uint8_t counter) {
 }
 
 static bool rx_msg_safety_check(const CANPacket_t *msg,
+                                int index,
                                 const safety_config *cfg,
                                 const safety_hooks *safety_hooks) {
 
-  int index = get_addr_check_index(msg, cfg->rx_checks, cfg->rx_checks_len);
   update_addr_timestamp(cfg->rx_checks, index);
 
   if (index != -1) {
@@ -193,8 +287,9 @@ static bool rx_msg_safety_check(const CANPacket_t *msg,
 bool safety_rx_hook(const CANPacket_t *msg) {
   bool controls_allowed_prev = controls_allowed;
 
-  bool valid = rx_msg_safety_check(msg, &current_safety_config, current_hooks);
-  bool whitelisted = get_addr_check_index(msg, current_safety_config.rx_checks, current_safety_config.rx_checks_len) != -1;
+  int index = get_addr_check_index(msg, current_safety_config.rx_checks);
+  bool valid = rx_msg_safety_check(msg, index, &current_safety_config, current_hooks);
+  bool whitelisted = index != -1;
   if (valid && whitelisted) {
     current_hooks->rx(msg);
   }
@@ -205,13 +300,7 @@ bool safety_rx_hook(const CANPacket_t *msg) {
   // the relay malfunction hook runs on all incoming rx messages.
   // check all applicable tx msgs for liveness on sending bus.
   // used to detect a relay malfunction or control messages from disabled ECUs like the radar
-  const int addr = msg->addr;
-  for (int i = 0; i < current_safety_config.tx_msgs_len; i++) {
-    const CanMsg *m = &current_safety_config.tx_msgs[i];
-    if (m->check_relay) {
-      stock_ecu_check((m->addr == addr) && (m->bus == msg->bus));
-    }
-  }
+  stock_ecu_check(is_relay_checked(msg->addr, msg->bus, false));
 
   // reset mismatches on rising edge of controls_allowed to avoid rare race condition
   if (controls_allowed && !controls_allowed_prev) {
@@ -221,22 +310,16 @@ bool safety_rx_hook(const CANPacket_t *msg) {
   return valid;
 }
 
-static bool tx_msg_safety_check(const CANPacket_t *msg, const CanMsg msg_list[], int len) {
+static bool tx_msg_safety_check(const CANPacket_t *msg) {
   int addr = msg->addr;
   int length = GET_LEN(msg);
 
-  bool whitelisted = false;
-  for (int i = 0; i < len; i++) {
-    if ((addr == msg_list[i].addr) && (msg->bus == msg_list[i].bus) && (length == msg_list[i].len)) {
-      whitelisted = true;
-      break;
-    }
-  }
-  return whitelisted;
+  int k = tx_msg_lookup_search(addr, msg->bus, length);
+  return (k < tx_msg_lookup_len) && (tx_msg_lookup[k].addr == addr) && (tx_msg_lookup[k].bus == msg->bus) && (tx_msg_lookup[k].len == length);
 }
 
 bool safety_tx_hook(CANPacket_t *msg) {
-  bool whitelisted = tx_msg_safety_check(msg, current_safety_config.tx_msgs, current_safety_config.tx_msgs_len);
+  bool whitelisted = tx_msg_safety_check(msg);
   if ((current_safety_mode == SAFETY_ALLOUTPUT) || (current_safety_mode == SAFETY_ELM327)) {
     whitelisted = true;
   }
@@ -267,14 +350,8 @@ int safety_fwd_hook(int bus_num, int addr) {
   // Block messages that are being checked for relay malfunctions. Safety modes can opt out of this
   // in the case of selective AEB forwarding
   const int destination_bus = get_fwd_bus(bus_num);
-  if (!blocked) {
-    for (int i = 0; i < current_safety_config.tx_msgs_len; i++) {
-      const CanMsg *m = &current_safety_config.tx_msgs[i];
-      if (m->check_relay && !m->disable_static_blocking && (m->addr == addr) && (m->bus == (unsigned int)destination_bus)) {
-        blocked = true;
-        break;
-      }
-    }
+  if (!blocked && (destination_bus != -1)) {
+    blocked = is_relay_checked(addr, (unsigned int)destination_bus, true);
   }
 
   if (!blocked && (current_hooks->fwd != NULL)) {
@@ -496,7 +573,8 @@ int set_safety_hooks(uint16_t mode, uint16_t param) {
       current_safety_config.rx_checks[j].status = (RxStatus){0};
     }
   }
-  return set_status;
+  // nothing is whitelisted if the lookups don't fit the config
+  return build_msg_lookups(&current_safety_config) ? set_status : -1;
 }
 
 // convert a trimmed integer to signed 32 bit int
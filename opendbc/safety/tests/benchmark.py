@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Safety hook throughput of each libsafety build profile.
+
+  python -m opendbc.safety.tests.benchmark
+  python -m opendbc.safety.tests.benchmark --profile replay --brand toyota --frames 3000 --json out.json
+
+Replays the traffic of a platform per brand through its safety mode, like safety replay does: the messages the car
+interface parses through safety_fwd_hook and safety_rx_hook, and the messages its CarController sends through
+safety_tx_hook, with a safety tick per 100Hz frame. Each profile runs the traffic twice: a cffi call per hook, and all of
+it in one safety_replay_batch call. Packets are made up front, so only the hooks are timed.
+"""
+import argparse
+import json
+import sys
+import time
+from collections.abc import Iterable, Iterator
+
+from opendbc.can.tests.benchmark import BRAND_PLATFORMS, _car_interface, _traffic
+from opendbc.car import DT_CTRL, structs
+from opendbc.safety.tests.libsafety import libsafety_py
+from opendbc.safety.tests.libsafety.libsafety_py import ffi, make_CANPacket, make_packets, replay_batch
+
+Metrics = dict[str, float]
+
+DEFAULT_PROFILES = ("debug-coverage", "replay")
+BATCH_RUNS = 5
+
+
+def _safety_traffic(brand: str, frames: int):
+  """(mode, param, [(timer_us, rx frames, tx frames)]) of a brand's platform"""
+  CC = structs.CarControl()
+  CC.enabled = CC.latActive = CC.longActive = True
+  CC = CC.as_reader()
+
+  CI = _car_interface(BRAND_PLATFORMS[brand])
+  # car states add most of their messages on first access
+  CI.update([])
+  CI.update([])
+  safety_config = CI.CP.safetyConfigs[-1]
+
+  traffic = []
+  for t, msgs in _traffic(CI.can_parsers, frames):
+    # like safety replay, skip the frames the panda echoes back
+    traffic.append((t // 1000, [m for m in msgs if m[2] < 128], CI.apply(CC, t)[1]))
+  return safety_config.safetyModel.raw, safety_config.safetyParam, traffic
+
+
+def _batch(traffic):
+  """traffic as safety_replay_batch events: a tick per 100Hz frame, then its rx and tx frames"""
+  events = []
+  for timer, rx, tx in traffic:
+    events.append((timer, libsafety_py.EVENT_TICK, 0, b"", 0))
+    events += [(timer, libsafety_py.EVENT_RX, addr, dat, bus) for addr, dat, bus in rx]
+    events += [(timer, libsafety_py.EVENT_TX, addr, dat, bus) for addr, dat, bus in tx]
+  timestamps, kinds, addresses, dat, buses = zip(*events, strict=True)
+  pkts = make_packets(addresses, buses, [len(d) for d in dat], dat)
+  return pkts, timestamps, kinds
+
+
+def benchmark_profile(safety, mode: int, param: int, traffic) -> Metrics | None:
+  if safety.set_safety_hooks(mode, param) != 0:
+    return None
+  safety.set_controls_allowed(True)
+  packets = [(timer, [(bus, addr, make_CANPacket(addr, bus, dat)) for addr, dat, bus in rx], [make_CANPacket(addr, bus, dat) for addr, dat, bus in tx])
+             for timer, rx, tx in traffic]
+  n = sum(len(rx) + len(tx) for _, rx, tx in traffic)
+
+  # a hook call per frame
+  t1 = time.perf_counter_ns()
+  for timer, rx, tx in packets:
+    safety.set_timer(timer)
+    safety.safety_tick_current_safety_config()
+    for bus, addr, pkt in rx:
+      safety.safety_fwd_hook(bus, addr)
+      safety.safety_rx_hook(pkt)
+    for pkt in tx:
+      safety.safety_tx_hook(pkt)
+  et = time.perf_counter_ns() - t1
+
+  # the same traffic in one safety_replay_batch call, best of a few runs since it's much shorter
+  pkts, timestamps, kinds = _batch(traffic)
+  batch_ets = []
+  for _ in range(BATCH_RUNS):
+    safety.set_safety_hooks(mode, param)
+    safety.set_controls_allowed(True)
+    t1 = time.perf_counter_ns()
+    replay_batch(safety, pkts, timestamps, kinds)
+    batch_ets.append(time.perf_counter_ns() - t1)
+  batch_et = min(batch_ets)
+
+  return {
+    "frames_per_s": n / et * 1e9 if et else 0.,
+    "ns_per_frame": et / max(n, 1),
+    "batch_frames_per_s": n / batch_et * 1e9 if batch_et else 0.,
+    "batch_ns_per_frame": batch_et / max(n, 1),
+  }
+
+
+def run(profiles: Iterable[str] = DEFAULT_PROFILES, brands: Iterable[str] = BRAND_PLATFORMS, frames: int = int(10 / DT_CTRL)) -> dict[str, Metrics]:
+  libs = {profile: ffi.dlopen(libsafety_py.get_libsafety(profile)) for profile in profiles}
+
+  results = {}
+  for brand in brands:
+    mode, param, traffic = _safety_traffic(brand, frames)
+    for profile, safety in libs.items():
+      metrics = benchmark_profile(safety, mode, param, traffic)
+      if metrics is not None:
+        results[f"{profile}/{brand}"] = metrics
+  return results
+
+
+def _iter_table(results: dict[str, Metrics], profiles: list[str]) -> Iterator[str]:
+  # ns per frame of each profile, calling the hooks per frame and batched
+  columns = [(profile, metric) for profile in profiles for metric in ("ns_per_frame", "batch_ns_per_frame")]
+  brands = list(dict.fromkeys(name.split("/", 1)[1] for name in results))
+  yield f"{'ns/frame':<16}" + "".join(f" {profile + (' batch' if metric.startswith('batch') else ''):>22}" for profile, metric in columns) + f" {'speedup':>8}"
+  for brand in brands:
+    ns = [results.get(f"{profile}/{brand}", {}).get(metric, float('nan')) for profile, metric in columns]
+    yield f"{brand:<16}" + "".join(f" {v:>22.1f}" for v in ns) + f" {ns[0] / ns[-1]:>7.1f}x"
+
+
+def main(argv: list[str] | None = None) -> int:
+  parser = argparse.ArgumentParser(description="Benchmark the safety hooks of libsafety build profiles", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--profile", choices=libsafety_py.PROFILES, action="append", help=f"Profile to run, defaults to {DEFAULT_PROFILES}. Can be repeated")
+  parser.add_argument("--brand", choices=BRAND_PLATFORMS, action="append", help="Brand to run, defaults to all. Can be repeated")
+  parser.add_argument("--frames", type=int, default=int(10 / DT_CTRL), help="100Hz frames per brand")
+  parser.add_argument("--json", help="Write results to this file")
+  args = parser.parse_args(argv)
+
+  profiles = args.profile or list(DEFAULT_PROFILES)
+  results = run(profiles, args.brand or BRAND_PLATFORMS, args.frames)
+  for line in _iter_table(results, profiles):
+    print(line)
+
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump({"frames": args.frames, "results": results}, f, indent=2)
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -1,39 +1,99 @@
+import argparse
+import fcntl
+import hashlib
 import os
+import shutil
 import subprocess
 import tempfile
 from pathlib import Path
 
+import numpy as np
 from cffi import FFI
 
-from opendbc.safety import LEN_TO_DLC
+from opendbc.safety import DLC_TO_LEN, LEN_TO_DLC
 
 libsafety_dir = os.path.dirname(os.path.abspath(__file__))
+root = str(Path(libsafety_dir).parents[3])
+safety_c = os.path.join(libsafety_dir, "safety.c")
 
+# Builds are cached here by a hash of their sources and flags. The objects stay next to their coverage
+# notes, so gcovr finds both. Set DISABLE_LIBSAFETY_CACHE=1 to always build.
+BUILD_DIR = os.path.join(libsafety_dir, "build")
+# bump when the build changes in a way the flags don't capture
+CACHE_VERSION = 1
 
-def _build_libsafety(release: bool = False) -> str:
-  """Compile libsafety.so to a temp file and return its path."""
-  root = str(Path(libsafety_dir).parents[3])
-  safety_c = os.path.join(libsafety_dir, "safety.c")
-
-  cflags = [
-    '-Wall', '-Wextra', '-Werror', '-nostdlib', '-fno-builtin',
-    '-std=gnu11', '-Wfatal-errors', '-Wno-pointer-to-int-cast',
-    '-g', '-O0', '-fno-omit-frame-pointer',
-  ]
-  ldflags = [
-    '-fsanitize=undefined', '-fno-sanitize-recover=undefined',
-  ]
-  if not release:
-    cflags += ['-DALLOW_DEBUG', '-fprofile-arcs', '-ftest-coverage']
-    ldflags += ['-fprofile-arcs', '-ftest-coverage']
-
-  fd, safety_os = tempfile.mkstemp(suffix='.os', dir=libsafety_dir)
-  os.close(fd)
-  fd, libsafety_so = tempfile.mkstemp(suffix='.so')
+
+_CFLAGS = ['-Wall', '-Wextra', '-Werror', '-nostdlib', '-fno-builtin', '-std=gnu11', '-Wfatal-errors', '-Wno-pointer-to-int-cast']
+_CHECKED_CFLAGS = ['-g', '-O0', '-fno-omit-frame-pointer']
+_CHECKED_LDFLAGS = ['-fsanitize=undefined', '-fno-sanitize-recover=undefined']
+_COVERAGE_FLAGS = ['-fprofile-arcs', '-ftest-coverage']
+
+# build profile -> (cflags, ldflags)
+PROFILES: dict[str, tuple[list[str], list[str]]] = {
+  # the safety tests: debug-only code paths, with line coverage for test.sh
+  "debug-coverage": (_CFLAGS + _CHECKED_CFLAGS + ['-DALLOW_DEBUG'] + _COVERAGE_FLAGS, _CHECKED_LDFLAGS + _COVERAGE_FLAGS),
+  # the code that runs on the panda
+  "release-checked": (_CFLAGS + _CHECKED_CFLAGS, _CHECKED_LDFLAGS),
+  # throughput for safety replay and benchmarks. Same code paths as debug-coverage, optimized and without instrumentation
+  "replay": (_CFLAGS + ['-O2', '-DALLOW_DEBUG'], []),
+}
+DEFAULT_PROFILE = "debug-coverage"
+
+
+def _build_libsafety(profile: str = DEFAULT_PROFILE, out_dir: str | None = None) -> str:
+  """Compile libsafety.so into out_dir, or a new temp dir, and return its path."""
+  cflags, ldflags = PROFILES[profile]
+  if out_dir is None:
+    out_dir = tempfile.mkdtemp(prefix="libsafety")
+  safety_os = os.path.join(out_dir, "safety.os")
+  fd, libsafety_so = tempfile.mkstemp(suffix='.so', dir=out_dir)
   os.close(fd)
 
   subprocess.check_call(['cc', '-fPIC', *cflags, '-I', root, '-c', safety_c, '-o', safety_os])
   subprocess.check_call(['cc', '-shared', safety_os, '-o', libsafety_so, *ldflags])
+  # atomic, so the library is never seen partially written
+  os.replace(libsafety_so, os.path.join(out_dir, "libsafety.so"))
+  return os.path.join(out_dir, "libsafety.so")
+
+
+def cache_enabled() -> bool:
+  return os.environ.get("DISABLE_LIBSAFETY_CACHE") != "1"
+
+
+def build_key(profile: str = DEFAULT_PROFILE) -> str:
+  """Hash of the profile, flags, compiler, and every header safety.c includes"""
+  cflags, ldflags = PROFILES[profile]
+  h = hashlib.sha256(f"{CACHE_VERSION}\0{profile}\0{cflags}\0{ldflags}\0".encode())
+  h.update(subprocess.check_output(['cc', '--version']))
+  deps = subprocess.check_output(['cc', '-MM', *cflags, '-I', root, safety_c], encoding='utf8', cwd=root)
+  for dep in sorted(set(deps.replace('\\\n', ' ').split()[1:])):
+    h.update(f"{os.path.relpath(os.path.join(root, dep), root)}\0".encode())
+    with open(os.path.join(root, dep), 'rb') as f:
+      h.update(hashlib.sha256(f.read()).digest())
+  return h.hexdigest()
+
+
+def get_libsafety(profile: str = DEFAULT_PROFILE) -> str:
+  """Path to a libsafety.so of the profile for the current sources, built once and shared between processes."""
+  if not cache_enabled():
+    return _build_libsafety(profile)
+
+  name = f"{profile}-{build_key(profile)[:16]}"
+  out_dir = os.path.join(BUILD_DIR, name)
+  libsafety_so = os.path.join(out_dir, "libsafety.so")
+  if os.path.exists(libsafety_so):
+    return libsafety_so
+
+  try:
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(BUILD_DIR, f"{name}.lock"), "w") as lock:
+      # concurrent builders of the same key wait for the first one
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      if not os.path.exists(libsafety_so):
+        _build_libsafety(profile, out_dir)
+  except OSError:
+    # read-only tree, just build every time
+    return _build_libsafety(profile)
   return libsafety_so
 
 
@@ -120,6 +180,22 @@ int mutation_get_active_mutant(void);
 void ignition_can_hook(const CANPacket_t *msg);
 bool get_ignition_can(void);
 void set_ignition_can(bool c);
+
+typedef struct {
+  uint32_t rx_total;
+  uint32_t rx_invalid;
+  uint32_t tx_total;
+  uint32_t tx_blocked;
+  uint32_t tx_controls;
+  uint32_t tx_controls_blocked;
+  uint32_t ticks;
+  uint32_t ticks_invalid;
+} SafetyReplayStats;
+
+int get_can_packet_size(void);
+// pkts is a CANPacket_t array, but CANPacket_t is aligned(4) in C which cffi can't express. Make it with make_packets
+void safety_replay_batch(void *pkts, const uint32_t *timestamps, const uint8_t *kinds, const uint8_t *fwd_buses, int n, uint8_t *verdicts,
+                         SafetyReplayStats *stats);
 """)
 
 class LibSafety:
@@ -130,9 +206,14 @@ def load(path):
   global libsafety
   libsafety = ffi.dlopen(str(path))
 
+def load_profile(profile: str) -> LibSafety:
+  """Loads a build profile as libsafety, instead of the default debug-coverage"""
+  load(get_libsafety(profile))
+  return libsafety
+
 def __getattr__(name):
   if name == "libsafety":
-    load(_build_libsafety())
+    load(get_libsafety())
     return libsafety
   raise AttributeError(name)
 
@@ -144,3 +225,65 @@ def make_CANPacket(addr: int, bus: int, dat):
   ret[0].bus = bus
   ret[0].data = bytes(dat)
   return ret
+
+
+# event kinds of safety_replay_batch
+EVENT_RX, EVENT_TX, EVENT_TICK = 0, 1, 2
+
+# CANPacket_t as laid out in C: fd:1, bus:3 and data_len_code:4 in head, then rejected:1, returned:1, extended:1 and addr:29 in addr
+PACKET_DTYPE = np.dtype({"names": ["head", "addr", "checksum", "data"], "formats": ["u1", "<u4", "u1", ("u1", (64,))],
+                         "offsets": [0, 1, 5, 6], "itemsize": 72})
+_LEN_TO_DLC = np.array([LEN_TO_DLC[min(length for length in DLC_TO_LEN if length >= i)] for i in range(65)], dtype=np.uint8)
+
+
+def make_packets(addresses, buses, lens, dat) -> np.ndarray:
+  """A contiguous CANPacket_t array for safety_replay_batch, like make_CANPacket for each frame.
+     dat is a list of payloads, or a (frames, width) payload matrix like the columns of opendbc.car.can_frames:
+
+       make_packets(frames["address"], frames["bus"], frames["dlc"], frames["dat"])
+  """
+  addresses = np.asarray(addresses, dtype=np.uint32)
+  if not isinstance(dat, np.ndarray):
+    dat = np.frombuffer(b"".join(bytes(d).ljust(64, b"\x00") for d in dat), dtype=np.uint8).reshape(-1, 64)
+  pkts: np.ndarray = np.zeros(len(addresses), dtype=PACKET_DTYPE)
+  pkts["head"] = ((np.asarray(buses, dtype=np.uint8) & 0x7) << 1) | (_LEN_TO_DLC[np.asarray(lens, dtype=np.intp)] << 4)
+  pkts["addr"] = (addresses << 3) | ((addresses >= 0x800).astype(np.uint32) << 2)
+  pkts["data"][:, :dat.shape[1]] = dat
+  return pkts
+
+
+def replay_batch(safety: LibSafety, pkts: np.ndarray, timestamps, kinds, fwd_buses=None) -> tuple[np.ndarray, dict[str, int]]:
+  """Runs rx, tx and tick events through the current safety mode in one call. Returns each event's verdict and the totals.
+     rx messages are forwarded on fwd_buses, defaulting to their packet's bus"""
+  assert pkts.dtype == PACKET_DTYPE and PACKET_DTYPE.itemsize == safety.get_can_packet_size()
+  pkts = np.ascontiguousarray(pkts)
+  timestamps = np.ascontiguousarray(timestamps, dtype=np.uint32)
+  kinds = np.ascontiguousarray(kinds, dtype=np.uint8)
+  assert len(pkts) == len(timestamps) == len(kinds)
+  if fwd_buses is not None:
+    fwd_buses = np.ascontiguousarray(fwd_buses, dtype=np.uint8)
+    assert len(fwd_buses) == len(pkts)
+
+  verdicts = np.zeros(len(pkts), dtype=np.uint8)
+  stats = ffi.new("SafetyReplayStats *")
+  safety.safety_replay_batch(ffi.from_buffer(pkts, require_writable=True), ffi.from_buffer("uint32_t[]", timestamps), ffi.from_buffer("uint8_t[]", kinds),
+                             ffi.NULL if fwd_buses is None else ffi.from_buffer("uint8_t[]", fwd_buses), len(pkts),
+                             ffi.from_buffer("uint8_t[]", verdicts, require_writable=True), stats)
+  return verdicts.astype(bool), {field: getattr(stats, field) for field, _ in ffi.typeof("SafetyReplayStats").fields}
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Prebuild the cached libsafety profiles", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--clear", action="store_true", help="Delete the build cache first")
+  parser.add_argument("--profile", choices=PROFILES, action="append", help="Profile to build, defaults to all. Can be repeated")
+  args = parser.parse_args()
+
+  if args.clear:
+    shutil.rmtree(BUILD_DIR, ignore_errors=True)
+    print(f"Cleared {BUILD_DIR}")
+  for profile in args.profile or PROFILES:
+    print(f"{profile}: {get_libsafety(profile)}")
+
+
+if __name__ == "__main__":
+  main()
@@ -34,6 +34,58 @@ bool safety_config_valid() {
   return true;
 }
 
+// ***** batched replay *****
+
+#define SAFETY_EVENT_RX 0U
+#define SAFETY_EVENT_TX 1U
+#define SAFETY_EVENT_TICK 2U
+
+typedef struct {
+  uint32_t rx_total;
+  uint32_t rx_invalid;
+  uint32_t tx_total;
+  uint32_t tx_blocked;
+  uint32_t tx_controls;
+  uint32_t tx_controls_blocked;
+  uint32_t ticks;
+  uint32_t ticks_invalid;
+} SafetyReplayStats;
+
+int get_can_packet_size(void) {
+  return sizeof(CANPacket_t);
+}
+
+// runs n events through the current safety mode, like one safety_*_hook call each, at timestamps[i] microseconds.
+// rx messages are forwarded on fwd_buses[i], or on their packet's bus if fwd_buses is NULL.
+// verdicts[i] is whether the rx message was valid, the tx message was allowed, or the safety config was valid after the tick.
+// stats accumulate across calls
+void safety_replay_batch(CANPacket_t *pkts, const uint32_t *timestamps, const uint8_t *kinds, const uint8_t *fwd_buses, int n, uint8_t *verdicts,
+                         SafetyReplayStats *stats) {
+  for (int i = 0; i < n; i++) {
+    CANPacket_t *pkt = &pkts[i];
+    bool verdict;
+    timer_cnt = timestamps[i];
+    if (kinds[i] == SAFETY_EVENT_RX) {
+      (void)safety_fwd_hook((fwd_buses != NULL) ? fwd_buses[i] : pkt->bus, pkt->addr);
+      verdict = safety_rx_hook(pkt);
+      stats->rx_total++;
+      stats->rx_invalid += verdict ? 0U : 1U;
+    } else if (kinds[i] == SAFETY_EVENT_TX) {
+      verdict = safety_tx_hook(pkt);
+      stats->tx_total++;
+      stats->tx_blocked += verdict ? 0U : 1U;
+      stats->tx_controls += controls_allowed ? 1U : 0U;
+      stats->tx_controls_blocked += (!verdict && controls_allowed) ? 1U : 0U;
+    } else {
+      safety_tick(&current_safety_config);
+      verdict = safety_config_valid();
+      stats->ticks++;
+      stats->ticks_invalid += verdict ? 0U : 1U;
+    }
+    verdicts[i] = verdict ? 1U : 0U;
+  }
+}
+
 void set_controls_allowed(bool c){
   controls_allowed = c;
 }
@@ -1,62 +1,89 @@
 #!/usr/bin/env python3
 import argparse
 from collections import Counter
+import numpy as np
 from tqdm import tqdm
 
+from opendbc.car.can_frames import read_can_frames
 from opendbc.car.carlog import carlog
+from opendbc.car.logreader import LogReader
 from opendbc.safety.tests.libsafety import libsafety_py
-from opendbc.safety.tests.safety_replay.helpers import package_can_msg, init_segment
+from opendbc.safety.tests.libsafety.libsafety_py import EVENT_RX, EVENT_TICK, EVENT_TX
+from opendbc.safety.tests.safety_replay.helpers import init_segment
+
+CHUNK_EVENTS = 1 << 12  # log events replayed per replay_batch call
+
+
+def log_events(fn):
+  """The can and sendcan frames of a log by event kind, and the events of both in time order as (mono_time, kind, start, end) columns,
+     where start:end are the event's rows in its frames"""
+  frames, columns = {}, []
+  for kind, msg_type in ((EVENT_RX, "can"), (EVENT_TX, "sendcan")):
+    frames[kind], events = read_can_frames(fn, msg_type)
+    starts = events["start"].astype(np.int64)
+    columns.append((events["mono_time"], np.full(len(events), kind, dtype=np.uint8), starts, np.append(starts[1:], len(frames[kind]))))
+  mono_times, kinds, starts, ends = (np.concatenate(c) for c in zip(*columns, strict=True))
+  order = np.argsort(mono_times, kind="stable")
+  return frames, mono_times[order], kinds[order], starts[order], ends[order]
 
 
 # replay a drive to check for safety violations
-def replay_drive(msgs, safety_mode, param, alternative_experience):
+def replay_drive(fn, safety_mode, param, alternative_experience):
   safety = libsafety_py.libsafety
-  msgs.sort(key=lambda m: m.logMonoTime)
 
   err = safety.set_safety_hooks(safety_mode, param)
   assert err == 0, "invalid safety mode: %d" % safety_mode
   safety.set_alternative_experience(alternative_experience)
 
-  init_segment(safety, msgs, safety_mode, param)
+  init_segment(safety, LogReader(fn, only_union_types=True, sort_by_time=True, streaming=True), safety_mode, param)
 
-  rx_tot, rx_invalid, tx_tot, tx_blocked, tx_controls, tx_controls_blocked = 0, 0, 0, 0, 0, 0
-  safety_tick_rx_invalid = False
+  frames, mono_times, kinds, starts, ends = log_events(fn)
+  start_t = mono_times[0]
+  end_t = mono_times[-1]
+  # skip start and end of route, warm up/down period
+  ticks = ((mono_times - start_t > 1e9) & (end_t - mono_times > 1e9)).astype(np.int64)
+
+  stats = Counter()
   blocked_addrs = Counter()
   invalid_addrs = set()
-
-  can_msgs = [m for m in msgs if m.which() in ('can', 'sendcan')]
-  start_t = can_msgs[0].logMonoTime
-  end_t = can_msgs[-1].logMonoTime
-  for msg in tqdm(can_msgs):
-    safety.set_timer((msg.logMonoTime // 1000) % 0xFFFFFFFF)
-
-    # skip start and end of route, warm up/down period
-    if msg.logMonoTime - start_t > 1e9 and end_t - msg.logMonoTime > 1e9:
-      safety.safety_tick_current_safety_config()
-      safety_tick_rx_invalid |= not safety.safety_config_valid() or safety_tick_rx_invalid
-
-    if msg.which() == 'sendcan':
-      for canmsg in msg.sendcan:
-        _msg = package_can_msg(canmsg)
-        sent = safety.safety_tx_hook(_msg)
-        if not sent:
-          tx_blocked += 1
-          tx_controls_blocked += safety.get_controls_allowed()
-          blocked_addrs[canmsg.address] += 1
-
-          carlog.debug("blocked bus %d msg %d at %f" % (canmsg.src, canmsg.address, (msg.logMonoTime - start_t) / 1e9))
-        tx_controls += safety.get_controls_allowed()
-        tx_tot += 1
-    elif msg.which() == 'can':
-      # ignore msgs we sent
-      for canmsg in filter(lambda m: m.src < 128, msg.can):
-        safety.safety_fwd_hook(canmsg.src, canmsg.address)
-        _msg = package_can_msg(canmsg)
-        recv = safety.safety_rx_hook(_msg)
-        if not recv:
-          rx_invalid += 1
-          invalid_addrs.add(canmsg.address)
-        rx_tot += 1
+  with tqdm(total=len(mono_times)) as pbar:
+    for chunk in range(0, len(mono_times), CHUNK_EVENTS):
+      events = slice(chunk, chunk + CHUNK_EVENTS)
+      # a row per tick and frame: each event's tick, then its frames
+      counts = ticks[events] + ends[events] - starts[events]
+      event = np.repeat(np.arange(len(counts)), counts)
+      offset = np.arange(len(event)) - np.repeat(np.cumsum(counts) - counts, counts)
+      tick = ticks[events][event]
+      row_kinds = np.where((tick == 1) & (offset == 0), EVENT_TICK, kinds[events][event]).astype(np.uint8)
+      rows = starts[events][event] + offset - tick
+
+      pkts = np.zeros(len(event), dtype=libsafety_py.PACKET_DTYPE)
+      addresses = np.zeros(len(event), dtype=np.uint32)
+      buses = np.zeros(len(event), dtype=np.uint8)
+      for kind, kind_frames in frames.items():
+        is_kind = row_kinds == kind
+        f = kind_frames[rows[is_kind]]
+        addresses[is_kind], buses[is_kind] = f["address"], f["bus"]
+        pkts[is_kind] = libsafety_py.make_packets(f["address"], f["bus"] % 4, f["dlc"], f["dat"])
+
+      # ignore msgs we sent. The fwd hook gets the raw bus, the other hooks bus % 4
+      keep = (row_kinds != EVENT_RX) | (buses < 128)
+      row_times = mono_times[events][event][keep]
+      addresses, buses, row_kinds = addresses[keep], buses[keep], row_kinds[keep]
+      verdicts, batch_stats = libsafety_py.replay_batch(safety, pkts[keep], (row_times // 1000) % 0xFFFFFFFF, row_kinds, buses)
+      stats.update(batch_stats)
+
+      for i in np.flatnonzero(~verdicts):
+        if row_kinds[i] == EVENT_TX:
+          blocked_addrs[int(addresses[i])] += 1
+          carlog.debug("blocked bus %d msg %d at %f" % (buses[i], addresses[i], (row_times[i] - start_t) / 1e9))
+        elif row_kinds[i] == EVENT_RX:
+          invalid_addrs.add(int(addresses[i]))
+      pbar.update(len(counts))
+
+  rx_tot, rx_invalid = stats["rx_total"], stats["rx_invalid"]
+  tx_tot, tx_blocked, tx_controls, tx_controls_blocked = stats["tx_total"], stats["tx_blocked"], stats["tx_controls"], stats["tx_controls_blocked"]
+  safety_tick_rx_invalid = stats["ticks_invalid"] > 0
 
   print("\nRX")
   print("total rx msgs:", rx_tot)
@@ -74,20 +101,19 @@ def replay_drive(msgs, safety_mode, param, alternative_experience):
 
 
 if __name__ == "__main__":
-  from openpilot.tools.lib.logreader import LogReader
-
-  parser = argparse.ArgumentParser(description="Replay CAN messages from a route or segment through a safety mode",
+  parser = argparse.ArgumentParser(description="Replay CAN messages from a log through a safety mode",
                                    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-  parser.add_argument("route_or_segment_name", nargs='+')
+  parser.add_argument("log", help="rlog path or URL")
   parser.add_argument("--mode", type=int, help="Override the safety mode from the log")
   parser.add_argument("--param", type=int, help="Override the safety param from the log")
   parser.add_argument("--alternative-experience", type=int, help="Override the alternative experience from the log")
+  parser.add_argument("--profile", default="replay", choices=libsafety_py.PROFILES, help="libsafety build profile")
   args = parser.parse_args()
 
-  lr = LogReader(args.route_or_segment_name[0])
+  libsafety_py.load_profile(args.profile)
 
   if None in (args.mode, args.param, args.alternative_experience):
-    CP = lr.first('carParams')
+    CP = LogReader(args.log, streaming=True).first('carParams')
     if args.mode is None:
       args.mode = CP.safetyConfigs[-1].safetyModel.raw
     if args.param is None:
@@ -95,5 +121,5 @@ if __name__ == "__main__":
     if args.alternative_experience is None:
       args.alternative_experience = CP.alternativeExperience
 
-  print(f"replaying {args.route_or_segment_name[0]} with safety mode {args.mode}, param {args.param}, alternative experience {args.alternative_experience}")
-  replay_drive(list(lr), args.mode, args.param, args.alternative_experience)
+  print(f"replaying {args.log} with safety mode {args.mode}, param {args.param}, alternative experience {args.alternative_experience}")
+  replay_drive(args.log, args.mode, args.param, args.alternative_experience)
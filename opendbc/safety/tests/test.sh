@@ -7,7 +7,7 @@ cd $DIR
 source ../../../setup.sh
 
 # reset coverage data
-rm -f ./libsafety/*.gcda
+find ./libsafety -name "*.gcda" -delete
 
 # run safety tests and generate coverage data
 python -m unittest discover -s .
@@ -0,0 +1,16 @@
+import unittest
+
+from opendbc.safety.tests.benchmark import run
+
+
+class TestBenchmark(unittest.TestCase):
+  def test_run(self):
+    results = run(["debug-coverage", "replay"], ["toyota", "honda"], frames=10)
+    self.assertEqual(set(results), {"debug-coverage/toyota", "replay/toyota", "debug-coverage/honda", "replay/honda"})
+    for metrics in results.values():
+      self.assertEqual(set(metrics), {"frames_per_s", "ns_per_frame", "batch_frames_per_s", "batch_ns_per_frame"})
+      self.assertTrue(all(v > 0 for v in metrics.values()))
+
+
+if __name__ == "__main__":
+  unittest.main()
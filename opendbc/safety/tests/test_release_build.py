@@ -1,15 +1,41 @@
 #!/usr/bin/env python3
+import os
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
+from opendbc.safety.tests.libsafety import libsafety_py
 from opendbc.safety.tests.libsafety.libsafety_py import _build_libsafety
+from opendbc.testing import parameterized
 
 
 class TestBuild(unittest.TestCase):
-  def test_development_build(self):
-    _build_libsafety(release=False)
+  @parameterized("profile", list(libsafety_py.PROFILES))
+  def test_build(self, profile):
+    with tempfile.TemporaryDirectory() as out_dir:
+      _build_libsafety(profile, out_dir=out_dir)
 
-  def test_release_build(self):
-    _build_libsafety(release=True)
+  def test_build_cache(self):
+    with tempfile.TemporaryDirectory() as build_dir, mock.patch.object(libsafety_py, "BUILD_DIR", build_dir), \
+         mock.patch.object(libsafety_py, "_build_libsafety", wraps=libsafety_py._build_libsafety) as build:
+      # concurrent builders wait for one build
+      with ThreadPoolExecutor(4) as pool:
+        paths = set(pool.map(lambda _: libsafety_py.get_libsafety("release-checked"), range(4)))
+      self.assertEqual(build.call_count, 1)
+      self.assertEqual(len(paths), 1)
+      self.assertTrue(os.path.exists(paths.pop()))
+
+      # keyed by profile
+      self.assertEqual(len({libsafety_py.build_key(profile) for profile in libsafety_py.PROFILES}), len(libsafety_py.PROFILES))
+      libsafety_py.get_libsafety("release-checked")
+      self.assertEqual(build.call_count, 1)
+
+      with mock.patch.dict(os.environ, {"DISABLE_LIBSAFETY_CACHE": "0"}):
+        self.assertTrue(libsafety_py.cache_enabled())
+      with mock.patch.dict(os.environ, {"DISABLE_LIBSAFETY_CACHE": "1"}):
+        self.assertFalse(libsafety_py.get_libsafety("release-checked").startswith(build_dir))
+      self.assertEqual(build.call_count, 2)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,73 @@
+import unittest
+
+import numpy as np
+
+from opendbc.safety.tests.benchmark import _batch, _safety_traffic
+from opendbc.safety.tests.libsafety import libsafety_py
+from opendbc.safety.tests.libsafety.libsafety_py import EVENT_RX, EVENT_TICK, EVENT_TX, ffi, make_CANPacket, make_packets, replay_batch
+
+
+class TestReplayBatch(unittest.TestCase):
+  def setUp(self):
+    self.safety = libsafety_py.libsafety
+    self.safety.init_tests()
+
+  def test_make_packets(self):
+    frames = [(0x123, 1, b"\x01\x02\x03"), (0x7FF, 0, bytes(range(8))), (0x800, 2, b""), (0x18DAF110, 3, bytes(range(12))), (0x1FFFFFFF, 7, bytes(64))]
+    pkts = make_packets(*zip(*[(addr, bus, len(dat), dat) for addr, bus, dat in frames], strict=True))
+    self.assertEqual(pkts.itemsize, self.safety.get_can_packet_size())
+    for pkt, (addr, bus, dat) in zip(pkts, frames, strict=True):
+      self.assertEqual(pkt.tobytes()[:ffi.sizeof("CANPacket_t")], bytes(ffi.buffer(make_CANPacket(addr, bus, dat))))
+
+    # same as a payload matrix
+    dat = np.zeros((len(frames), 12), dtype=np.uint8)
+    dat[0, :3] = [1, 2, 3]
+    dat[1, :8] = range(8)
+    dat[3] = range(12)
+    self.assertTrue(np.array_equal(make_packets([f[0] for f in frames[:4]], [f[1] for f in frames[:4]], [3, 8, 0, 12], dat[:4]), pkts[:4]))
+
+  def test_same_as_hooks(self):
+    for brand in ("toyota", "honda", "hyundai_canfd"):
+      with self.subTest(brand=brand):
+        mode, param, traffic = _safety_traffic(brand, 200)
+        # blocked and invalid messages too
+        traffic[50][1][:] = [(addr, bytes(b ^ 0xFF for b in dat), bus) for addr, dat, bus in traffic[50][1]]
+        traffic[60][2].append((0x1FF, b"\x00" * 8, 0))
+
+        expected, tx_controls = [], 0
+        self.assertEqual(self.safety.set_safety_hooks(mode, param), 0)
+        for i, (timer, rx, tx) in enumerate(traffic):
+          self.safety.set_controls_allowed(i >= 100)
+          self.safety.set_timer(timer)
+          self.safety.safety_tick_current_safety_config()
+          expected.append(self.safety.safety_config_valid())
+          for addr, dat, bus in rx:
+            self.safety.safety_fwd_hook(bus, addr)
+            expected.append(self.safety.safety_rx_hook(make_CANPacket(addr, bus, dat)))
+          for addr, dat, bus in tx:
+            expected.append(self.safety.safety_tx_hook(make_CANPacket(addr, bus, dat)))
+            tx_controls += self.safety.get_controls_allowed()
+
+        self.assertEqual(self.safety.set_safety_hooks(mode, param), 0)
+        pkts, timestamps, kinds = _batch(traffic)
+        kinds = np.array(kinds)
+        ticks = np.flatnonzero(kinds == EVENT_TICK)
+        verdicts, stats = replay_batch(self.safety, pkts[:ticks[100]], timestamps[:ticks[100]], kinds[:ticks[100]])
+        self.safety.set_controls_allowed(True)
+        more_verdicts, more_stats = replay_batch(self.safety, pkts[ticks[100]:], timestamps[ticks[100]:], kinds[ticks[100]:])
+        verdicts = np.concatenate([verdicts, more_verdicts])
+        stats = {k: v + more_stats[k] for k, v in stats.items()}
+
+        self.assertEqual(verdicts.tolist(), expected)
+        self.assertGreater(stats["tx_blocked"], 0)
+        self.assertGreater(stats["rx_invalid"], 0)
+        self.assertEqual(stats["rx_total"], np.sum(kinds == EVENT_RX))
+        self.assertEqual(stats["tx_total"], np.sum(kinds == EVENT_TX))
+        self.assertEqual(stats["ticks"], len(ticks))
+        self.assertEqual(stats["rx_invalid"], np.sum(~verdicts[kinds == EVENT_RX]))
+        self.assertEqual(stats["tx_blocked"], np.sum(~verdicts[kinds == EVENT_TX]))
+        self.assertEqual(stats["tx_controls"], tx_controls)
+
+
+if __name__ == "__main__":
+  unittest.main()